@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from sqlalchemy import select, update, bindparam, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, Alert, AlertStatus, AlertType, Ingredient
+
+logger = logging.getLogger(__name__)
+
+ALERT_COALESCE_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS", "60"))
+ALERT_FLUSH_SECONDS = float(os.getenv("ALERT_FLUSH_SECONDS", "5"))
+
+# Must match the predicate of the uq_alerts_open partial index.
+OPEN_PREDICATE = text("status = 'OPEN'")
+# Key in ``Session.info`` for in-memory updates waiting on the transaction to commit.
+PENDING_EFFECTS = "alert_pipeline_effects"
+ALERT_COLUMNS = (Alert.id, Alert.ingredient_id, Alert.alert_type, Alert.message, Alert.status, Alert.occurrences, Alert.created_at, Alert.last_seen_at)
+
+
+class OpenAlert:
+    __slots__ = ("id", "written_at", "pending", "last_seen")
+
+    def __init__(self, alert_id, written_at):
+        self.id = alert_id
+        self.written_at = written_at
+        self.pending = 0
+        self.last_seen = None
+
+
+class AlertPipeline:
+    """De-duplicates alerts per (ingredient, type) and coalesces repeats.
+
+    The table holds at most one open alert per key. The first occurrence is
+    upserted immediately; repeats within ``window`` seconds only bump an
+    in-memory counter, which ``flush`` writes for all keys in one batch.
+    """
+
+    def __init__(self, window: float = ALERT_COALESCE_SECONDS, flush_interval: float = ALERT_FLUSH_SECONDS):
+        self.window = window
+        self.flush_interval = flush_interval
+        self.open = {}
+        self.writes = 0
+        self.coalesced = 0
+        self._flusher = None
+
+    async def raise_alert(self, db: AsyncSession, ingredient_id: int, alert_type: AlertType, message: str):
+        """Record one occurrence. Returns the alert row when it was written, or None when coalesced.
+
+        The in-memory state only changes once the caller has committed ``db``
+        and called ``committed``, so a rolled-back transaction leaves no trace.
+        """
+        key = (ingredient_id, alert_type)
+        entry = self.open.get(key)
+        now = time.monotonic()
+        if entry and now - entry.written_at < self.window:
+            seen = datetime.now()
+
+            def repeated():
+                entry.pending += 1
+                entry.last_seen = seen
+                self.coalesced += 1
+            db.info.setdefault(PENDING_EFFECTS, []).append(repeated)
+            return None
+        seen = datetime.now()
+        included = entry.pending if entry else 0
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(Alert).values(
+            ingredient_id=ingredient_id, alert_type=alert_type, message=message, status=AlertStatus.OPEN,
+            occurrences=1 + included, created_at=seen, updated_at=seen, last_seen_at=seen,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Alert.ingredient_id, Alert.alert_type],
+            index_where=OPEN_PREDICATE,
+            set_={
+                "occurrences": Alert.occurrences + stmt.excluded.occurrences,
+                "message": stmt.excluded.message,
+                "last_seen_at": stmt.excluded.last_seen_at,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        row = (await db.execute(stmt.returning(*ALERT_COLUMNS))).one()
+
+        def written():
+            fresh = OpenAlert(row.id, now)
+            if entry:
+                # Repeats counted after this write still have to be flushed.
+                fresh.pending, fresh.last_seen = entry.pending - included, entry.last_seen
+            self.open[key] = fresh
+            self.writes += 1
+        db.info.setdefault(PENDING_EFFECTS, []).append(written)
+        return row
+
+    def committed(self, db: AsyncSession):
+        """Apply the bookkeeping of alerts raised in ``db``'s transaction; call right after it commits."""
+        for effect in db.info.pop(PENDING_EFFECTS, []):
+            effect()
+
+    def track(self, rows):
+        """Remember alerts created elsewhere (the set-based sweep) so their repeats coalesce too."""
+        now = time.monotonic()
+        for row in rows:
+            self.open[(row.ingredient_id, row.alert_type)] = OpenAlert(row.id, now)
+
+    async def resolve(self, db: AsyncSession, ingredient_ids):
+        """Resolve open LOW_STOCK alerts for ``ingredient_ids`` that are back at or above their minimum."""
+        if not ingredient_ids:
+            return []
+        now = datetime.now()
+        replenished = select(Ingredient.id).where(Ingredient.id.in_(list(ingredient_ids)), Ingredient.quantity_grams >= Ingredient.minimum_quantity)
+        rows = (await db.execute(
+            update(Alert)
+            .where(Alert.status == AlertStatus.OPEN, Alert.alert_type == AlertType.LOW_STOCK, Alert.ingredient_id.in_(replenished))
+            .values(status=AlertStatus.RESOLVED, resolved_at=now, updated_at=now)
+            .returning(*ALERT_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )).all()
+        for row in rows:
+            self.open.pop((row.ingredient_id, row.alert_type), None)
+        return rows
+
+    async def flush(self):
+        """Write the coalesced counters in one batch and forget keys whose window has passed."""
+        due = [(entry, entry.pending) for entry in self.open.values() if entry.pending]
+        rows = []
+        if due:
+            table = Alert.__table__
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("alert_id"), OPEN_PREDICATE)
+                    .values(occurrences=table.c.occurrences + bindparam("repeats"), last_seen_at=bindparam("seen"), updated_at=bindparam("seen")),
+                    [{"alert_id": entry.id, "repeats": repeats, "seen": entry.last_seen} for entry, repeats in due],
+                )
+                rows = (await db.execute(select(*ALERT_COLUMNS).where(Alert.id.in_([entry.id for entry, _ in due])))).all()
+                await db.commit()
+            # Repeats that arrived while writing stay pending for the next flush.
+            for entry, repeats in due:
+                entry.pending -= repeats
+            self.writes += 1
+        cutoff = time.monotonic() - self.window
+        for key in [key for key, entry in self.open.items() if entry.written_at < cutoff and not entry.pending]:
+            del self.open[key]
+        return rows
+
+    async def start(self, publish):
+        """Flush every ``flush_interval`` seconds and hand the updated rows to ``publish``."""
+        async def loop():
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    publish(await self.flush())
+                except Exception:
+                    logger.exception("Alert flush failed")
+        self._flusher = asyncio.create_task(loop())
+
+    async def stop(self, publish):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        publish(await self.flush())
+
+    def stats(self):
+        return {
+            "open_tracked": len(self.open),
+            "pending": sum(entry.pending for entry in self.open.values()),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+        }
+
+
+alert_pipeline = AlertPipeline()
@@ -1,11 +1,17 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Depends, HTTPException, status, APIRouter, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from database import SessionLocal, User, Role
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import User, Role, get_db
 from jose import JWTError, jwt
 import os
+import time
 from sqlalchemy.exc import IntegrityError
 from pydantic import EmailStr
 
@@ -15,6 +21,14 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey123")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified principals are cached per token; a TTL of 0 disables the cache.
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+
+# bcrypt runs in this many threads; beyond the queue limit new logins are refused with 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -25,12 +39,107 @@ credentials_exception = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@dataclass(frozen=True)
+class Principal:
+    """Detached snapshot of the authenticated user, safe to share between requests."""
+    id: int
+    full_name: str
+    email: str
+    role: Role
+
+    @classmethod
+    def from_user(cls, user: User):
+        return cls(id=user.id, full_name=user.full_name, email=user.email, role=user.role)
+
+class PrincipalCache:
+    """Bounded LRU of token -> Principal. Entries expire after the TTL or with the token, whichever is first."""
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL_SECONDS, maxsize: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        entry = self.entries.get(token)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self.entries[token]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, principal: Principal, token_expires_at: float | None = None):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self.entries[token] = (principal, expires_at)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        for token in [token for token, (principal, _) in self.entries.items() if principal.id == user_id]:
+            del self.entries[token]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "ttl": self.ttl, "maxsize": self.maxsize}
+
+principal_cache = PrincipalCache()
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_principal(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+class HashingPool:
+    """Bounded thread pool for bcrypt so a login spike never blocks the event loop."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent logins, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(0, self.pending - self.workers),
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+hashing_pool = HashingPool()
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -38,12 +147,18 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
+    if not user:
+        return None
+    # Hand the connection back to the pool while bcrypt runs, so a login storm cannot starve it.
+    db.expunge(user)
+    await db.rollback()
+    if not await hashing_pool.run(verify_password, password, user.password):
         return None
     return user
 
@@ -53,7 +168,14 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await principal_for_token(db, token)
+
+async def principal_for_token(db: AsyncSession, token: str):
+    """Principal for a bearer token, from the cache or the users table; raises 401 if it is invalid."""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -61,10 +183,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_user_by_email(db, email)
+    user = await get_user_by_email(db, email)
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
 
 def get_current_admin(current_user: User = Depends(get_current_user)):
     if current_user.role != Role.ADMIN:
@@ -91,24 +215,25 @@ def get_current_cook(current_user: User = Depends(get_current_user)):
     return current_user
 
 @router.post("/register")
-async def register(full_name: str = Form(...), email: EmailStr = Form(...), password: str = Form(...), role: str = Form(...), db: Session = Depends(get_db)):
-    db_user = get_user_by_email(db, email)
+async def register(full_name: str = Form(...), email: EmailStr = Form(...), password: str = Form(...), role: str = Form(...), db: AsyncSession = Depends(get_db)):
+    db_user = await get_user_by_email(db, email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
+    await db.rollback()
     try:
-        hashed_password = get_password_hash(password)
+        hashed_password = await hashing_pool.run(get_password_hash, password)
         new_user = User(full_name=full_name, email=email, password=hashed_password, role=role.upper())
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         return {"message": "User registered successfully", "user_id": new_user.id}
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Database error: Email already exists or invalid data")
 
 @router.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -116,4 +241,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token = create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/auth/hashing")
+async def get_hashing_stats(current_user: User = Depends(get_current_admin)):
+    return hashing_pool.stats()
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""Cross-process delivery of broadcast messages.
+
+Every uvicorn worker publishes through the backplane and feeds what it receives
+into its local ``broadcast.hub``, so clients get updates no matter which worker
+or Celery task made the change. Messages published within one tick are sent as
+a single batch.
+
+Set ``BROADCAST_BACKPLANE_URL=redis://localhost:6379/0`` when running more than
+one worker; without it the in-process ``LocalBackplane`` is used.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from broadcast import json_default
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_BACKPLANE_URL = os.getenv("BROADCAST_BACKPLANE_URL", "")
+BROADCAST_CHANNEL = os.getenv("BROADCAST_CHANNEL", "kindergarten:broadcast")
+BROADCAST_TICK_SECONDS = float(os.getenv("BROADCAST_TICK_SECONDS", "0.02"))
+
+
+class LocalBackplane:
+    """Single-process stand-in that batches per tick and hands batches straight to ``deliver``."""
+
+    def __init__(self, tick: float = BROADCAST_TICK_SECONDS):
+        self.tick = tick
+        self.pending = deque()
+        self.deliver = None
+        self.batches = 0
+        self.messages = 0
+        self.dropped = 0
+        self._flusher = None
+
+    async def start(self, deliver):
+        """Start forwarding batches to ``deliver(topic, message)``."""
+        self.deliver = deliver
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def publish(self, topic: str, message: dict):
+        """Queue a message for the next tick; never waits. Dropped until ``start`` has run."""
+        if self.deliver:
+            self.pending.append((topic, message))
+            return
+        self.dropped += 1
+        if self.dropped == 1:
+            # Typically a Celery worker without BROADCAST_BACKPLANE_URL: nobody here forwards to clients.
+            logger.warning("Broadcast backplane not started in this process; dropping '%s' messages. "
+                           "Set BROADCAST_BACKPLANE_URL to a Redis URL so other processes can deliver them.", topic)
+
+    def publish_sync(self, topic: str, message: dict):
+        """Publish from code without a running event loop, such as a Celery task."""
+        # deque appends are thread-safe; the flusher picks the message up on its next tick.
+        self.publish(topic, message)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            if self.pending:
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Broadcast backplane flush failed")
+
+    async def flush(self):
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        if batch:
+            self.batches += 1
+            self.messages += len(batch)
+            await self._send(batch)
+
+    async def _send(self, batch):
+        self._receive(batch)
+
+    def _receive(self, batch):
+        if self.deliver:
+            for topic, message in batch:
+                self.deliver(topic, message)
+
+    def stats(self):
+        return {"backend": type(self).__name__, "batches": self.batches, "messages": self.messages, "pending": len(self.pending), "dropped": self.dropped}
+
+
+class RedisBackplane(LocalBackplane):
+    """Redis pub/sub backplane: each batch is one PUBLISH and every worker, including this one, receives it."""
+
+    def __init__(self, url: str, channel: str = BROADCAST_CHANNEL, tick: float = BROADCAST_TICK_SECONDS):
+        super().__init__(tick)
+        self.url = url
+        self.channel = channel
+        self.received = 0
+        self._redis = None
+        self._listener = None
+
+    async def start(self, deliver):
+        import redis.asyncio as redis
+        self._redis = redis.Redis.from_url(self.url)
+        await super().start(deliver)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        await super().stop()
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+
+    def publish_sync(self, topic: str, message: dict):
+        import redis
+        client = redis.Redis.from_url(self.url)
+        try:
+            client.publish(self.channel, self._encode([(topic, message)]))
+        finally:
+            client.close()
+
+    def _encode(self, batch):
+        return json.dumps({"events": batch}, default=json_default)
+
+    async def _send(self, batch):
+        await self._redis.publish(self.channel, self._encode(batch))
+
+    async def _listen(self):
+        # Resubscribe after connection errors so a Redis restart does not silence the worker.
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for item in pubsub.listen():
+                        if item["type"] == "message":
+                            self.received += 1
+                            self._receive(json.loads(item["data"])["events"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Broadcast backplane subscription lost: %s", e)
+                await asyncio.sleep(1)
+
+    def stats(self):
+        return {**super().stats(), "received": self.received}
+
+
+def create_backplane(url: str = BROADCAST_BACKPLANE_URL):
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackplane(url)
+    return LocalBackplane()
+
+
+backplane = create_backplane()
@@ -0,0 +1,99 @@
+"""Compare the legacy sync-session handlers with the async session layer under concurrent load.
+
+Both apps expose the same two routes: a heavy servings listing and a light
+single-row lookup. The light route is hit concurrently with the heavy one so the
+numbers show how much one slow query stalls unrelated requests.
+
+    python benchmarks/async_db.py --servings 5000 --concurrency 20 --requests 200
+"""
+import argparse
+import asyncio
+import json
+
+from common import use_temp_database, run_load, summarize, asgi_client
+
+
+def build_apps(concurrency):
+    from fastapi import FastAPI, Depends
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session, sessionmaker, selectinload
+    from database import DATABASE_URL, MealServing, User, get_db
+
+    # A blocked loop holds every checked-out connection, so give the sync pool room for both workloads.
+    sync_engine = create_engine(DATABASE_URL, pool_size=concurrency * 2, connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+
+    def get_sync_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    sync_app = FastAPI()
+
+    @sync_app.get("/servings")
+    async def sync_servings(db: Session = Depends(get_sync_db)):
+        return [{"meal": s.meal.name, "user": s.user.full_name, "portions": s.portions_served} for s in db.query(MealServing).all()]
+
+    @sync_app.get("/user")
+    async def sync_user(db: Session = Depends(get_sync_db)):
+        return {"name": db.get(User, 1).full_name}
+
+    async_app = FastAPI()
+
+    @async_app.get("/servings")
+    async def async_servings(db=Depends(get_db)):
+        query = select(MealServing).options(selectinload(MealServing.meal), selectinload(MealServing.user))
+        return [{"meal": s.meal.name, "user": s.user.full_name, "portions": s.portions_served} for s in (await db.execute(query)).scalars().all()]
+
+    @async_app.get("/user")
+    async def async_user(db=Depends(get_db)):
+        return {"name": (await db.get(User, 1)).full_name}
+
+    return {"sync": sync_app, "async": async_app}
+
+
+def seed(servings):
+    from sqlalchemy import insert
+    from database import init_db, engine, User, Meal, MealServing, Role
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": f"Cook {i}", "email": f"cook{i}@example.com", "password": "x", "role": Role.COOK} for i in range(1, 11)])
+        conn.execute(insert(Meal), [{"name": f"Meal {i}"} for i in range(1, 51)])
+        conn.execute(insert(MealServing), [{"meal_id": i % 50 + 1, "user_id": i % 10 + 1, "portions_served": 1} for i in range(servings)])
+
+
+async def bench(app, mode, concurrency, requests):
+    async with asgi_client(app) as client:
+        async def heavy():
+            (await client.get("/servings")).raise_for_status()
+
+        async def light():
+            (await client.get("/user")).raise_for_status()
+
+        (heavy_lat, heavy_elapsed), (light_lat, light_elapsed) = await asyncio.gather(
+            run_load(heavy, concurrency, requests),
+            run_load(light, concurrency, requests * 5),
+        )
+    return [summarize(f"{mode}:servings", heavy_lat, heavy_elapsed), summarize(f"{mode}:user", light_lat, light_elapsed)]
+
+
+async def main(args):
+    seed(args.servings)
+    from database import async_engine
+    for mode, app in build_apps(args.concurrency).items():
+        for result in await bench(app, mode, args.concurrency, args.requests):
+            print(json.dumps(result))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--servings", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
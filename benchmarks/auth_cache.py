@@ -0,0 +1,42 @@
+"""Measure per-request authentication overhead of get_current_user with and without the principal cache.
+
+    python benchmarks/auth_cache.py --iterations 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import use_temp_database
+
+
+async def main(args):
+    from sqlalchemy import insert
+    from database import init_db, engine, async_engine, AsyncSessionLocal, User, Role
+    import auth
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Cook", "email": "cook@example.com", "password": "x", "role": Role.COOK}])
+    token = auth.create_access_token({"sub": "cook@example.com"})
+
+    results = {}
+    for label, ttl in (("uncached", 0), ("cached", 60)):
+        auth.principal_cache = auth.PrincipalCache(ttl=ttl)
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            # A fresh session per call mirrors the per-request get_db dependency.
+            async with AsyncSessionLocal() as db:
+                await auth.get_current_user(token, db)
+        results[f"{label}_us_per_request"] = round((time.perf_counter() - started) / args.iterations * 1e6, 1)
+    results["speedup"] = round(results["uncached_us_per_request"] / results["cached_us_per_request"], 1)
+    print(json.dumps(results))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
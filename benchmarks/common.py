@@ -0,0 +1,67 @@
+"""Shared helpers for the benchmark scripts in this directory.
+
+The scripts run the app in-process against a throwaway SQLite database, so they
+must call ``use_temp_database()`` before importing ``database`` or ``main``.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_temp_database():
+    """Switch into a fresh working directory so ``kindergarten_meal.db`` is a scratch file."""
+    workdir = tempfile.mkdtemp(prefix="kindergarten-bench-")
+    os.symlink(os.path.join(ROOT, "templates"), os.path.join(workdir, "templates"))
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return workdir
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, elapsed, **extra):
+    result = {
+        "name": name,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+    result.update(extra)
+    return result
+
+
+async def run_load(call, concurrency, total):
+    """Run ``call()`` ``total`` times from ``concurrency`` workers and return (latencies, elapsed)."""
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def asgi_client(app, raise_app_exceptions=True):
+    import httpx
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=raise_app_exceptions)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
@@ -0,0 +1,69 @@
+"""Cost of polling the list endpoints with and without If-None-Match.
+
+    python benchmarks/conditional_get.py --ingredients 2000 --requests 500
+
+``uncached`` runs the query and encodes the body every time (body cache off),
+``full`` sends no validator (answered from the body cache after the first
+request), ``revalidate`` sends the ETag it got back (answered with 304).
+"""
+import argparse
+import asyncio
+import json
+
+from common import use_temp_database, run_load, summarize, asgi_client
+
+PATHS = ["/ingredients/?limit=100", "/meals/", "/reports/monthly", "/api/servings?limit=100"]
+
+
+def seed(ingredients):
+    from sqlalchemy import insert
+    from database import init_db, engine, User, Ingredient, Meal, MealIngredient, MealServing, Role
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Admin", "email": "admin@example.com", "password": "x", "role": Role.ADMIN}])
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": 5000.0, "minimum_quantity": 1000.0} for i in range(ingredients)
+        ])
+        conn.execute(insert(Meal), [{"name": f"Meal {i}"} for i in range(50)])
+        conn.execute(insert(MealIngredient), [
+            {"meal_id": m + 1, "ingredient_id": (m * 7 + k) % ingredients + 1, "quantity": 25.0} for m in range(50) for k in range(6)
+        ])
+        conn.execute(insert(MealServing), [{"meal_id": i % 50 + 1, "user_id": 1, "portions_served": 10} for i in range(5000)])
+
+
+async def main(args):
+    seed(args.ingredients)
+    from sqlalchemy import event
+    from database import async_engine
+    from auth import create_access_token
+    import main as app_module
+    from etags import ETAG_BODY_CACHE_SECONDS, body_cache
+
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(1))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin@example.com'})}"}
+    async with asgi_client(app_module.app) as client:
+        for path in PATHS:
+            etag = (await client.get(path, headers=headers)).headers["etag"]
+            for mode, extra in (("uncached", {}), ("full", {}), ("revalidate", {"If-None-Match": etag})):
+                body_cache.ttl = 0 if mode == "uncached" else ETAG_BODY_CACHE_SECONDS
+                body_cache.entries.clear()
+                async def poll():
+                    response = await client.get(path, headers={**headers, **extra})
+                    assert response.status_code == (304 if extra else 200), response.status_code
+
+                statements.clear()
+                latencies, elapsed = await run_load(poll, args.concurrency, args.requests)
+                print(json.dumps(summarize(path, latencies, elapsed, mode=mode, statements_per_request=round(len(statements) / args.requests, 3))))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ingredients", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
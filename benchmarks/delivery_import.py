@@ -0,0 +1,105 @@
+"""Import a large supplier manifest through ``POST /deliveries/bulk``.
+
+    python benchmarks/delivery_import.py --lines 100000 --ingredients 2000 --format csv
+
+Half of the manifest's ingredients exist beforehand. The body is streamed to the
+app in 64 KiB chunks. For comparison, ``--baseline`` lines are entered one at a
+time with ``PUT /ingredients/{id}``, the way deliveries were recorded before.
+``--memory`` also reports peak Python allocations during the import (tracing
+slows the import down, so leave it off when comparing times).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+from common import use_temp_database, asgi_client
+
+
+def seed(ingredients):
+    from sqlalchemy import insert
+    from database import init_db, engine, User, Ingredient, Role
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Manager", "email": "manager@example.com", "password": "x", "role": Role.MANAGER}])
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": 0.0, "minimum_quantity": 1000.0} for i in range(0, ingredients, 2)
+        ])
+
+
+def manifest(lines, ingredients, fmt):
+    rng = random.Random(lines)
+    rows = [(f"Ingredient {rng.randrange(ingredients)}", round(rng.uniform(100, 20000), 1)) for _ in range(lines)]
+    if fmt == "csv":
+        body = "name,quantity_grams,minimum_quantity\n" + "".join(f"{name},{grams},500\n" for name, grams in rows)
+    else:
+        body = "".join(json.dumps({"name": name, "quantity_grams": grams, "minimum_quantity": 500}) + "\n" for name, grams in rows)
+    return body.encode(), sum(grams for _, grams in rows)
+
+
+async def chunked(body, size=64 * 1024):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def main(args):
+    seed(args.ingredients)
+    from sqlalchemy import event, select, func
+    from database import SessionLocal, async_engine, Ingredient, InventoryTransaction
+    from auth import create_access_token
+    import main as app_module
+
+    body, grams = manifest(args.lines, args.ingredients, args.format)
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(1))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'manager@example.com'})}"}
+    content_type = "text/csv" if args.format == "csv" else "application/x-ndjson"
+    async with asgi_client(app_module.app) as client:
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        response = await client.post("/deliveries/bulk", content=chunked(body), headers={**headers, "Content-Type": content_type})
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 200, response.text
+        result = {"bulk": {**response.json(), "seconds": round(elapsed, 2), "lines_per_second": round(args.lines / elapsed),
+                           "statements": len(statements), "body_mb": round(len(body) / 2**20, 1)}}
+        if args.memory:
+            result["bulk"]["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+
+        if args.baseline:
+            with SessionLocal() as db:
+                current = dict(db.execute(select(Ingredient.id, Ingredient.quantity_grams)).all())
+            ids = list(current)
+            started = time.perf_counter()
+            for i in range(args.baseline):
+                ingredient_id = ids[i % len(ids)]
+                current[ingredient_id] += 100.0
+                response = await client.put(f"/ingredients/{ingredient_id}", json={"quantity_grams": current[ingredient_id]}, headers=headers)
+                assert response.status_code == 200, response.text
+            elapsed = time.perf_counter() - started
+            result["one_at_a_time"] = {"lines": args.baseline, "seconds": round(elapsed, 2), "lines_per_second": round(args.baseline / elapsed)}
+            grams += 100.0 * args.baseline
+
+    with SessionLocal() as db:
+        ledger_rows, ledger_grams = db.execute(select(func.count(), func.sum(InventoryTransaction.quantity_change_grams))).one()
+        stock = db.scalar(select(func.sum(Ingredient.quantity_grams)))
+    await async_engine.dispose()
+    print(json.dumps(result))
+    assert ledger_rows == args.lines + args.baseline
+    assert abs(ledger_grams - grams) < 1e-3 * args.lines and abs(stock - grams) < 1e-3 * args.lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--ingredients", type=int, default=2000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--baseline", type=int, default=200)
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,95 @@
+"""Export a large synthetic ledger through /export and check that peak memory stays bounded.
+
+    python benchmarks/export_memory.py --rows 1000000 --limit-mb 64
+
+The response is driven through the ASGI interface directly and body chunks are
+counted and discarded, so the measured peak is the server side of the stream.
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+
+async def export(app, path, token):
+    received = {"bytes": 0, "chunks": 0, "status": None}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            received["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            received["bytes"] += len(message.get("body", b""))
+            received["chunks"] += 1
+
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80), "root_path": "",
+    }
+    await app(scope, receive, send)
+    return received
+
+
+async def main(args):
+    from sqlalchemy import insert
+    from database import init_db, engine, async_engine, User, Role, Ingredient, InventoryTransaction, TransactionType
+    import auth
+    from main import app
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Auditor", "email": "admin@example.com", "password": "x", "role": Role.ADMIN}])
+        conn.execute(insert(Ingredient), [{"name": f"Ingredient {i}", "quantity_grams": 0, "minimum_quantity": 0} for i in range(50)])
+        base = datetime(2024, 1, 1)
+        chunk = 50_000
+        for offset in range(0, args.rows, chunk):
+            conn.execute(insert(InventoryTransaction), [
+                {
+                    "ingredient_id": i % 50 + 1, "quantity_change_grams": -12.5, "user_id": 1,
+                    "transaction_type": TransactionType.CONSUMPTION, "created_at": base + timedelta(seconds=i), "updated_at": base,
+                }
+                for i in range(offset, min(offset + chunk, args.rows))
+            ])
+    token = auth.create_access_token({"sub": "admin@example.com"})
+
+    results = {"rows": args.rows}
+    for label, path in (("ndjson", "/export/transactions"), ("csv_gzip", "/export/transactions?format=csv&gzip=true")):
+        tracemalloc.start()
+        started = time.perf_counter()
+        received = await export(app, path, token)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert received["status"] == 200, received
+        results[label] = {
+            "seconds": round(elapsed, 2),
+            "mb_sent": round(received["bytes"] / 2**20, 1),
+            "chunks": received["chunks"],
+            "peak_mb": round(peak / 2**20, 1),
+        }
+        assert peak < args.limit_mb * 2**20, f"{label} peaked at {peak / 2**20:.1f} MB"
+    print(json.dumps(results))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit-mb", type=float, default=64)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,106 @@
+"""Cost of the stockout forecast on a synthetic dataset.
+
+    python benchmarks/forecast.py --database /tmp/kitchen-medium.db
+    python benchmarks/forecast.py --scale small
+
+Times each step of ``ConsumptionForecast``: the cold load of the whole
+window, moving the window on by one day, re-reading stock after a write,
+recomputing the rates, and a cached call. The baseline is aggregating the same
+window straight from the CONSUMPTION ledger, which is what every request
+would pay without the rollups and the cache. The two must give the same daily
+totals. ``--database`` is used read-only; without it a fresh dataset of
+``--scale`` is generated.
+"""
+import argparse
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from common import use_temp_database
+import synthetic
+
+
+def timed(call, repeat):
+    """Fastest of ``repeat`` calls, in milliseconds, and the last result."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3), result
+
+
+def main(args):
+    import numpy as np
+    from sqlalchemy import select, func
+    from database import SessionLocal, InventoryTransaction, TransactionType
+    from forecast import ConsumptionForecast
+
+    today = date.today()
+    results = {}
+    with SessionLocal() as db:
+        def cold():
+            forecast = ConsumptionForecast(window_days=args.window)
+            forecast.refresh(db, today, 0)
+            return forecast
+
+        results["cold_load_ms"], forecast = timed(cold, args.repeat)
+
+        def ledger():
+            start = datetime.combine(forecast.first_day, datetime.min.time())
+            day = func.date(InventoryTransaction.created_at)
+            return db.execute(
+                select(InventoryTransaction.ingredient_id, day, (-func.sum(InventoryTransaction.quantity_change_grams)).label("grams"))
+                .where(InventoryTransaction.transaction_type == TransactionType.CONSUMPTION,
+                       InventoryTransaction.created_at >= start, InventoryTransaction.created_at < datetime.combine(today, datetime.min.time()))
+                .group_by(InventoryTransaction.ingredient_id, day)
+            ).all()
+
+        results["ledger_aggregate_ms"], rows = timed(ledger, args.repeat)
+        usage = np.zeros_like(forecast.usage)
+        rows_by_id = {ingredient_id: i for i, ingredient_id in enumerate(forecast.ids.tolist())}
+        for ingredient_id, day, grams in rows:
+            usage[rows_by_id[ingredient_id], (date.fromisoformat(day) - forecast.first_day).days] = grams
+        results["matches_ledger"] = bool(np.allclose(usage, forecast.usage))
+
+        def next_day():
+            moved = ConsumptionForecast(window_days=args.window)
+            moved.refresh(db, today - timedelta(days=1), 0)
+            started = time.perf_counter()
+            moved.refresh(db, today, 0)
+            return time.perf_counter() - started
+
+        results["day_advance_ms"] = round(min(next_day() for _ in range(args.repeat)) * 1000, 2)
+
+        def stock():
+            forecast.refresh_seconds = 0
+            forecast.refresh(db, today, forecast.stock_version + 1)
+
+        results["stock_refresh_ms"], _ = timed(stock, args.repeat)
+        results["compute_ms"], _ = timed(lambda: forecast._compute(today), args.repeat)
+        forecast.forecast(today)
+        results["cached_ms"], body = timed(lambda: forecast.forecast(today), args.repeat)
+        results["ingredients"] = len(body["ingredients"])
+        results["window_days"] = args.window
+        results["ledger_rows_in_window"] = db.scalar(
+            select(func.count()).select_from(InventoryTransaction)
+            .where(InventoryTransaction.created_at >= datetime.combine(forecast.first_day, datetime.min.time())))
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    synthetic.add_scale_arguments(parser)
+    parser.add_argument("--database", help="dataset made by synthetic.py")
+    parser.add_argument("--window", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    database = os.path.abspath(args.database) if args.database else None
+    use_temp_database()
+    if database:
+        os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    else:
+        synthetic.create(None, synthetic.scale_from_args(args), args.seed)
+    main(args)
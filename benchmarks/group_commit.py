@@ -0,0 +1,83 @@
+"""Servings per second with per-request commits versus group commit.
+
+Runs ``POST /serve/{meal_id}`` at each concurrency level twice, once with every
+request committing its own transaction and once through the group-commit writer,
+then checks that stock and the ledger add up for both.
+
+    python benchmarks/group_commit.py --requests 500 --concurrency 1 10 100
+"""
+import argparse
+import asyncio
+import json
+
+from common import use_temp_database, run_load, summarize, asgi_client
+
+
+def seed(ingredients_per_meal):
+    from sqlalchemy import insert
+    from database import init_db, engine, User, Ingredient, Meal, MealIngredient, Role
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Cook", "email": "cook@example.com", "password": "x", "role": Role.COOK}])
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": 1e12, "minimum_quantity": 0.0}
+            for i in range(1, ingredients_per_meal + 1)
+        ])
+        conn.execute(insert(Meal), [{"name": "Group Goulash"}])
+        conn.execute(insert(MealIngredient), [
+            {"meal_id": 1, "ingredient_id": i, "quantity": 10.0} for i in range(1, ingredients_per_meal + 1)
+        ])
+
+
+async def main(args):
+    seed(args.ingredients)
+    from sqlalchemy import select, func
+    from database import SessionLocal, async_engine, Ingredient, MealServing, InventoryTransaction
+    from auth import create_access_token
+    from serving import serving_writer
+    import main as app_module
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'cook@example.com'})}"}
+    results = []
+    async with asgi_client(app_module.app, raise_app_exceptions=False) as client:
+        for concurrency in args.concurrency:
+            for mode in ("per_request", "group_commit"):
+                serving_writer.enabled = mode == "group_commit"
+                batches, orders = serving_writer.batches, serving_writer.orders
+                errors = {}
+
+                async def serve():
+                    response = await client.post("/serve/1", json={"portions": 1}, headers=headers)
+                    if response.status_code != 200:
+                        errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+                latencies, elapsed = await run_load(serve, concurrency, args.requests)
+                extra = {"mode": mode, "concurrency": concurrency, "errors": errors}
+                if serving_writer.enabled:
+                    extra["mean_batch"] = round((serving_writer.orders - orders) / max(1, serving_writer.batches - batches), 1)
+                result = summarize("serve_meal", latencies, elapsed, **extra)
+                results.append(result)
+                print(json.dumps(result))
+        await serving_writer.stop()
+
+    with SessionLocal() as db:
+        served = db.scalar(select(func.coalesce(func.sum(MealServing.portions_served), 0)))
+        ledger = db.scalar(select(func.count()).select_from(InventoryTransaction))
+        used = db.scalar(select(func.sum(1e12 - Ingredient.quantity_grams)))
+    await async_engine.dispose()
+
+    failed = sum(sum(r["errors"].values()) for r in results)
+    assert ledger == served * args.ingredients, f"{ledger} ledger rows for {served} servings"
+    assert abs(used - served * 10.0 * args.ingredients) < 1e-3, "stock does not match servings"
+    assert served + failed == len(results) * args.requests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ingredients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,109 @@
+"""Cold-start import budget for the web app and the Celery worker.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 9 --web-budget 5 --worker-budget 3.5
+
+Imports ``main`` (what uvicorn loads) and ``jobs`` (what ``celery -A jobs
+worker`` loads) in fresh interpreters under ``python -X importtime``. The
+fastest of ``--runs`` runs is compared against each budget. Budgets are
+multiples of a bare ``import sqlalchemy`` measured the same way in the same
+run, so a slower or busier machine moves the baseline and the budget
+together. Single runs measured 3.5-4.6x (web) and 2.0-2.9x (worker); the
+defaults sit about 30% above the slowest of those. Every run also checks
+that neither process imports the other's stack: the worker must not import
+FastAPI, Starlette, Jinja2 or the auth libraries, and the web process must not
+import Celery or Jinja2 before they are needed. Prints one JSON line per
+target, with the modules that cost the most, and exits with status 1 on any
+violation, so CI can run it as a test.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import ROOT, use_temp_database
+
+TARGETS = {
+    "web": {"module": "main", "budget": 6.0, "forbidden": ("celery", "jinja2")},
+    "worker": {"module": "jobs", "budget": 4.0, "forbidden": ("fastapi", "starlette", "jinja2", "passlib", "jose")},
+}
+BASELINE_MODULE = "sqlalchemy"
+TOP_MODULES = 10
+
+
+def import_times(module):
+    """Run ``import module`` in a fresh interpreter; return {module name: (self µs, cumulative µs)}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=os.getcwd(),
+                            env={**os.environ, "PYTHONPATH": ROOT, "PYTHONDONTWRITEBYTECODE": "1"},
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f"import {module} failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def baseline_ms(runs):
+    """Fastest cumulative import time of ``BASELINE_MODULE`` over ``runs`` fresh interpreters."""
+    return min(import_times(BASELINE_MODULE)[BASELINE_MODULE][1] for _ in range(runs)) / 1000
+
+
+def measure(name, target, runs, startup):
+    totals, fastest, loaded = [], None, set()
+    for _ in range(runs):
+        times = import_times(target["module"])
+        loaded.update(times)
+        totals.append(times[target["module"]][1] / 1000)
+        if totals[-1] == min(totals):
+            fastest = times
+    # Top-level packages only, so "sqlalchemy" stands for all of its submodules.
+    forbidden = sorted({module.split(".")[0] for module in loaded} & set(target["forbidden"]))
+    heaviest = sorted(((module, round(cumulative / 1000, 1)) for module, (_, cumulative) in fastest.items() if "." not in module and module not in startup and module != target["module"]),
+                      key=lambda item: -item[1])
+    return {
+        "name": name,
+        "module": target["module"],
+        "ms": round(min(totals), 1),
+        "median_ms": round(statistics.median(totals), 1),
+        "budget_ms": round(target["budget_ms"], 1),
+        "x_baseline": round(min(totals) / target["baseline_ms"], 2),
+        "modules": len(set(fastest) - startup),
+        "forbidden_imports": forbidden,
+        "heaviest": heaviest[:TOP_MODULES],
+    }
+
+
+def main(args):
+    # Loaded by the interpreter itself (site, encodings, ...), not by the app.
+    startup = set(import_times("sys"))
+    baseline = baseline_ms(args.runs)
+    print(json.dumps({"name": "baseline", "module": BASELINE_MODULE, "ms": round(baseline, 1)}))
+    failures = []
+    for name, target in TARGETS.items():
+        budget = getattr(args, f"{name}_budget") or target["budget"]
+        target = {**target, "baseline_ms": baseline, "budget_ms": budget * baseline}
+        result = measure(name, target, args.runs, startup)
+        print(json.dumps(result))
+        if result["ms"] > result["budget_ms"]:
+            failures.append(f"{name}: import {target['module']} took {result['ms']} ms, budget {result['budget_ms']} ms ({budget}x {BASELINE_MODULE})")
+        if result["forbidden_imports"]:
+            failures.append(f"{name}: import {target['module']} loads {', '.join(result['forbidden_imports'])}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target; the fastest counts")
+    parser.add_argument("--web-budget", type=float, help=f"budget for the web app, in multiples of import {BASELINE_MODULE}")
+    parser.add_argument("--worker-budget", type=float, help=f"budget for the worker, in multiples of import {BASELINE_MODULE}")
+    args = parser.parse_args()
+    use_temp_database()
+    sys.exit(main(args))
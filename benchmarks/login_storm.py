@@ -0,0 +1,79 @@
+"""Log in many users at once and measure the latency of an unrelated endpoint during the storm.
+
+Runs the storm twice: with bcrypt inline on the event loop (the old behaviour)
+and through auth.hashing_pool.
+
+    python benchmarks/login_storm.py --users 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import use_temp_database, summarize, asgi_client
+
+
+async def storm(app, users, probe_headers):
+    logins, probes, statuses = [], [], {}
+    done = asyncio.Event()
+
+    # Unhandled errors (e.g. connection pool timeouts) are counted as 500s instead of aborting the run.
+    async with asgi_client(app, raise_app_exceptions=False) as client:
+        async def login(i):
+            started = time.perf_counter()
+            response = await client.post("/token", data={"username": f"cook{i}@example.com", "password": "secret"})
+            logins.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                (await client.get("/me", headers=probe_headers)).raise_for_status()
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(login(i) for i in range(users)))
+        finally:
+            elapsed = time.perf_counter() - started
+            done.set()
+            await prober
+    return logins, probes, elapsed, statuses
+
+
+async def main(args):
+    from sqlalchemy import insert
+    from database import init_db, engine, async_engine, User, Role
+    import auth
+    import main as app_module
+
+    init_db()
+    hashed = auth.get_password_hash("secret")
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"full_name": f"Cook {i}", "email": f"cook{i}@example.com", "password": hashed, "role": Role.COOK}
+            for i in range(args.users)
+        ])
+    probe_headers = {"Authorization": f"Bearer {auth.create_access_token({'sub': 'cook0@example.com'})}"}
+
+    async def inline(fn, *a):
+        return fn(*a)
+
+    pooled_run = auth.hashing_pool.run
+    for mode, run in (("inline", inline), ("pool", pooled_run)):
+        auth.hashing_pool.run = run
+        logins, probes, elapsed, statuses = await storm(app_module.app, args.users, probe_headers)
+        print(json.dumps(summarize(f"{mode}:login", logins, elapsed, statuses=statuses)))
+        print(json.dumps(summarize(f"{mode}:unrelated_probe", probes, elapsed)))
+    print(json.dumps({"hashing_pool": auth.hashing_pool.stats()}))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
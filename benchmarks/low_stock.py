@@ -0,0 +1,81 @@
+"""Compare the per-ingredient low-stock sweep with the set-based one.
+
+    python benchmarks/low_stock.py --ingredients 50000 --low-fraction 0.1
+
+Both sweeps start from the same data (some low ingredients already alerted)
+and must create alerts for exactly the same ingredients.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import use_temp_database
+
+
+async def legacy_check_low_stock(db):
+    # The sweep check_low_stock ran before detect_low_stock.
+    from sqlalchemy import select
+    from database import Alert, Ingredient
+    for ing in (await db.execute(select(Ingredient))).scalars().all():
+        if ing.quantity_grams < ing.minimum_quantity:
+            alert = (await db.execute(select(Alert).where(Alert.ingredient_id == ing.id, Alert.alert_type == "LOW_STOCK"))).scalars().first()
+            if not alert:
+                message = f"{str(ing.name).strip()} below minimum {float(ing.minimum_quantity)}g"
+                db.add(Alert(ingredient_id=ing.id, alert_type="LOW_STOCK", message=message))
+                await db.commit()
+
+
+async def main(args):
+    from sqlalchemy import delete, event, insert, select
+    from database import init_db, engine, async_engine, AsyncSessionLocal, Alert, AlertType, Ingredient
+    from inventory import detect_low_stock
+
+    init_db()
+    low_every = max(1, round(1 / args.low_fraction))
+    with engine.begin() as conn:
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": 100.0 if i % low_every == 0 else 5000.0, "minimum_quantity": 1000.0}
+            for i in range(args.ingredients)
+        ])
+        # A tenth of the low ingredients were already alerted by an earlier sweep.
+        conn.execute(insert(Alert), [
+            {"ingredient_id": i + 1, "alert_type": AlertType.LOW_STOCK, "message": "already alerted"}
+            for i in range(0, args.ingredients, low_every * 10)
+        ])
+
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(1))
+
+    async def run(check):
+        with engine.begin() as conn:
+            conn.execute(delete(Alert).where(Alert.message != "already alerted"))
+        statements.clear()
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await check(db)
+            await db.commit()
+        elapsed = time.perf_counter() - started
+        with engine.connect() as conn:
+            alerted = set(conn.execute(select(Alert.ingredient_id).where(Alert.message != "already alerted")).scalars())
+        return {"seconds": round(elapsed, 3), "statements": len(statements), "alerts": len(alerted)}, alerted
+
+    legacy, legacy_ids = await run(legacy_check_low_stock)
+    set_based, set_ids = await run(detect_low_stock)
+    assert legacy_ids == set_ids, "sweeps disagree"
+    print(json.dumps({
+        "ingredients": args.ingredients,
+        "legacy": legacy,
+        "set_based": set_based,
+        "speedup": round(legacy["seconds"] / set_based["seconds"], 1),
+    }))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ingredients", type=int, default=50_000)
+    parser.add_argument("--low-fraction", type=float, default=0.1)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
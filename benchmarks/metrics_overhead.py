@@ -0,0 +1,131 @@
+"""Cost of the metrics and profiling instrumentation itself.
+
+    python benchmarks/metrics_overhead.py --requests 5000 --queries 10000 --rounds 7
+
+Requests go straight into the ASGI app (no HTTP client) so the difference
+between the layers is not lost in client overhead: ``metrics`` adds
+``MetricsMiddleware``, ``metrics+profiler`` also adds an idle
+``ProfilerMiddleware``, and ``profiled`` profiles every request. Queries are
+``SELECT 1`` on an in-memory SQLite engine with no cursor events, with the
+metrics hook, and with the metrics hook plus the slow-query log. Each variant
+is run ``--rounds`` times, interleaved, and the fastest round counts. Times are
+CPU time of the benchmark thread, so other processes on a small machine do not
+show up as overhead.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from common import use_temp_database
+
+HEADERS = [(b"host", b"test"), (b"user-agent", b"bench"), (b"accept", b"application/json"), (b"authorization", b"Bearer x")]
+
+
+def app_with(variant):
+    from fastapi import FastAPI
+    from metrics import Metrics, MetricsMiddleware
+    from profiling import Profiler, ProfilerMiddleware
+
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    if variant in ("metrics+profiler", "profiled"):
+        target = Profiler(tempfile.mkdtemp(prefix="profiles-"), keep=5, sample_rate=1.0 if variant == "profiled" else 0.0)
+        app.add_middleware(ProfilerMiddleware, target=target)
+    if variant != "plain":
+        app.add_middleware(MetricsMiddleware, registry=Metrics())
+    return app
+
+
+async def time_requests(app, total):
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/items/7", "raw_path": b"/items/7", "root_path": "", "query_string": b"", "headers": HEADERS,
+             "client": ("127.0.0.1", 1), "server": ("test", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(min(500, total)):
+        await app(dict(scope), receive, send)
+    started = time.thread_time()
+    for _ in range(total):
+        await app(dict(scope), receive, send)
+    return (time.thread_time() - started) / total
+
+
+def time_queries(variant, total):
+    from sqlalchemy import create_engine, text
+    from metrics import Metrics, instrument_engine
+    from profiling import Profiler, trace_queries
+
+    engine = create_engine("sqlite://")
+    registry = Metrics()
+    if variant != "plain":
+        instrument_engine(engine, registry)
+    if variant == "metrics+slow_log":
+        trace_queries(registry, Profiler(tempfile.mkdtemp(prefix="profiles-")))
+    with engine.connect() as conn:
+        statement = text("SELECT 1")
+        for _ in range(500):
+            conn.execute(statement)
+        started = time.thread_time()
+        for _ in range(total):
+            conn.execute(statement)
+        return (time.thread_time() - started) / total
+
+
+def time_render(routes):
+    from metrics import Metrics
+
+    registry = Metrics()
+    for i in range(routes):
+        for status in (200, 404):
+            registry.observe_request("GET", f"/route/{i}", status, 0.01, 3, 0.002)
+    started = time.thread_time()
+    body = registry.render()
+    return time.thread_time() - started, len(body)
+
+
+def fastest(times):
+    """Microseconds per call for each variant, and the extra cost over the first one."""
+    result = {variant: round(min(runs) * 1e6, 2) for variant, runs in times.items()}
+    baseline = next(iter(result.values()))
+    return {variant: {"us": us, "overhead_us": round(us - baseline, 2)} for variant, us in result.items()}
+
+
+async def main(args):
+    # Alternate the runs so drift in machine load hits every variant equally.
+    requests = {variant: [] for variant in ("plain", "metrics", "metrics+profiler")}
+    for _ in range(args.rounds):
+        for variant, runs in requests.items():
+            runs.append(await time_requests(app_with(variant), args.requests))
+    profiled = await time_requests(app_with("profiled"), args.profiled)
+
+    queries = {variant: [] for variant in ("plain", "metrics", "metrics+slow_log")}
+    for _ in range(args.rounds):
+        for variant, runs in queries.items():
+            runs.append(time_queries(variant, args.queries))
+
+    seconds, size = time_render(args.routes)
+    print(json.dumps({"request": fastest(requests), "profiled_request_us": round(profiled * 1e6, 1), "query": fastest(queries),
+                      "render": {"routes": args.routes, "ms": round(seconds * 1000, 2), "bytes": size}}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--profiled", type=int, default=50)
+    parser.add_argument("--routes", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=7)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,85 @@
+"""Compare the per-meal lazy-loading portion estimate with the vectorized PortionEstimator.
+
+    python benchmarks/portion_estimator.py --meals 3000 --ingredients 2000 --per-meal 8
+"""
+import argparse
+import json
+import random
+import time
+
+from common import use_temp_database
+
+
+def seed(meals, ingredients, per_meal):
+    from sqlalchemy import insert
+    from database import init_db, engine, Ingredient, Meal, MealIngredient
+
+    init_db()
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": rng.uniform(0, 50000), "minimum_quantity": 100.0}
+            for i in range(1, ingredients + 1)
+        ])
+        conn.execute(insert(Meal), [{"name": f"Meal {i}"} for i in range(1, meals + 1)])
+        conn.execute(insert(MealIngredient), [
+            {"meal_id": m, "ingredient_id": i, "quantity": rng.uniform(1, 300)}
+            for m in range(1, meals + 1)
+            for i in rng.sample(range(1, ingredients + 1), per_meal)
+        ])
+
+
+def legacy_estimate(db):
+    from database import Meal
+    estimates = {}
+    for meal in db.query(Meal).all():
+        min_portions = float('inf')
+        for meal_ing in meal.ingredients:
+            min_portions = min(min_portions, meal_ing.ingredient.quantity_grams / meal_ing.quantity)
+        estimates[meal.name] = int(min_portions) if min_portions != float('inf') else 0
+    return estimates
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def main(args):
+    seed(args.meals, args.ingredients, args.per_meal)
+    from database import SessionLocal
+    from portions import PortionEstimator
+
+    with SessionLocal() as db:
+        expected, legacy_s = timed(lambda: legacy_estimate(db))
+    with SessionLocal() as db:
+        estimator, load_s = timed(lambda: PortionEstimator.from_session(db))
+    estimates, estimate_s = timed(estimator.estimate, repeat=20)
+    assert estimates == expected, "vectorized estimates differ from the legacy loop"
+
+    def serve_and_estimate():
+        estimator.adjust_stock({random.randint(1, args.ingredients): -10.0 for _ in range(args.per_meal)})
+        return estimator.estimate()
+
+    _, incremental_s = timed(serve_and_estimate, repeat=20)
+    print(json.dumps({
+        "meals": args.meals,
+        "ingredients": args.ingredients,
+        "legacy_ms": round(legacy_s * 1000, 2),
+        "estimator_load_ms": round(load_s * 1000, 2),
+        "estimate_ms": round(estimate_s * 1000, 3),
+        "incremental_update_and_estimate_ms": round(incremental_s * 1000, 3),
+        "speedup_vs_legacy": round(legacy_s / estimate_s, 1),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--meals", type=int, default=3000)
+    parser.add_argument("--ingredients", type=int, default=2000)
+    parser.add_argument("--per-meal", type=int, default=8)
+    args = parser.parse_args()
+    use_temp_database()
+    main(args)
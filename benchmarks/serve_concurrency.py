@@ -0,0 +1,73 @@
+"""Stress ``POST /serve/{meal_id}`` with concurrent cooks and check stock never goes negative.
+
+Stock is seeded for exactly ``--portions`` servings; every request beyond that
+must be refused. The script also reports SQL statements issued per request.
+
+    python benchmarks/serve_concurrency.py --portions 100 --requests 300 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+
+from common import use_temp_database, run_load, summarize, asgi_client
+
+
+def seed(portions, ingredients_per_meal):
+    from sqlalchemy import insert
+    from database import init_db, engine, User, Ingredient, Meal, MealIngredient, Role
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Cook", "email": "cook@example.com", "password": "x", "role": Role.COOK}])
+        conn.execute(insert(Ingredient), [
+            {"name": f"Ingredient {i}", "quantity_grams": 10.0 * portions, "minimum_quantity": 0.0}
+            for i in range(1, ingredients_per_meal + 1)
+        ])
+        conn.execute(insert(Meal), [{"name": "Stress Stew"}])
+        conn.execute(insert(MealIngredient), [
+            {"meal_id": 1, "ingredient_id": i, "quantity": 10.0} for i in range(1, ingredients_per_meal + 1)
+        ])
+
+
+async def main(args):
+    seed(args.portions, args.ingredients)
+    from sqlalchemy import select, func
+    from database import SessionLocal, async_engine, Ingredient, MealServing, InventoryTransaction
+    from auth import create_access_token
+    from metrics import metrics
+    import main as app_module
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'cook@example.com'})}"}
+    outcomes = {}
+    async with asgi_client(app_module.app) as client:
+        async def serve():
+            response = await client.post("/serve/1", json={"portions": 1}, headers=headers)
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+        latencies, elapsed = await run_load(serve, args.concurrency, args.requests)
+
+    with SessionLocal() as db:
+        lowest = db.scalar(select(func.min(Ingredient.quantity_grams)))
+        served = db.scalar(select(func.coalesce(func.sum(MealServing.portions_served), 0)))
+        ledger = db.scalar(select(func.count()).select_from(InventoryTransaction))
+    # Counted per request by the metrics middleware, so cached lookups (auth, recipes) are not guessed at.
+    queries = metrics.queries[("POST", "/serve/{meal_id}")]
+    per_request = queries.sum / sum(queries.counts)
+    print(json.dumps(summarize("serve_meal", latencies, elapsed, outcomes=outcomes, served=served, lowest_stock=lowest,
+                               ledger_rows=ledger, statements_per_request=round(per_request, 2))))
+    await async_engine.dispose()
+
+    assert lowest >= 0, f"stock overdrawn: {lowest}"
+    assert served == min(args.portions, args.requests), f"served {served} portions, expected {args.portions}"
+    assert ledger == served * args.ingredients
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--portions", type=int, default=100)
+    parser.add_argument("--ingredients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,108 @@
+"""Point-in-time stock queries against growing ledgers.
+
+For each ledger size, a year of history is generated with daily snapshots, then
+stock for all ingredients is read at random moments two ways: from the nearest
+snapshot (``stock_at``) and by rewinding live stock through the ledger (the
+approach used before snapshots). Both must agree.
+
+    python benchmarks/stock_history.py --ingredients 200 --ledger 100000 1000000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database, percentile
+
+YEAR_SECONDS = 365 * 24 * 3600
+
+
+def seed(ingredients, ledger_rows, start):
+    from sqlalchemy import delete, insert, update, bindparam
+    from database import engine, Ingredient, InventoryTransaction, StockSnapshot, TransactionType
+
+    rng = random.Random(ledger_rows)
+    stock = [0.0] * (ingredients + 1)
+    with engine.begin() as conn:
+        conn.execute(delete(InventoryTransaction))
+        conn.execute(delete(StockSnapshot))
+        step = YEAR_SECONDS / ledger_rows
+        rows, snapshots, next_day = [], [], 1
+        for i in range(ledger_rows):
+            created_at = start + timedelta(seconds=i * step)
+            # Daily snapshots, as the snapshotter would have taken them.
+            while created_at >= start + timedelta(days=next_day):
+                taken_at = start + timedelta(days=next_day)
+                snapshots.extend({"taken_at": taken_at, "ingredient_id": k, "quantity_grams": stock[k]} for k in range(1, ingredients + 1))
+                next_day += 1
+            ingredient_id = rng.randrange(ingredients) + 1
+            delivery = i % 10 == 0
+            change = 5000.0 if delivery else -rng.uniform(10, 500)
+            stock[ingredient_id] += change
+            rows.append({
+                "ingredient_id": ingredient_id,
+                "quantity_change_grams": change,
+                "user_id": 1,
+                "transaction_type": TransactionType.DELIVERY if delivery else TransactionType.CONSUMPTION,
+                "created_at": created_at,
+            })
+            if len(rows) == 50_000:
+                conn.execute(insert(InventoryTransaction), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(InventoryTransaction), rows)
+        conn.execute(insert(StockSnapshot), snapshots)
+        table = Ingredient.__table__
+        conn.execute(
+            update(table).where(table.c.id == bindparam("ingredient_id")).values(quantity_grams=bindparam("grams")),
+            [{"ingredient_id": k, "grams": stock[k]} for k in range(1, ingredients + 1)],
+        )
+
+
+def measure(query_at, moments):
+    latencies, results = [], []
+    for moment in moments:
+        started = time.perf_counter()
+        results.append(query_at(moment))
+        latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+
+def main(args):
+    from sqlalchemy import insert
+    from database import init_db, engine, SessionLocal, User, Ingredient, Role
+    from stock import stock_at, rewound
+
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"full_name": "Bench", "email": "bench@example.com", "password": "x", "role": Role.MANAGER}])
+        conn.execute(insert(Ingredient), [{"name": f"Ingredient {i}", "quantity_grams": 0.0, "minimum_quantity": 0.0} for i in range(args.ingredients)])
+    start = datetime(2024, 1, 1)
+    for ledger_rows in args.ledger:
+        seed(args.ingredients, ledger_rows, start)
+        rng = random.Random(7)
+        moments = [start + timedelta(seconds=rng.uniform(0, YEAR_SECONDS)) for _ in range(args.queries)]
+        with SessionLocal() as db:
+            snapshot_latencies, from_snapshots = measure(lambda at: stock_at(db, at), moments)
+            rewind_latencies, from_rewind = measure(lambda at: dict(db.execute(rewound(at)).all()), moments)
+        for a, b in zip(from_snapshots, from_rewind):
+            assert all(abs(a[k] - b[k]) < 1e-3 for k in a), "snapshot and rewind disagree"
+        print(json.dumps({
+            "ledger_rows": ledger_rows,
+            "ingredients": args.ingredients,
+            "snapshot_p50_ms": round(percentile(snapshot_latencies, 50) * 1000, 2),
+            "snapshot_p99_ms": round(percentile(snapshot_latencies, 99) * 1000, 2),
+            "rewind_p50_ms": round(percentile(rewind_latencies, 50) * 1000, 2),
+            "rewind_p99_ms": round(percentile(rewind_latencies, 99) * 1000, 2),
+        }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ingredients", type=int, default=200)
+    parser.add_argument("--ledger", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    use_temp_database()
+    main(args)
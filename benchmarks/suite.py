@@ -0,0 +1,175 @@
+"""End-to-end load suite over a synthetic dataset.
+
+    python benchmarks/suite.py --scale small --concurrency 1 10 50 --output suite.json
+    python benchmarks/suite.py --database /tmp/kitchen-medium.db --flows serve servings --requests 500
+
+Drives the app in-process through an ASGI client for the key flows: login,
+serving a meal, the portion estimate, the stockout forecast, the servings
+list, the alerts list and monthly report generation (Celery runs eagerly, so
+the report is built inside the request). Each flow runs at every ``--concurrency`` level and reports
+p50/p95/p99 latency, throughput, status codes and SQL statements per request.
+
+``--database`` names a dataset made by ``synthetic.py``; it is generated on
+first use and copied for every run, so runs on different commits start from
+identical data. Without it a fresh dataset of ``--scale`` is generated.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+from common import ROOT, use_temp_database, run_load, summarize, asgi_client
+import synthetic
+
+FLOWS = ("login", "serve", "estimate", "forecast", "servings", "alerts", "report")
+# Responses that are a normal outcome of the flow; anything else counts as an error.
+EXPECTED = {"serve": {200, 400}}
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare(args, workdir):
+    """Put a copy of the dataset in the scratch directory and point DATABASE_URL at it."""
+    target = os.path.join(workdir, "kindergarten_meal.db")
+    if args.database:
+        if not os.path.exists(args.database):
+            print(f"Generating {args.database} ...")
+            subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "synthetic.py"), "--database", args.database,
+                            "--scale", args.scale, "--seed", str(args.seed)]
+                           + [f"--{key}={getattr(args, key)}" for key in synthetic.SCALES["small"] if getattr(args, key) is not None],
+                           check=True)
+        shutil.copyfile(args.database, target)
+        os.environ["DATABASE_URL"] = f"sqlite:///{target}"
+        from database import init_db
+        init_db()
+        return {"source": os.path.abspath(args.database)}
+    return synthetic.create(target, synthetic.scale_from_args(args), args.seed)
+
+
+def dataset_counts():
+    from sqlalchemy import select, func
+    from database import SessionLocal, Alert, Ingredient, InventoryTransaction, Meal, MealServing, User
+
+    with SessionLocal() as db:
+        return {model.__tablename__: db.scalar(select(func.count()).select_from(model))
+                for model in (User, Ingredient, Meal, MealServing, InventoryTransaction, Alert)}
+
+
+def flow_calls(client, rng):
+    """One coroutine function per flow; each issues a single request and returns the response."""
+    from sqlalchemy import select, func
+    from auth import create_access_token
+    from database import SessionLocal, MealServing, Meal, User, Role
+
+    with SessionLocal() as db:
+        emails = {role: db.scalars(select(User.email).where(User.role == role).order_by(User.id)).all() for role in Role}
+        meal_count = db.scalar(select(func.count()).select_from(Meal))
+        first, last = db.execute(select(func.min(MealServing.created_at), func.max(MealServing.created_at))).one()
+    headers = {role: [{"Authorization": f"Bearer {create_access_token({'sub': email})}"} for email in emails[role]] for role in Role}
+    months = sorted({f"{first.year + (first.month - 1 + i) // 12}-{(first.month - 1 + i) % 12 + 1:02d}"
+                     for i in range((last.year - first.year) * 12 + last.month - first.month + 1)}) if first else ["2025-01"]
+
+    async def login():
+        email = rng.choice(emails[Role.COOK])
+        return await client.post("/token", data={"username": email, "password": synthetic.BENCH_PASSWORD})
+
+    async def serve():
+        return await client.post(f"/serve/{rng.randint(1, meal_count)}", json={"portions": rng.randint(1, 5)}, headers=rng.choice(headers[Role.COOK]))
+
+    async def estimate():
+        return await client.get("/portions/estimate", headers=rng.choice(headers[Role.MANAGER]))
+
+    async def forecast():
+        return await client.get("/ingredients/forecast", headers=rng.choice(headers[Role.MANAGER]))
+
+    async def servings():
+        params = {"limit": 100}
+        if rng.random() < 0.5:
+            params["meal_id"] = rng.randint(1, meal_count)
+        return await client.get("/api/servings", params=params, headers=rng.choice(headers[Role.MANAGER]))
+
+    async def alerts():
+        return await client.get("/api/alerts", params={"state": rng.choice(["open", "all"]), "limit": 100}, headers=rng.choice(headers[Role.MANAGER]))
+
+    async def report():
+        return await client.post("/tasks/generate-report", params={"month": rng.choice(months)}, headers=headers[Role.ADMIN][0])
+
+    return {"login": login, "serve": serve, "estimate": estimate, "forecast": forecast, "servings": servings, "alerts": alerts, "report": report}
+
+
+async def main(args):
+    workdir = use_temp_database()
+    os.environ["CELERY_TASK_ALWAYS_EAGER"] = "1"
+    dataset = prepare(args, workdir)
+    from sqlalchemy import event
+    from database import engine, async_engine
+    import main as app_module
+
+    statements = []
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", lambda *a: statements.append(1))
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "dataset": {**dataset, "rows": dataset_counts()},
+        "settings": {"concurrency": args.concurrency, "requests": args.requests, "login_requests": args.login_requests, "seed": args.seed},
+        "results": [],
+    }
+    async with asgi_client(app_module.app) as client:
+        for flow in args.flows:
+            rng = random.Random(f"{args.seed}-{flow}")
+            call = flow_calls(client, rng)[flow]
+            for _ in range(args.warmup):
+                await call()
+            for concurrency in args.concurrency:
+                outcomes = {}
+
+                async def request():
+                    response = await call()
+                    outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+                total = args.login_requests if flow == "login" else args.requests
+                statements.clear()
+                latencies, elapsed = await run_load(request, concurrency, total)
+                errors = sum(count for code, count in outcomes.items() if code not in EXPECTED.get(flow, {200}))
+                result = summarize(flow, latencies, elapsed, concurrency=concurrency, statuses=outcomes, errors=errors,
+                                   queries_per_request=round(len(statements) / total, 2))
+                report["results"].append(result)
+                print(json.dumps(result))
+    await async_engine.dispose()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, default=str)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    synthetic.add_scale_arguments(parser)
+    parser.add_argument("--database", help="dataset made by synthetic.py, generated here if missing")
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--login-requests", type=int, default=40, help="logins are bcrypt-bound, so fewer by default")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", help="write the full report, with dataset and revision, as JSON")
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.database:
+        args.database = os.path.abspath(args.database)
+    started = time.perf_counter()
+    asyncio.run(main(args))
+    print(f"Suite finished in {time.perf_counter() - started:.0f}s")
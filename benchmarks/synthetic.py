@@ -0,0 +1,241 @@
+"""Synthetic kitchen data at production-like scale.
+
+    python benchmarks/synthetic.py --scale medium --database /tmp/kitchen-medium.db
+    python benchmarks/synthetic.py --ingredients 3000 --meals 1500 --servings 1000000 --days 365
+
+Generates users, ingredients, meals with recipes, servings spread over
+``--days`` days of lunch service, and the inventory ledger that goes with them:
+one CONSUMPTION row per serving and ingredient, and DELIVERY rows whenever
+stock runs low. Live quantities, stock snapshots, daily rollups and low-stock
+alerts (resolved by the next delivery, or still open) all agree with the
+ledger. Meal and ingredient popularity follow a Zipf curve, so a few recipes
+dominate like they do in a real kitchen.
+
+Rows are written with chunked Core inserts. The same ``--seed`` and scale give
+the same data, so results can be compared between commits; ``suite.py``
+copies a generated database instead of regenerating it for every run.
+Every generated user has the password ``BENCH_PASSWORD``.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import use_temp_database
+
+BENCH_PASSWORD = "bench-password"
+SCALES = {
+    "small": {"ingredients": 200, "meals": 100, "servings": 20_000, "days": 90, "users": 20},
+    "medium": {"ingredients": 2000, "meals": 1000, "servings": 500_000, "days": 365, "users": 60},
+    "large": {"ingredients": 5000, "meals": 3000, "servings": 2_000_000, "days": 730, "users": 120},
+}
+CHUNK_ROWS = 20_000
+SNAPSHOT_EVERY_DAYS = 7
+# Stock levels in days of expected use.
+RESTOCK_TO_DAYS = 10
+MINIMUM_DAYS = 3
+
+
+def zipf_weights(n, exponent, rng):
+    weights = [1 / (rank + 1) ** exponent for rank in range(n)]
+    rng.shuffle(weights)
+    return weights
+
+
+def lunch_times(rng, day, count):
+    """``count`` sorted serving times on ``day``, clustered around noon."""
+    times = [day + timedelta(hours=11, minutes=30) + timedelta(seconds=min(max(rng.gauss(3600, 1500), 0), 3 * 3600)) for _ in range(count)]
+    return sorted(times)
+
+
+class Writer:
+    """Buffers rows per table and writes them with multi-row Core inserts."""
+
+    def __init__(self, conn, chunk=CHUNK_ROWS):
+        self.conn = conn
+        self.chunk = chunk
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, table, row):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.chunk:
+            self.flush(table)
+
+    def flush(self, table=None):
+        from sqlalchemy import insert
+
+        for name in [table] if table is not None else list(self.buffers):
+            rows = self.buffers.get(name)
+            if rows:
+                self.conn.execute(insert(name), rows)
+                self.counts[name.__tablename__] = self.counts.get(name.__tablename__, 0) + len(rows)
+                rows.clear()
+
+
+def generate(ingredients, meals, servings, days, users, seed=1, end=None, chunk=CHUNK_ROWS):
+    """Fill the (empty, initialized) database and return row counts per table."""
+    from sqlalchemy import update, bindparam
+    from auth import get_password_hash
+    from database import (
+        engine, SessionLocal, Alert, AlertStatus, AlertType, Ingredient, InventoryTransaction, Meal, MealIngredient,
+        MealServing, Role, StockSnapshot, TransactionType, User,
+    )
+    from reporting import rebuild_rollups
+
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    password = get_password_hash(BENCH_PASSWORD)
+
+    managers = max(1, users // 10)
+    cooks = max(1, users - managers - 2)
+    user_rows = [{"full_name": f"Admin {i}", "email": f"admin{i}@bench.example", "password": password, "role": Role.ADMIN} for i in range(2)]
+    user_rows += [{"full_name": f"Manager {i}", "email": f"manager{i}@bench.example", "password": password, "role": Role.MANAGER} for i in range(managers)]
+    user_rows += [{"full_name": f"Cook {i}", "email": f"cook{i}@bench.example", "password": password, "role": Role.COOK} for i in range(cooks)]
+    manager_ids = range(3, 3 + managers)
+    cook_ids = range(3 + managers, 3 + managers + cooks)
+
+    # Recipes: 3-9 ingredients each, drawn by ingredient popularity.
+    ingredient_weights = zipf_weights(ingredients, 0.8, rng)
+    recipes = []
+    for _ in range(meals):
+        picked = set(rng.choices(range(1, ingredients + 1), weights=ingredient_weights, k=rng.randint(3, 9)))
+        recipes.append([(ingredient_id, round(rng.uniform(5, 250), 1)) for ingredient_id in sorted(picked)])
+    meal_weights = zipf_weights(meals, 1.0, rng)
+    meal_cumulative = []
+    total = 0.0
+    for weight in meal_weights:
+        total += weight
+        meal_cumulative.append(total)
+
+    # Expected daily use per ingredient sets delivery sizes and minimums.
+    servings_per_day = servings / days
+    mean_portions = 22.5
+    daily_use = [0.0] * (ingredients + 1)
+    for weight, recipe in zip(meal_weights, recipes):
+        for ingredient_id, grams in recipe:
+            daily_use[ingredient_id] += weight / total * servings_per_day * mean_portions * grams
+    restock_to = [max(use * RESTOCK_TO_DAYS, 5000.0) for use in daily_use]
+    minimum = [round(max(use * MINIMUM_DAYS, 500.0), -1) for use in daily_use]
+
+    stock = [0.0] * (ingredients + 1)
+    delivered_at = [start] * (ingredients + 1)
+    crossed_at = [None] * (ingredients + 1)
+    names = [None] + [f"Ingredient {i:05d}" for i in range(1, ingredients + 1)]
+
+    with engine.begin() as conn:
+        writer = Writer(conn, chunk)
+        for row in user_rows:
+            writer.add(User, row)
+        for ingredient_id in range(1, ingredients + 1):
+            writer.add(Ingredient, {"name": names[ingredient_id], "quantity_grams": 0.0, "minimum_quantity": minimum[ingredient_id],
+                                    "delivery_date": start, "created_at": start, "updated_at": start})
+        for meal_id, recipe in enumerate(recipes, 1):
+            writer.add(Meal, {"name": f"Meal {meal_id:05d}", "created_at": start, "updated_at": start})
+            for ingredient_id, grams in recipe:
+                writer.add(MealIngredient, {"meal_id": meal_id, "ingredient_id": ingredient_id, "quantity": grams})
+        writer.flush()
+
+        def deliver(ingredient_id, grams, at):
+            stock[ingredient_id] += grams
+            delivered_at[ingredient_id] = at
+            writer.add(InventoryTransaction, {"ingredient_id": ingredient_id, "quantity_change_grams": grams, "user_id": rng.choice(manager_ids),
+                                              "meal_serving_id": None, "transaction_type": TransactionType.DELIVERY, "created_at": at, "updated_at": at})
+            if crossed_at[ingredient_id] is not None and stock[ingredient_id] >= minimum[ingredient_id]:
+                writer.add(Alert, {"ingredient_id": ingredient_id, "alert_type": AlertType.LOW_STOCK, "status": AlertStatus.RESOLVED,
+                                   "message": f"{names[ingredient_id]} below minimum {minimum[ingredient_id]}g",
+                                   "occurrences": 1, "created_at": crossed_at[ingredient_id], "last_seen_at": crossed_at[ingredient_id],
+                                   "resolved_at": at, "updated_at": at})
+                crossed_at[ingredient_id] = None
+
+        serving_id = 0
+        for day_index in range(days):
+            day = start + timedelta(days=day_index)
+            if day_index % SNAPSHOT_EVERY_DAYS == 0:
+                for ingredient_id in range(1, ingredients + 1):
+                    writer.add(StockSnapshot, {"taken_at": day, "ingredient_id": ingredient_id, "quantity_grams": stock[ingredient_id]})
+            # Morning deliveries for anything below its minimum.
+            morning = day + timedelta(hours=6)
+            for ingredient_id in range(1, ingredients + 1):
+                if stock[ingredient_id] < minimum[ingredient_id]:
+                    deliver(ingredient_id, round(restock_to[ingredient_id] - stock[ingredient_id], 1), morning)
+            count = servings * (day_index + 1) // days - servings * day_index // days
+            for served_at in lunch_times(rng, day, count):
+                meal_id = rng.choices(range(1, meals + 1), cum_weights=meal_cumulative)[0]
+                portions = rng.randint(5, 40)
+                cook_id = rng.choice(cook_ids)
+                serving_id += 1
+                writer.add(MealServing, {"id": serving_id, "meal_id": meal_id, "user_id": cook_id, "portions_served": portions,
+                                         "created_at": served_at, "updated_at": served_at})
+                for ingredient_id, grams in recipes[meal_id - 1]:
+                    used = grams * portions
+                    if stock[ingredient_id] < used:
+                        # Emergency delivery just before service, as a kitchen would have to.
+                        deliver(ingredient_id, round(max(restock_to[ingredient_id], used * 2), 1), served_at - timedelta(minutes=30))
+                    stock[ingredient_id] -= used
+                    writer.add(InventoryTransaction, {"ingredient_id": ingredient_id, "quantity_change_grams": -used, "user_id": cook_id,
+                                                      "meal_serving_id": serving_id, "transaction_type": TransactionType.CONSUMPTION,
+                                                      "created_at": served_at, "updated_at": served_at})
+                    if stock[ingredient_id] < minimum[ingredient_id] and crossed_at[ingredient_id] is None:
+                        crossed_at[ingredient_id] = served_at
+        for ingredient_id in range(1, ingredients + 1):
+            if crossed_at[ingredient_id] is not None:
+                writer.add(Alert, {"ingredient_id": ingredient_id, "alert_type": AlertType.LOW_STOCK, "status": AlertStatus.OPEN,
+                                   "message": f"{names[ingredient_id]} below minimum {minimum[ingredient_id]}g",
+                                   "occurrences": 1, "created_at": crossed_at[ingredient_id], "last_seen_at": crossed_at[ingredient_id],
+                                   "resolved_at": None, "updated_at": crossed_at[ingredient_id]})
+        writer.flush()
+
+        table = Ingredient.__table__
+        conn.execute(
+            update(table).where(table.c.id == bindparam("ingredient_id")).values(quantity_grams=bindparam("grams"), delivery_date=bindparam("delivered")),
+            [{"ingredient_id": i, "grams": round(stock[i], 3), "delivered": delivered_at[i]} for i in range(1, ingredients + 1)],
+        )
+
+    with SessionLocal() as db:
+        rebuild_rollups(db, start, end + timedelta(days=1))
+        db.commit()
+    return writer.counts
+
+
+def create(database, scale, seed=1):
+    """Initialize ``database`` (a SQLite path, or the configured DATABASE_URL when None) and fill it."""
+    if database:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+    from database import init_db
+
+    init_db()
+    started = time.perf_counter()
+    counts = generate(**scale, seed=seed)
+    return {"scale": scale, "seed": seed, "rows": counts, "seconds": round(time.perf_counter() - started, 1)}
+
+
+def scale_from_args(args):
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key, None) is not None:
+            scale[key] = getattr(args, key)
+    return scale
+
+
+def add_scale_arguments(parser):
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    for key in SCALES["small"]:
+        parser.add_argument(f"--{key}", type=int, help=f"override the scale's {key}")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_scale_arguments(parser)
+    parser.add_argument("--database", help="SQLite file to create (default: a scratch directory)")
+    args = parser.parse_args()
+    if args.database and os.path.exists(args.database):
+        parser.error(f"{args.database} already exists")
+    database = os.path.abspath(args.database) if args.database else None
+    use_temp_database()
+    print(json.dumps(create(database, scale_from_args(args), args.seed)))
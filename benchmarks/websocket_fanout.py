@@ -0,0 +1,106 @@
+"""Broadcast latency to many WebSocket clients when some of them are slow.
+
+    python benchmarks/websocket_fanout.py --clients 1000 --slow 50 --messages 50
+
+Clients are in-memory sockets; slow ones take ``--slow-delay`` seconds per send.
+The hub is compared with the previous sequential loop over every connection.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import percentile, use_temp_database
+
+
+class FakeSocket:
+    def __init__(self, delay):
+        self.delay = delay
+        self.latencies = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        message = json.loads(text)
+        if "sent_at" in message:
+            self.latencies.append(time.perf_counter() - message["sent_at"])
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+def report(label, sockets, elapsed, **extra):
+    fast = [l for s in sockets if not s.delay for l in s.latencies]
+    return {
+        "name": label,
+        "publish_seconds": round(elapsed, 3),
+        "fast_deliveries": len(fast),
+        "fast_p50_ms": round(percentile(fast, 50) * 1000, 2),
+        "fast_p99_ms": round(percentile(fast, 99) * 1000, 2),
+        "fast_max_ms": round(max(fast, default=0) * 1000, 2),
+        **extra,
+    }
+
+
+async def sequential(args, sockets):
+    # The loop broadcast_update used before the hub.
+    started = time.perf_counter()
+    for seq in range(args.messages):
+        text = json.dumps({"type": "inventory_update", "seq": seq, "sent_at": time.perf_counter()})
+        for connection in sockets:
+            await connection.send_text(text)
+        await asyncio.sleep(args.interval)
+    return time.perf_counter() - started
+
+
+async def hub_fanout(args, sockets, policy):
+    from broadcast import BroadcastHub
+    hub = BroadcastHub(queue_size=args.queue_size, policy=policy, send_timeout=args.send_timeout)
+    for socket in sockets:
+        await hub.connect(socket, ["inventory"])
+    started = time.perf_counter()
+    for seq in range(args.messages):
+        hub.publish("inventory", {"type": "inventory_update", "seq": seq, "sent_at": time.perf_counter()})
+        await asyncio.sleep(args.interval)
+    elapsed = time.perf_counter() - started
+    # Let fast clients drain; slow ones are left behind on purpose.
+    await asyncio.sleep(args.interval * 10 + 0.1)
+    stats = hub.stats()
+    await hub.close()
+    return elapsed, stats
+
+
+def make_sockets(args):
+    return [FakeSocket(args.slow_delay if i < args.slow else 0) for i in range(args.clients)]
+
+
+async def main(args):
+    results = []
+    for policy in ("coalesce", "disconnect"):
+        sockets = make_sockets(args)
+        elapsed, stats = await hub_fanout(args, sockets, policy)
+        results.append(report(f"hub_{policy}", sockets, elapsed, coalesced=stats["coalesced"], disconnected=stats["disconnected"]))
+    if not args.skip_sequential:
+        sockets = make_sockets(args)
+        results.append(report("sequential", sockets, await sequential(args, sockets)))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=50)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.01)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--send-timeout", type=float, default=10)
+    parser.add_argument("--skip-sequential", action="store_true", help="the old loop takes messages * slow * slow-delay seconds")
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(main(args))
@@ -0,0 +1,175 @@
+import asyncio
+import enum
+import json
+import os
+import uuid
+from collections import deque
+from datetime import date
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from starlette.websockets import WebSocket
+
+TOPICS = ("inventory", "alerts", "reports")
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "64"))
+# "coalesce" drops the oldest queued message and tells the client how many it missed;
+# "disconnect" closes a client whose queue overflows.
+WS_SLOW_POLICY = os.getenv("WS_SLOW_POLICY", "coalesce")
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# Recent events kept so reconnecting clients can resume with ?since=<seq>.
+WS_REPLAY_SIZE = int(os.getenv("WS_REPLAY_SIZE", "1024"))
+
+
+def json_default(value):
+    """Encode enums and datetimes in messages the way the HTTP API does."""
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscriber:
+    """One WebSocket connection with its own bounded outgoing queue and sender task."""
+
+    def __init__(self, hub, websocket: "WebSocket", topics):
+        self.hub = hub
+        self.websocket = websocket
+        self.topics = set(topics)
+        self.queue = deque()
+        self.skipped = 0
+        self._ready = asyncio.Event()
+        self.task = None
+
+    def offer(self, text: str):
+        """Queue an already-serialized message without waiting; returns False if the client must go."""
+        if len(self.queue) >= self.hub.queue_size:
+            if self.hub.policy == "disconnect":
+                return False
+            self.queue.popleft()
+            self.skipped += 1
+            self.hub.coalesced += 1
+        self.queue.append(text)
+        self._ready.set()
+        return True
+
+    async def run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self.queue:
+                    if self.skipped:
+                        lagged, self.skipped = json.dumps({"type": "lagged", "skipped": self.skipped}), 0
+                        await asyncio.wait_for(self.websocket.send_text(lagged), self.hub.send_timeout)
+                    await asyncio.wait_for(self.websocket.send_text(self.queue.popleft()), self.hub.send_timeout)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Send timeouts and closed sockets both end the subscription.
+            self.hub.drop(self)
+
+
+class BroadcastHub:
+    """Fans messages out to WebSocket subscribers by topic.
+
+    ``publish`` serializes once and only appends to per-client queues, so a
+    stalled client never delays the publisher or the other clients.
+
+    Every event is stamped with an increasing ``seq`` and this process's
+    ``epoch``. A client that reconnects with both gets the events it missed
+    from the replay buffer, or a ``resync`` telling it to reload a snapshot
+    when the buffer no longer reaches back that far.
+    """
+
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_POLICY, send_timeout: float = WS_SEND_TIMEOUT_SECONDS,
+                 replay_size: int = WS_REPLAY_SIZE):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.replay = deque(maxlen=replay_size)
+        self.subscribers = set()
+        self.published = 0
+        self.coalesced = 0
+        self.disconnected = 0
+
+    async def connect(self, websocket: "WebSocket", topics=TOPICS, since: int = None, epoch: str = None):
+        await websocket.accept()
+        subscriber = Subscriber(self, websocket, topics)
+        if since is not None:
+            missed = self.since(since, epoch, subscriber.topics)
+            if missed is None:
+                subscriber.queue.append(self._position("resync"))
+            else:
+                subscriber.queue.extend(missed)
+        subscriber.queue.append(self._position("hello"))
+        subscriber._ready.set()
+        subscriber.task = asyncio.create_task(subscriber.run())
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def since(self, seq: int, epoch: str, topics):
+        """Serialized events after ``seq`` for ``topics``, or None when they cannot be replayed."""
+        if epoch != self.epoch or seq > self.seq:
+            return None
+        if seq < self.seq and (not self.replay or self.replay[0][0] > seq + 1):
+            return None
+        return [text for event_seq, topic, text in self.replay if event_seq > seq and topic in topics]
+
+    def _position(self, kind: str):
+        return json.dumps({"type": kind, "seq": self.seq, "epoch": self.epoch})
+
+    def disconnect(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.discard(subscriber)
+            if subscriber.task and subscriber.task is not asyncio.current_task():
+                subscriber.task.cancel()
+
+    def drop(self, subscriber: Subscriber):
+        """Disconnect a slow or broken client and close its socket in the background."""
+        if subscriber in self.subscribers:
+            self.disconnected += 1
+            self.disconnect(subscriber)
+            asyncio.get_running_loop().create_task(self._close(subscriber.websocket))
+
+    async def _close(self, websocket: "WebSocket"):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def publish(self, topic: str, message: dict):
+        """Stamp ``message`` with the next sequence number, serialize it once and queue it for every subscriber of ``topic``."""
+        self.seq += 1
+        text = json.dumps({**message, "seq": self.seq, "epoch": self.epoch}, default=json_default)
+        self.replay.append((self.seq, topic, text))
+        self.published += 1
+        delivered = 0
+        for subscriber in list(self.subscribers):
+            if topic in subscriber.topics:
+                if subscriber.offer(text):
+                    delivered += 1
+                else:
+                    self.drop(subscriber)
+        return delivered
+
+    def stats(self):
+        return {
+            "seq": self.seq,
+            "replay": len(self.replay),
+            "subscribers": len(self.subscribers),
+            "by_topic": {topic: sum(topic in s.topics for s in self.subscribers) for topic in TOPICS},
+            "queued": sum(len(s.queue) for s in self.subscribers),
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "disconnected": self.disconnected,
+        }
+
+    async def close(self):
+        for subscriber in list(self.subscribers):
+            self.disconnect(subscriber)
+
+
+hub = BroadcastHub()
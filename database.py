@@ -1,11 +1,76 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import create_engine, event, inspect, text, MetaData, Column, Integer, String, Float, Date, DateTime, ForeignKey, Enum, Index
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy.schema import CreateColumn, CreateTable
 import enum
-
-DATABASE_URL = "sqlite:///kindergarten_meal.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+import os
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///kindergarten_meal.db")
+
+# SQLite pragmas applied to every new connection. WAL lets readers run alongside the writer.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Connection pool and server-side limits for Postgres.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+# Drivers used by the async engine for each sync URL scheme.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_engine/create_async_engine for ``url``."""
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}} if "aiosqlite" not in url else {}
+    statement_timeout = str(DB_STATEMENT_TIMEOUT_MS)
+    if "asyncpg" in url:
+        connect_args = {"server_settings": {"statement_timeout": statement_timeout}}
+    else:
+        connect_args = {"options": f"-c statement_timeout={statement_timeout}"}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
+    }
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+# The sync engine is kept for scripts and the Celery worker; request handlers use the async one.
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
 Base = declarative_base()
 
 class Role(enum.Enum):
@@ -21,6 +86,10 @@ class AlertType(enum.Enum):
     LOW_STOCK = "low_stock"
     DISCREPANCY = "discrepancy"
 
+class AlertStatus(enum.Enum):
+    OPEN = "open"
+    RESOLVED = "resolved"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -85,6 +154,8 @@ class MealServing(Base):
     meal = relationship("Meal", back_populates="servings")
     user = relationship("User", back_populates="meal_servings")
 
+    __table_args__ = (Index("ix_meal_servings_created_at_id", "created_at", "id"),)
+
 class InventoryTransaction(Base):
     __tablename__ = "inventory_transactions"
 
@@ -101,6 +172,11 @@ class InventoryTransaction(Base):
     user = relationship("User", back_populates="inventory_transactions")
     meal_serving = relationship("MealServing")
 
+    __table_args__ = (
+        Index("ix_inventory_transactions_ingredient_created_at", "ingredient_id", "created_at"),
+        Index("ix_inventory_transactions_created_at", "created_at"),
+    )
+
 class MonthlyReport(Base):
     __tablename__ = "monthly_reports"
 
@@ -116,16 +192,118 @@ class Alert(Base):
     __tablename__ = "alerts"
 
     id = Column(Integer, primary_key=True, index=True)
-    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=False)
+    # Discrepancy alerts are not tied to a single ingredient.
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=True)
     alert_type = Column(Enum(AlertType), nullable=False)
     message = Column(String, nullable=False)
+    # Rows that predate alert states count as resolved, so they never block a new open alert.
+    status = Column(Enum(AlertStatus), nullable=False, default=AlertStatus.OPEN, server_default=AlertStatus.RESOLVED.name)
+    occurrences = Column(Integer, nullable=False, default=1, server_default="1")
+    last_seen_at = Column(DateTime, nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     ingredient = relationship("Ingredient", back_populates="alerts")
 
+    __table_args__ = (
+        Index("ix_alerts_type_created_at", "alert_type", "created_at"),
+        Index("ix_alerts_ingredient_type", "ingredient_id", "alert_type"),
+        Index("ix_alerts_status_created_at", "status", "created_at"),
+        # At most one open alert per (ingredient, type); repeats update its counter instead.
+        Index("uq_alerts_open", "ingredient_id", "alert_type", unique=True,
+              sqlite_where=text("status = 'OPEN'"), postgresql_where=text("status = 'OPEN'")),
+    )
+
+class ResourceVersion(Base):
+    __tablename__ = "resource_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# Daily rollups maintained alongside every serving so reports read a handful of rows.
+# No foreign keys: history outlives deleted meals and ingredients.
+class DailyMealServing(Base):
+    __tablename__ = "daily_meal_servings"
+
+    day = Column(Date, primary_key=True)
+    meal_id = Column(Integer, primary_key=True)
+    portions = Column(Integer, nullable=False, default=0)
+
+class DailyIngredientUsage(Base):
+    __tablename__ = "daily_ingredient_usage"
+
+    day = Column(Date, primary_key=True)
+    ingredient_id = Column(Integer, primary_key=True)
+    grams = Column(Float, nullable=False, default=0.0)
+
+# Periodic copies of every ingredient's stock; point-in-time queries replay the ledger from the nearest one.
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+
+    taken_at = Column(DateTime, primary_key=True)
+    ingredient_id = Column(Integer, primary_key=True)
+    quantity_grams = Column(Float, nullable=False)
+
+def add_missing_columns(bind):
+    """Add columns introduced after a table was created; they must be nullable or have a server default."""
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    if hasattr(column.type, "create"):
+                        column.type.create(conn, checkfirst=True)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=bind.dialect)}"))
+
+def relax_not_null(bind):
+    """Drop NOT NULL from columns the models have since made nullable.
+
+    Postgres alters the column in place. SQLite cannot, so the table is
+    rebuilt: created under a new name, copied, and swapped in.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            relaxed = [
+                column.name for column in table.columns
+                if column.nullable and not column.primary_key and column.name in existing and not existing[column.name]["nullable"]
+            ]
+            if not relaxed:
+                continue
+            if bind.dialect.name == "sqlite":
+                # Copy every table so the rebuilt one's foreign keys resolve.
+                scratch = MetaData()
+                for other in Base.metadata.sorted_tables:
+                    other.to_metadata(scratch)
+                copy = table.to_metadata(scratch, name=f"{table.name}_rebuild")
+                columns = ", ".join(column.name for column in table.columns if column.name in existing)
+                conn.execute(CreateTable(copy))
+                conn.execute(text(f"INSERT INTO {copy.name} ({columns}) SELECT {columns} FROM {table.name}"))
+                conn.execute(text(f"DROP TABLE {table.name}"))
+                conn.execute(text(f"ALTER TABLE {copy.name} RENAME TO {table.name}"))
+            else:
+                for name in relaxed:
+                    conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL"))
+
+def migrate(bind):
+    """Bring an existing database up to the current models; safe to run repeatedly."""
+    add_missing_columns(bind)
+    relax_not_null(bind)
+    # create_all skips tables that already exist, so add indexes introduced later explicitly.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
 def populate_sample_data():
     db = SessionLocal()
@@ -198,12 +376,23 @@ def populate_sample_data():
     finally:
         db.close()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def begin_savepoint(db: AsyncSession):
+    """``db.begin_nested()`` that is safe as the first statement of a SQLite transaction.
+
+    The sqlite3 driver only opens a transaction on the first write, so a
+    SAVEPOINT sent before one would itself be the outermost transaction and
+    releasing it would commit everything. Open the transaction first.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        conn = await db.connection()
+        raw = await conn.get_raw_connection()
+        if not raw.driver_connection.in_transaction:
+            await conn.exec_driver_sql("BEGIN")
+    return await db.begin_nested()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 if __name__ == "__main__":
     init_db()
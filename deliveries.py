@@ -0,0 +1,219 @@
+"""Bulk delivery import from supplier manifests.
+
+A manifest is CSV with a header row, NDJSON, or a JSON array, one delivery per
+line: ``name``, ``quantity_grams`` and optionally ``minimum_quantity`` (used when
+the ingredient is new) and ``delivery_date``. The body is parsed and validated
+as it streams in, into compact per-line arrays; nothing is written until the
+whole manifest is valid, so the write transaction stays short.
+"""
+import codecs
+import csv
+import math
+import os
+from array import array
+from datetime import datetime
+from typing import NamedTuple
+import orjson
+from sqlalchemy import select, insert, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from alerts import alert_pipeline
+from database import Ingredient, InventoryTransaction, TransactionType
+from inventory import detect_low_stock
+
+DELIVERY_CHUNK_SIZE = int(os.getenv("DELIVERY_CHUNK_SIZE", "5000"))
+DELIVERY_MAX_LINES = int(os.getenv("DELIVERY_MAX_LINES", "500000"))
+DELIVERY_MAX_ERRORS = 20
+MANIFEST_FORMATS = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/json": "json"}
+DEFAULT_MINIMUM = Ingredient.minimum_quantity.default.arg
+
+
+class Manifest:
+    """Validated manifest lines: one entry per distinct ingredient name plus two arrays per line."""
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.minimums = []
+        self.delivery_dates = []
+        self.line_ingredient = array("i")
+        self.line_grams = array("d")
+        self.errors = []
+
+    def __len__(self):
+        return len(self.line_grams)
+
+    def error(self, line: int, message: str):
+        if len(self.errors) < DELIVERY_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def add(self, line: int, record):
+        if not isinstance(record, dict):
+            return self.error(line, "expected an object")
+        name = str(record.get("name") or "").strip()
+        if not name:
+            return self.error(line, "name is required")
+        try:
+            grams = float(record.get("quantity_grams"))
+            minimum = record.get("minimum_quantity")
+            minimum = float(minimum) if minimum not in (None, "") else None
+            delivered = record.get("delivery_date")
+            delivered = datetime.fromisoformat(delivered) if delivered else None
+        except (TypeError, ValueError) as e:
+            return self.error(line, f"invalid value: {e}")
+        if not math.isfinite(grams) or grams <= 0:
+            return self.error(line, "quantity_grams must be positive")
+        if minimum is not None and (not math.isfinite(minimum) or minimum < 0):
+            return self.error(line, "minimum_quantity must not be negative")
+        if len(self) >= DELIVERY_MAX_LINES:
+            return self.error(line, f"manifest exceeds {DELIVERY_MAX_LINES} lines")
+        position = self.index.get(name)
+        if position is None:
+            position = self.index[name] = len(self.names)
+            self.names.append(name)
+            self.minimums.append(minimum)
+            self.delivery_dates.append(delivered)
+        else:
+            if minimum is not None:
+                self.minimums[position] = minimum
+            if delivered and (self.delivery_dates[position] is None or delivered > self.delivery_dates[position]):
+                self.delivery_dates[position] = delivered
+        self.line_ingredient.append(position)
+        self.line_grams.append(grams)
+
+
+def manifest_format(content_type: str):
+    return MANIFEST_FORMATS.get(content_type.split(";")[0].strip().lower())
+
+
+async def _lines(chunks):
+    """Decode a byte stream into text lines without holding more than one chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def read_manifest(chunks, fmt: str):
+    """Parse and validate a manifest body in format ``csv``, ``ndjson`` or ``json`` (an array, or NDJSON)."""
+    manifest = Manifest()
+    lines = _lines(chunks)
+    if fmt == "csv":
+        header = None
+        number = 0
+        async for text in lines:
+            number += 1
+            if not text.strip():
+                continue
+            fields = next(csv.reader([text]))
+            if header is None:
+                header = [field.strip().lower() for field in fields]
+                if "name" not in header or "quantity_grams" not in header:
+                    manifest.error(number, "header must include name and quantity_grams")
+                    break
+                continue
+            manifest.add(number, dict(zip(header, fields)))
+        return manifest
+    number = 0
+    async for text in lines:
+        number += 1
+        stripped = text.strip()
+        if not stripped:
+            continue
+        if number == 1 and stripped.startswith("["):
+            # A JSON array cannot be split into lines; read the rest and parse it at once.
+            rest = [text]
+            async for more in lines:
+                rest.append(more)
+            try:
+                records = orjson.loads("\n".join(rest))
+            except orjson.JSONDecodeError as e:
+                manifest.error(1, f"invalid JSON: {e}")
+                return manifest
+            for position, record in enumerate(records, 1):
+                manifest.add(position, record)
+            return manifest
+        try:
+            manifest.add(number, orjson.loads(stripped))
+        except orjson.JSONDecodeError as e:
+            manifest.error(number, f"invalid JSON: {e}")
+    return manifest
+
+
+class DeliveryResult(NamedTuple):
+    ingredient_ids: list
+    created: int
+    alerts: list
+    resolved: list
+
+
+def _chunks(items, size=DELIVERY_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def apply_manifest(db: AsyncSession, user_id: int, manifest: Manifest):
+    """Upsert ingredients by name, write one DELIVERY ledger row per line and add the totals to stock; the caller commits."""
+    now = datetime.now()
+    ids = {}
+    for names in _chunks(manifest.names):
+        ids.update((await db.execute(select(Ingredient.name, Ingredient.id).where(Ingredient.name.in_(names)))).all())
+    missing = [position for position, name in enumerate(manifest.names) if name not in ids]
+    created_ids = []
+    for positions in _chunks(missing):
+        # Names are unique, so map the new ids by name; ordered RETURNING would force row-at-a-time inserts on SQLite.
+        created = (await db.execute(
+            insert(Ingredient).returning(Ingredient.id, Ingredient.name),
+            [
+                {
+                    "name": manifest.names[position],
+                    "quantity_grams": 0.0,
+                    "minimum_quantity": DEFAULT_MINIMUM if manifest.minimums[position] is None else manifest.minimums[position],
+                    "delivery_date": manifest.delivery_dates[position] or now,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for position in positions
+            ],
+        )).all()
+        ids.update((name, ingredient_id) for ingredient_id, name in created)
+        created_ids.extend(ingredient_id for ingredient_id, _ in created)
+    by_position = [ids[name] for name in manifest.names]
+
+    for start in range(0, len(manifest), DELIVERY_CHUNK_SIZE):
+        await db.execute(insert(InventoryTransaction), [
+            {
+                "ingredient_id": by_position[position],
+                "quantity_change_grams": grams,
+                "user_id": user_id,
+                "transaction_type": TransactionType.DELIVERY,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for position, grams in zip(manifest.line_ingredient[start:start + DELIVERY_CHUNK_SIZE], manifest.line_grams[start:start + DELIVERY_CHUNK_SIZE])
+        ])
+
+    totals = [0.0] * len(manifest.names)
+    for position, grams in zip(manifest.line_ingredient, manifest.line_grams):
+        totals[position] += grams
+    table = Ingredient.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("ingredient_id"))
+        .values(quantity_grams=table.c.quantity_grams + bindparam("grams"), delivery_date=bindparam("delivered"), updated_at=now),
+        [
+            {"ingredient_id": by_position[position], "grams": total, "delivered": manifest.delivery_dates[position] or now}
+            for position, total in enumerate(totals)
+        ],
+    )
+    alerts, resolved = [], []
+    for chunk in _chunks(created_ids):
+        alerts.extend(await detect_low_stock(db, chunk))
+    for chunk in _chunks(by_position):
+        resolved.extend(await alert_pipeline.resolve(db, chunk))
+    return DeliveryResult(by_position, len(created_ids), alerts, resolved)
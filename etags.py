@@ -0,0 +1,134 @@
+"""Conditional GET for list endpoints.
+
+Writes bump per-resource counters in ``resource_versions`` in the same
+transaction. A list response's strong ETag is derived from the counters it
+depends on plus the request path and query, so a client polling with
+``If-None-Match`` gets a 304 as long as nothing changed. Each worker re-reads
+the counters at most once per ``ETAG_VERSION_CHECK_SECONDS`` (or right after
+its own writes), so most revalidations never touch the database. Serialized
+bodies are kept briefly per version so repeated full fetches skip the query
+and the JSON encoding too.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ResourceVersion
+
+if TYPE_CHECKING:
+    from starlette.requests import Request
+
+ETAG_VERSION_CHECK_SECONDS = float(os.getenv("ETAG_VERSION_CHECK_SECONDS", "1.0"))
+ETAG_BODY_CACHE_SECONDS = float(os.getenv("ETAG_BODY_CACHE_SECONDS", "30"))
+ETAG_BODY_CACHE_SIZE = int(os.getenv("ETAG_BODY_CACHE_SIZE", "256"))
+
+# Counter names in resource_versions, next to RecipeCatalog.resource ("recipes").
+INGREDIENTS = "ingredients"
+SERVINGS = "servings"
+REPORTS = "reports"
+
+# Clients must revalidate every time, but may keep the body to reuse on a 304.
+CACHE_CONTROL = "private, no-cache"
+
+
+class VersionTracker:
+    """This worker's view of the resource version counters."""
+
+    def __init__(self, check_interval: float = ETAG_VERSION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self.versions = {}
+        self.checked_at = None
+        self.refreshes = 0
+
+    async def current(self, db: AsyncSession, names):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval:
+            self.versions = dict((await db.execute(select(ResourceVersion.name, ResourceVersion.version))).all())
+            self.checked_at = time.monotonic()
+            self.refreshes += 1
+        return tuple(self.versions.get(name, 0) for name in names)
+
+    def expire(self):
+        """Re-read the counters on the next request; call after committing a write."""
+        self.checked_at = None
+
+
+class BodyCache:
+    """Small LRU of serialized response bodies with a time limit."""
+
+    def __init__(self, ttl: float = ETAG_BODY_CACHE_SECONDS, max_entries: int = ETAG_BODY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+version_tracker = VersionTracker()
+body_cache = BodyCache()
+
+
+def make_etag(key) -> str:
+    return '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:20] + '"'
+
+
+def matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches.
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def conditional_json(request: "Request", db: AsyncSession, resources, build):
+    """Answer a GET from ``resources``' versions: 304, a cached body, or ``await build(response)``.
+
+    ``build`` receives a scratch Response for headers such as the next-page
+    cursor; they are cached along with the body.
+    """
+    # Imported here so Celery workers, which only need the counters, never load Starlette.
+    from starlette.responses import Response
+
+    key = (request.url.path, request.url.query, await version_tracker.current(db, resources))
+    etag = make_etag(key)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if matches(request.headers.get("if-none-match", ""), etag):
+        body_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    cached = body_cache.get(key)
+    if cached is None:
+        scratch = Response()
+        data = await build(scratch)
+        cached = (orjson.dumps(data), {name: value for name, value in scratch.headers.items() if name != "content-length"})
+        body_cache.put(key, cached)
+    body, extra = cached
+    return Response(body, media_type="application/json", headers={**extra, **headers})
+
+
+def stats():
+    return {
+        "versions": version_tracker.versions,
+        "refreshes": version_tracker.refreshes,
+        "body_hits": body_cache.hits,
+        "body_misses": body_cache.misses,
+        "not_modified": body_cache.not_modified,
+        "bodies": len(body_cache.entries),
+    }
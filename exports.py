@@ -0,0 +1,113 @@
+import csv
+import enum
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from sqlalchemy import select, exists
+from database import AsyncSessionLocal, Ingredient, InventoryTransaction, Meal, MealIngredient, MealServing, User
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+TRANSACTION_COLUMNS = [
+    InventoryTransaction.id,
+    InventoryTransaction.created_at,
+    InventoryTransaction.transaction_type,
+    InventoryTransaction.ingredient_id,
+    Ingredient.name.label("ingredient"),
+    InventoryTransaction.quantity_change_grams,
+    InventoryTransaction.meal_serving_id,
+    MealServing.meal_id,
+    InventoryTransaction.user_id,
+]
+
+SERVING_COLUMNS = [
+    MealServing.id,
+    MealServing.created_at,
+    MealServing.meal_id,
+    Meal.name.label("meal"),
+    MealServing.portions_served,
+    MealServing.user_id,
+    User.full_name.label("user"),
+]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def transactions_query(start=None, end=None, ingredient_id=None, meal_id=None):
+    query = (
+        select(*TRANSACTION_COLUMNS)
+        .outerjoin(Ingredient, Ingredient.id == InventoryTransaction.ingredient_id)
+        .outerjoin(MealServing, MealServing.id == InventoryTransaction.meal_serving_id)
+    )
+    if start is not None:
+        query = query.where(InventoryTransaction.created_at >= start)
+    if end is not None:
+        query = query.where(InventoryTransaction.created_at < end)
+    if ingredient_id is not None:
+        query = query.where(InventoryTransaction.ingredient_id == ingredient_id)
+    if meal_id is not None:
+        query = query.where(MealServing.meal_id == meal_id)
+    return query.order_by(InventoryTransaction.id)
+
+
+def servings_query(start=None, end=None, ingredient_id=None, meal_id=None):
+    query = (
+        select(*SERVING_COLUMNS)
+        .outerjoin(Meal, Meal.id == MealServing.meal_id)
+        .outerjoin(User, User.id == MealServing.user_id)
+    )
+    if start is not None:
+        query = query.where(MealServing.created_at >= start)
+    if end is not None:
+        query = query.where(MealServing.created_at < end)
+    if meal_id is not None:
+        query = query.where(MealServing.meal_id == meal_id)
+    if ingredient_id is not None:
+        # Servings of any meal whose recipe uses the ingredient
+        query = query.where(exists().where(MealIngredient.meal_id == MealServing.meal_id, MealIngredient.ingredient_id == ingredient_id))
+    return query.order_by(MealServing.id)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _ndjson(fields, rows):
+    return "".join(json.dumps(dict(zip(fields, map(_plain, row)))) + "\n" for row in rows)
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_plain(v) for v in row] for row in rows)
+    return buffer.getvalue()
+
+
+async def stream_rows(query, fmt="ndjson", compress=False, batch_size=None):
+    """Yield ``query`` as NDJSON or CSV chunks, one chunk per ``yield_per`` batch.
+
+    The generator opens its own session because it outlives the request's
+    ``get_db`` dependency, and only one batch of rows is held at a time.
+    """
+    fields = [c.key for c in query.selected_columns]
+    gzip = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(text):
+        data = text.encode()
+        return gzip.compress(data) if gzip else data
+
+    if fmt == "csv":
+        yield emit(_csv([fields]))
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size or EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            chunk = emit(_csv(rows) if fmt == "csv" else _ndjson(fields, rows))
+            if chunk:
+                yield chunk
+    if gzip:
+        yield gzip.flush()
@@ -0,0 +1,198 @@
+"""Consumption rates and projected days until stockout for every ingredient.
+
+Daily consumption comes from the CONSUMPTION ledger through its daily rollups
+(``daily_ingredient_usage``, written in the serving transaction), so the cost
+depends on ingredients x window days and not on the size of the ledger. The
+last ``FORECAST_WINDOW_DAYS`` complete days are held as one NumPy matrix, and
+the rolling means and the exponentially weighted mean are a single vectorized
+pass over it. Today's partial day is left out of the rates; it is already
+reflected in the stock.
+
+Completed days never change, so the window is read in full only once. When
+the date changes the matrix shifts and only the newly completed days are read.
+Stock levels are re-read when the ingredient version counter moves, at most
+once per ``FORECAST_REFRESH_SECONDS``. After a rollup backfill, call
+``invalidate()`` or restart the process.
+"""
+import asyncio
+import os
+import time
+from datetime import date, timedelta
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import DailyIngredientUsage, Ingredient
+
+FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", "28"))
+FORECAST_SHORT_WINDOW_DAYS = int(os.getenv("FORECAST_SHORT_WINDOW_DAYS", "7"))
+FORECAST_HALFLIFE_DAYS = float(os.getenv("FORECAST_HALFLIFE_DAYS", "7"))
+FORECAST_REFRESH_SECONDS = float(os.getenv("FORECAST_REFRESH_SECONDS", "10"))
+
+
+def _numbers(values, digits=1):
+    """Rounded Python floats, with None where there is no finite value (no usage, never runs out)."""
+    rounded = np.round(values, digits)
+    return [value if finite else None for value, finite in zip(rounded.tolist(), np.isfinite(rounded).tolist())]
+
+
+class ConsumptionForecast:
+    """Per-ingredient daily usage over a sliding window of days, plus current stock, as NumPy arrays.
+
+    Row ``i`` of ``usage`` belongs to ingredient ``ids[i]`` (sorted); column ``j``
+    is the day ``first_day + j``, so the last column is yesterday.
+    """
+
+    def __init__(self, window_days: int = FORECAST_WINDOW_DAYS, short_days: int = FORECAST_SHORT_WINDOW_DAYS,
+                 halflife_days: float = FORECAST_HALFLIFE_DAYS, refresh_seconds: float = FORECAST_REFRESH_SECONDS):
+        self.window_days = window_days
+        self.short_days = min(short_days, window_days)
+        self.halflife_days = halflife_days
+        self.refresh_seconds = refresh_seconds
+        self.first_day = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.usage = np.zeros((0, window_days))
+        self.names = []
+        self.stock = np.zeros(0)
+        self.minimum = np.zeros(0)
+        self.created = np.zeros(0, dtype=np.int64)
+        self.stock_version = None
+        self.stock_loaded_at = None
+        self._result = None
+        self._refreshing = asyncio.Lock()
+        self.full_loads = 0
+        self.day_loads = 0
+        self.stock_loads = 0
+        self.hits = 0
+
+    def invalidate(self):
+        """Read the whole window and the stock again on the next refresh."""
+        self.first_day = None
+        self.stock_loaded_at = None
+
+    def needs_refresh(self, today: date, version):
+        if self.first_day is None or self.first_day + timedelta(days=self.window_days) != today:
+            return True
+        if self.stock_loaded_at is None:
+            return True
+        return version != self.stock_version and time.monotonic() - self.stock_loaded_at >= self.refresh_seconds
+
+    async def ensure_fresh(self, db: AsyncSession, today: date, version):
+        # One refresh at a time: the reads yield to other requests, which must not shift the window again.
+        if self.needs_refresh(today, version):
+            async with self._refreshing:
+                if self.needs_refresh(today, version):
+                    await db.run_sync(self.refresh, today, version)
+
+    def refresh(self, db: Session, today: date, version):
+        """Bring stock up to ``version`` and the window up to ``today``, reading as little as possible."""
+        if self.stock_loaded_at is None or (version != self.stock_version and time.monotonic() - self.stock_loaded_at >= self.refresh_seconds):
+            self._load_stock(db, version)
+        first_day = today - timedelta(days=self.window_days)
+        if self.first_day is None or not 0 <= (first_day - self.first_day).days < self.window_days:
+            self.usage[:] = 0.0
+            self.first_day = first_day
+            self._load_usage(db, first_day, today)
+            self.full_loads += 1
+        elif first_day != self.first_day:
+            shift = (first_day - self.first_day).days
+            self.usage = np.roll(self.usage, -shift, axis=1)
+            self.usage[:, -shift:] = 0.0
+            completed_from = self.first_day + timedelta(days=self.window_days)
+            self.first_day = first_day
+            self._load_usage(db, completed_from, today)
+            self.day_loads += 1
+        self._result = None
+
+    def _load_stock(self, db: Session, version):
+        rows = db.execute(
+            select(Ingredient.id, Ingredient.name, Ingredient.quantity_grams, Ingredient.minimum_quantity, Ingredient.created_at).order_by(Ingredient.id)
+        ).all()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        if not np.array_equal(ids, self.ids):
+            # Keep the history of known ingredients; new ones get theirs read once.
+            usage = np.zeros((len(ids), self.window_days))
+            known = np.zeros(len(ids), dtype=bool)
+            if len(self.ids):
+                rows_before = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+                known = self.ids[rows_before] == ids
+                usage[known] = self.usage[rows_before[known]]
+            self.ids, self.usage = ids, usage
+            if self.first_day is not None and not known.all():
+                self._load_usage(db, self.first_day, self.first_day + timedelta(days=self.window_days), ids[~known].tolist())
+        self.names = [row[1] for row in rows]
+        self.stock = np.array([row[2] or 0.0 for row in rows], dtype=np.float64)
+        self.minimum = np.array([row[3] or 0.0 for row in rows], dtype=np.float64)
+        # Ingredients without a creation time count as older than the window.
+        self.created = np.array([row[4].toordinal() if row[4] else 0 for row in rows], dtype=np.int64)
+        self.stock_version = version
+        self.stock_loaded_at = time.monotonic()
+        self.stock_loads += 1
+
+    def _load_usage(self, db: Session, start: date, end: date, ingredient_ids=None):
+        """Fill the columns for days ``[start, end)`` from the rollups."""
+        query = select(DailyIngredientUsage.ingredient_id, DailyIngredientUsage.day, DailyIngredientUsage.grams).where(
+            DailyIngredientUsage.day >= start, DailyIngredientUsage.day < end)
+        if ingredient_ids is not None:
+            query = query.where(DailyIngredientUsage.ingredient_id.in_(ingredient_ids))
+        rows = db.execute(query).all()
+        if not rows or not len(self.ids):
+            return
+        ingredient_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        columns = np.fromiter(((row[1] - self.first_day).days for row in rows), dtype=np.int64, count=len(rows))
+        grams = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        positions = np.minimum(np.searchsorted(self.ids, ingredient_ids), len(self.ids) - 1)
+        # Rollups of deleted ingredients have no row.
+        present = self.ids[positions] == ingredient_ids
+        self.usage[positions[present], columns[present]] = grams[present]
+
+    def _compute(self, today: date):
+        window = self.window_days
+        # Days of the window each ingredient existed for, so new ingredients are not averaged over empty days.
+        age = np.clip(today.toordinal() - self.created, 0, window)
+        decay = 0.5 ** (1 / self.halflife_days)
+        weights = (1 - decay) * decay ** np.arange(window - 1, -1, -1)
+        covered = np.concatenate(([0.0], np.cumsum(weights[::-1])))[age]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ewma = np.where(covered > 0, self.usage @ weights / covered, np.nan)
+            short = np.where(age > 0, self.usage[:, -self.short_days:].sum(axis=1) / np.minimum(age, self.short_days), np.nan)
+            long = np.where(age > 0, self.usage.sum(axis=1) / age, np.nan)
+            until_stockout = np.where(ewma > 0, np.maximum(self.stock, 0) / ewma, np.inf)
+            until_minimum = np.where(ewma > 0, np.maximum(self.stock - self.minimum, 0) / ewma, np.inf)
+        order = np.argsort(until_stockout, kind="stable")
+        # Beyond this the date would overflow; such slow movers get no stockout date.
+        horizon = (date.max - today).days
+        days = _numbers(until_stockout[order], 2)
+        columns = zip(
+            self.ids[order].tolist(), [self.names[i] for i in order.tolist()], _numbers(self.stock[order]), _numbers(self.minimum[order]),
+            _numbers(ewma[order]), _numbers(short[order]), _numbers(long[order]), days, _numbers(until_minimum[order], 2),
+        )
+        rows = [{
+            "id": ingredient_id,
+            "name": name,
+            "quantity_grams": quantity,
+            "minimum_quantity": minimum,
+            "daily_grams": {"ewma": ewma_grams, f"rolling_{self.short_days}d": short_grams, f"rolling_{window}d": long_grams},
+            "days_until_stockout": until,
+            "stockout_date": today + timedelta(days=int(until)) if until is not None and until < horizon else None,
+            "days_until_minimum": to_minimum,
+        } for ingredient_id, name, quantity, minimum, ewma_grams, short_grams, long_grams, until, to_minimum in columns]
+        return today, until_stockout[order], rows
+
+    def forecast(self, today: date, within_days: float = None):
+        """Every ingredient, soonest stockout first; ``within_days`` keeps those running out within that many days."""
+        if self._result is None or self._result[0] != today:
+            self._result = self._compute(today)
+        else:
+            self.hits += 1
+        _, sorted_days, rows = self._result
+        if within_days is not None:
+            rows = rows[:int(np.searchsorted(sorted_days, within_days, side="right"))]
+        return {"as_of": today, "window_days": self.window_days, "halflife_days": self.halflife_days, "ingredients": rows}
+
+    def stats(self):
+        return {"ingredients": len(self.ids), "first_day": self.first_day, "stock_version": self.stock_version, "hits": self.hits,
+                "full_loads": self.full_loads, "day_loads": self.day_loads, "stock_loads": self.stock_loads}
+
+
+forecaster = ConsumptionForecast()
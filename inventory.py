@@ -0,0 +1,121 @@
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import select, update, insert, case, cast, func, literal, DateTime, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from alerts import ALERT_COLUMNS
+from database import begin_savepoint, Alert, AlertStatus, AlertType, Ingredient, InventoryTransaction, TransactionType
+
+
+class StockLevel(NamedTuple):
+    quantity_grams: float
+    minimum_quantity: float
+
+
+def add_demand(demand: dict, items, portions):
+    """Accumulate the grams needed for ``portions`` of a recipe into ``demand``."""
+    for ingredient_id, _, grams in items:
+        demand[ingredient_id] = demand.get(ingredient_id, 0.0) + grams * portions
+    return demand
+
+
+async def consume_stock(db: AsyncSession, demand: dict):
+    """Subtract ``{ingredient_id: grams}`` from stock with one guarded UPDATE.
+
+    Returns ``{ingredient_id: StockLevel}`` after the update when every
+    ingredient had enough stock, otherwise None with stock left unchanged:
+    the update runs in a savepoint that is rolled back, so other writes in
+    the same transaction survive.
+    """
+    if not demand:
+        return {}
+    required = case(demand, value=Ingredient.id)
+    savepoint = await begin_savepoint(db)
+    remaining = (await db.execute(
+        update(Ingredient)
+        .where(Ingredient.id.in_(list(demand)), Ingredient.quantity_grams >= required)
+        .values(quantity_grams=Ingredient.quantity_grams - required, updated_at=datetime.now())
+        .returning(Ingredient.id, Ingredient.quantity_grams, Ingredient.minimum_quantity)
+        .execution_options(synchronize_session=False)
+    )).all()
+    if len(remaining) != len(demand):
+        await savepoint.rollback()
+        return None
+    await savepoint.commit()
+    return {ingredient_id: StockLevel(quantity, minimum) for ingredient_id, quantity, minimum in remaining}
+
+
+def crossed_minimum(remaining: dict, demand: dict):
+    """Ingredients that ``consume_stock`` took from at-or-above to below their minimum."""
+    return [
+        ingredient_id for ingredient_id, level in remaining.items()
+        if level.quantity_grams < level.minimum_quantity <= level.quantity_grams + demand[ingredient_id]
+    ]
+
+
+async def find_shortfalls(db: AsyncSession, demand: dict):
+    """List the ingredients whose current stock cannot cover ``demand``."""
+    stock = {
+        ingredient_id: (name, quantity)
+        for ingredient_id, name, quantity in (await db.execute(
+            select(Ingredient.id, Ingredient.name, Ingredient.quantity_grams).where(Ingredient.id.in_(list(demand)))
+        )).all()
+    }
+    shortfalls = []
+    for ingredient_id, required in demand.items():
+        name, available = stock.get(ingredient_id, (None, 0.0))
+        if available < required:
+            shortfalls.append({"ingredient_id": ingredient_id, "ingredient": name, "required": required, "available": available})
+    return shortfalls
+
+
+async def record_consumption(db: AsyncSession, user_id: int, servings):
+    """Bulk-insert CONSUMPTION ledger rows for ``[(meal_serving_id, demand), ...]``."""
+    rows = [
+        {
+            "ingredient_id": ingredient_id,
+            "quantity_change_grams": -grams,
+            "user_id": user_id,
+            "meal_serving_id": meal_serving_id,
+            "transaction_type": TransactionType.CONSUMPTION,
+        }
+        for meal_serving_id, demand in servings
+        for ingredient_id, grams in demand.items()
+    ]
+    if rows:
+        await db.execute(insert(InventoryTransaction), rows)
+
+
+async def detect_low_stock(db: AsyncSession, ingredient_ids=None):
+    """Open LOW_STOCK alerts for ingredients below their minimum that have no open one yet.
+
+    One INSERT ... SELECT with an anti-join against open alerts, limited to
+    ``ingredient_ids`` when given. Returns the new alerts as rows; the caller commits.
+    """
+    now = datetime.now()
+    has_alert = (
+        select(Alert.id)
+        .where(Alert.ingredient_id == Ingredient.id, Alert.alert_type == AlertType.LOW_STOCK, Alert.status == AlertStatus.OPEN)
+        .exists()
+    )
+    low = (
+        select(
+            Ingredient.id,
+            literal(AlertType.LOW_STOCK, Alert.alert_type.type),
+            func.trim(Ingredient.name) + " below minimum " + cast(Ingredient.minimum_quantity, String) + "g",
+            literal(AlertStatus.OPEN, Alert.status.type),
+            literal(1),
+            literal(now, DateTime),
+            literal(now, DateTime),
+            literal(now, DateTime),
+        )
+        .where(Ingredient.quantity_grams < Ingredient.minimum_quantity, ~has_alert)
+    )
+    if ingredient_ids is not None:
+        if not ingredient_ids:
+            return []
+        low = low.where(Ingredient.id.in_(list(ingredient_ids)))
+    return (await db.execute(
+        insert(Alert)
+        .from_select(["ingredient_id", "alert_type", "message", "status", "occurrences", "last_seen_at", "created_at", "updated_at"], low)
+        .returning(*ALERT_COLUMNS)
+    )).all()
@@ -0,0 +1,62 @@
+"""Background jobs and the one Celery app shared by the web process and workers.
+
+Run a worker with:
+
+    celery -A jobs worker --loglevel=info
+
+This module only depends on ``database``, ``reporting`` and ``backplane``, so a
+worker never imports FastAPI, the templates or the auth stack. The web process
+imports it lazily, the first time it schedules a job.
+
+Jobs publish results (``report_update``) through the broadcast backplane. A
+worker is a separate process that never starts the in-process backplane, so
+workers must be given ``BROADCAST_BACKPLANE_URL=redis://...`` like the web
+workers; a worker started without it refuses to run rather than silently
+dropping every update.
+
+Set ``CELERY_TASK_ALWAYS_EAGER=1`` to run jobs inside the calling process,
+without a broker (development and the load suite).
+"""
+import os
+from datetime import datetime
+from typing import Optional
+from celery import Celery
+from celery.signals import worker_init
+from backplane import RedisBackplane, backplane
+from database import SessionLocal, init_db
+from reporting import generate_report, parse_month, report_row
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "") or None
+CELERY_TASK_ALWAYS_EAGER = os.getenv("CELERY_TASK_ALWAYS_EAGER", "0") == "1"
+# Reports take seconds each; prefetching more than one would park them behind a busy worker.
+CELERY_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
+
+celery_app = Celery("kindergarten", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery_app.conf.update(
+    task_always_eager=CELERY_TASK_ALWAYS_EAGER,
+    task_ignore_result=CELERY_RESULT_BACKEND is None,
+    # Regenerating a month replaces its report, so a job lost with its worker can safely run again.
+    task_acks_late=True,
+    worker_prefetch_multiplier=CELERY_PREFETCH_MULTIPLIER,
+    broker_connection_retry_on_startup=True,
+)
+
+
+@worker_init.connect
+def require_backplane(**kwargs):
+    if not isinstance(backplane, RedisBackplane):
+        raise RuntimeError("Celery workers need BROADCAST_BACKPLANE_URL=redis://... to deliver job results to web clients")
+
+
+@worker_init.connect
+def migrate_database(**kwargs):
+    init_db()
+
+
+@celery_app.task(name="generate_monthly_report")
+def generate_monthly_report(month: Optional[str] = None):
+    month_start = parse_month(month) if month else datetime.now()
+    with SessionLocal() as db:
+        report = report_row(generate_report(db, month_start))
+    backplane.publish_sync("reports", {"type": "report_update", "discrepancy": report["discrepancy"], "report": report})
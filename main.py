@@ -1,20 +1,41 @@
-import asyncio
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Request, Response, Query
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, exists, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from starlette.middleware.cors import CORSMiddleware
 
 import auth
-from database import SessionLocal, User, Ingredient, Meal, MealIngredient, MealServing, InventoryTransaction, MonthlyReport, Alert, Role, get_db
+from database import engine, async_engine, init_db, User, Ingredient, Meal, MealIngredient, MealServing, InventoryTransaction, MonthlyReport, Alert, AlertStatus, AlertType, Role, StockSnapshot, TransactionType, get_db
 from auth import get_current_user, router
-from datetime import datetime, timedelta
+from portions import estimator
+from recipes import RecipeCatalog, recipe_catalog, bump_version
+from etags import INGREDIENTS, REPORTS, SERVINGS, conditional_json, version_tracker
+import etags
+from exports import MEDIA_TYPES, stream_rows, transactions_query, servings_query
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset, paginate
+from alerts import alert_pipeline
+from backplane import backplane
+from broadcast import TOPICS, hub
+from inventory import add_demand, detect_low_stock
+from reporting import breakdown_queries, parse_month, remove_meal_rollups, report_row
+from serving import serve, serving_writer
+from stock import stock_at, stock_snapshotter
+from deliveries import apply_manifest, manifest_format, read_manifest
+from forecast import forecaster
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_ENABLED, METRICS_TOKEN, MetricsMiddleware, instrument_engine, metrics
+from profiling import ProfilerMiddleware, profiler, trace_queries
+from datetime import date, datetime, timedelta
 import json
-from celery import Celery
+import logging
+import os
+import orjson
 from typing import List, Optional
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
+logger = logging.getLogger(__name__)
 
 class IngredientCreate(BaseModel):
     name: str
@@ -39,62 +60,128 @@ class MealUpdate(BaseModel):
     ingredients: Optional[List[MealIngredientBase]] = None
 
 class ServeMealRequest(BaseModel):
-    portions: int
-
-app = FastAPI()
+    portions: int = Field(gt=0)
+
+class ServeBatchLine(BaseModel):
+    meal_id: int
+    portions: int = Field(gt=0)
+
+class ServeBatchRequest(BaseModel):
+    lines: List[ServeBatchLine]
+
+def ingredient_row(ing: Ingredient):
+    return {"id": ing.id, "name": ing.name, "quantity_grams": ing.quantity_grams, "minimum_quantity": ing.minimum_quantity, "delivery_date": ing.delivery_date}
+
+def alert_row(alert: Alert):
+    return {"id": alert.id, "type": alert.alert_type, "message": alert.message, "time": alert.created_at,
+            "status": alert.status, "occurrences": alert.occurrences, "last_seen": alert.last_seen_at}
+
+def stock_rows(remaining: dict):
+    return [{"id": ingredient_id, "quantity_grams": level.quantity_grams} for ingredient_id, level in remaining.items()]
+
+def shortfall_message(shortfalls):
+    if not shortfalls:
+        return "Stock changed while serving, please try again"
+    insufficient = [s["ingredient"] or f"ingredient #{s['ingredient_id']}" for s in shortfalls]
+    return f"Insufficient ingredients: {', '.join(insufficient)}"
+
+def publish_alerts(alerts, event="alert"):
+    for alert in alerts:
+        backplane.publish("alerts", {"type": event, "message": alert.message, "alert": alert_row(alert)})
+
+async def recipe_items(db: AsyncSession, ingredients: List[MealIngredientBase]):
+    """Resolve ingredient names so the recipe catalog can be patched without a reload."""
+    names = dict((await db.execute(select(Ingredient.id, Ingredient.name).where(Ingredient.id.in_([ing.ingredient_id for ing in ingredients])))).all())
+    return [(ing.ingredient_id, names.get(ing.ingredient_id), ing.quantity) for ing in ingredients]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creates missing tables and brings an older database file up to the current models.
+    init_db()
+    await backplane.start(hub.publish)
+    await alert_pipeline.start(publish_alerts)
+    await stock_snapshotter.start(publish_alerts)
+    yield
+    await stock_snapshotter.stop()
+    await serving_writer.stop()
+    await alert_pipeline.stop(publish_alerts)
+    await backplane.stop()
+    await hub.close()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
-celery_app = Celery('tasks', broker='redis://localhost:6379/0')
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-active_connections: List[WebSocket] = []
-templates = Jinja2Templates(directory="templates")
+_templates = None
+
+def page(name: str, request: Request):
+    # Jinja2 is loaded with the first HTML page rather than at startup.
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory="templates")
+    return _templates.TemplateResponse(name, {"request": request})
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER]
 )
+app.add_middleware(ProfilerMiddleware)
+if METRICS_ENABLED:
+    # Added last so it is outermost and times the other middleware too.
+    app.add_middleware(MetricsMiddleware)
+# Statement timing also feeds the slow-query log, so it stays on without METRICS_ENABLED.
+instrument_engine(async_engine.sync_engine)
+instrument_engine(engine)
+trace_queries(metrics)
+metrics.gauge("websocket_connections", "Open WebSocket connections.", lambda: len(hub.subscribers))
+metrics.gauge("broadcast_queue_depth", "Messages queued for WebSocket clients, summed over connections.", lambda: sum(len(s.queue) for s in hub.subscribers))
+metrics.gauge("backplane_pending_messages", "Broadcasts waiting for the next backplane tick.", lambda: len(backplane.pending))
+metrics.gauge("serving_queue_depth", "Serve orders waiting for the group-commit writer.", lambda: serving_writer.queue.qsize() if serving_writer.queue else 0)
 @app.get("/register", response_class=HTMLResponse)
 async def get_register(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request})
+    return page("register.html", request)
 
 @app.get("/", response_class=HTMLResponse)
 async def get_login(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return page("index.html", request)
 
 @app.get("/home", response_class=HTMLResponse)
 async def get_home(request: Request):
-    return templates.TemplateResponse("home.html", {"request": request})
+    return page("home.html", request)
 
 @app.get("/ingredients", response_class=HTMLResponse)
 async def get_ingredients_page(request: Request):
-    return templates.TemplateResponse("ingredients.html", {"request": request})
+    return page("ingredients.html", request)
 
 @app.get("/meals", response_class=HTMLResponse)
 async def get_meals_page(request: Request):
-    return templates.TemplateResponse("meals.html", {"request": request})
+    return page("meals.html", request)
 
 @app.get("/serve-meal", response_class=HTMLResponse)
 async def get_serve_meal_page(request: Request):
-    return templates.TemplateResponse("serve_meal.html", {"request": request})
+    return page("serve_meal.html", request)
 
 @app.get("/reports", response_class=HTMLResponse)
 async def get_reports_page(request: Request):
-    return templates.TemplateResponse("reports.html", {"request": request})
+    return page("reports.html", request)
 
 @app.get("/servings", response_class=HTMLResponse)
 async def get_servings_page(request: Request):
-    return templates.TemplateResponse("servings.html", {"request": request})
+    return page("servings.html", request)
 
 @app.get("/alerts", response_class=HTMLResponse)
 async def get_alerts_page(request: Request):
-    return templates.TemplateResponse("alerts.html", {"request": request})
+    return page("alerts.html", request)
 
 @app.get("/trigger-report", response_class=HTMLResponse)
 async def get_trigger_report_page(request: Request):
-    return templates.TemplateResponse("trigger_report.html", {"request": request})
+    return page("trigger_report.html", request)
 
 @app.get("/me")
 async def get_user_details(current_user: User = Depends(get_current_user)):
@@ -106,29 +193,29 @@ async def get_user_details(current_user: User = Depends(get_current_user)):
     }
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    active_connections.append(websocket)
-    print(f"WebSocket client connected. Total connections: {len(active_connections)}")
+async def websocket_endpoint(websocket: WebSocket, topics: Optional[str] = None, since: Optional[int] = None, epoch: Optional[str] = None):
+    """Clients pick topics with ``?topics=inventory,alerts`` or later ``{"subscribe": [...]}`` messages,
+    and resume after a reconnect with the ``since``/``epoch`` of the last event they applied."""
+    subscriber = await hub.connect(websocket, [t for t in topics.split(",") if t in TOPICS] if topics else TOPICS, since, epoch)
+    logger.info("WebSocket client connected to %s. Total connections: %d", sorted(subscriber.topics), len(hub.subscribers))
     try:
         while True:
             message = await websocket.receive_text()
-            print(f"Received message from client: {message}")
+            try:
+                data = json.loads(message)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                subscriber.topics |= {t for t in data.get("subscribe", []) if t in TOPICS}
+                subscriber.topics -= set(data.get("unsubscribe", []))
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
-        print(f"WebSocket client disconnected. Total connections: {len(active_connections)}")
-
-async def broadcast_update(message: dict):
-    json_message = json.dumps(message)
-    print(f"Broadcasting message: {json_message}")
-    for connection in active_connections:
-        try:
-            await connection.send_text(json_message)
-        except Exception:
-            active_connections.remove(connection)
+        pass
+    finally:
+        hub.disconnect(subscriber)
+        logger.info("WebSocket client disconnected. Total connections: %d", len(hub.subscribers))
 
 @app.post("/ingredients/")
-async def add_ingredient(ingredient: IngredientCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def add_ingredient(ingredient: IngredientCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -142,74 +229,199 @@ async def add_ingredient(ingredient: IngredientCreate, db: Session = Depends(get
         delivery_date=delivery_date
     )
     db.add(db_ingredient)
-    db.commit()
-    await broadcast_update({"type": "inventory_update", "ingredient": ingredient.name, "quantity": ingredient.quantity_grams})
+    await db.flush()
+    if db_ingredient.quantity_grams:
+        db.add(InventoryTransaction(ingredient_id=db_ingredient.id, quantity_change_grams=db_ingredient.quantity_grams,
+                                    user_id=current_user.id, transaction_type=TransactionType.DELIVERY))
+    low_alerts = await detect_low_stock(db, [db_ingredient.id]) if db_ingredient.quantity_grams < db_ingredient.minimum_quantity else []
+    await bump_version(db, INGREDIENTS)
+    await db.commit()
+    version_tracker.expire()
+    alert_pipeline.track(low_alerts)
+    estimator.set_stock(db_ingredient.id, db_ingredient.quantity_grams)
+    publish_alerts(low_alerts)
+    backplane.publish("inventory", {"type": "inventory_update", "ingredient": ingredient.name, "quantity": ingredient.quantity_grams, "ingredients": [ingredient_row(db_ingredient)]})
     return {"message": "Ingredient added"}
 
 @app.get("/ingredients/")
-async def get_ingredients(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_ingredients(request: Request, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          below_minimum: bool = False, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    async def build(response: Response):
+        query = select(Ingredient)
+        if below_minimum:
+            query = query.where(Ingredient.quantity_grams < Ingredient.minimum_quantity)
+        query = keyset(query, [Ingredient.id], cursor, [int], descending=False)
+        ingredients = (await db.execute(query.limit(limit + 1))).scalars().all()
+        ingredients = paginate(ingredients, limit, response, lambda ing: [ing.id])
+        return [ingredient_row(ing) for ing in ingredients]
+    return await conditional_json(request, db, [INGREDIENTS], build)
+
+# Imports touching more ingredients than this broadcast a reload hint instead of every row.
+DELIVERY_BROADCAST_MAX_ROWS = int(os.getenv("DELIVERY_BROADCAST_MAX_ROWS", "1000"))
+
+@app.post("/deliveries/bulk")
+async def import_deliveries(request: Request, format: Optional[str] = Query(None, pattern="^(csv|ndjson|json)$"),
+                            db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    ingredients = db.query(Ingredient).all()
-    return [{"id": ing.id, "name": ing.name, "quantity_grams": ing.quantity_grams, "minimum_quantity": ing.minimum_quantity, "delivery_date": ing.delivery_date} for ing in ingredients]
+    fmt = format or manifest_format(request.headers.get("content-type", ""))
+    if not fmt:
+        raise HTTPException(status_code=415, detail="Send text/csv, application/x-ndjson or application/json, or pass ?format=")
+    manifest = await read_manifest(request.stream(), fmt)
+    if manifest.errors:
+        raise HTTPException(status_code=400, detail={"message": "Manifest has invalid lines", "errors": manifest.errors})
+    if not len(manifest):
+        raise HTTPException(status_code=400, detail="Manifest contains no lines")
+    result = await apply_manifest(db, current_user.id, manifest)
+    await bump_version(db, INGREDIENTS)
+    await db.commit()
+    version_tracker.expire()
+    alert_pipeline.track(result.alerts)
+    publish_alerts(result.alerts)
+    publish_alerts(result.resolved, "alert_resolved")
+    summary = {"lines": len(manifest), "ingredients": len(result.ingredient_ids), "created": result.created, "grams": sum(manifest.line_grams)}
+    if len(result.ingredient_ids) > DELIVERY_BROADCAST_MAX_ROWS:
+        estimator.invalidate()
+        backplane.publish("inventory", {"type": "inventory_update", "delivery": summary, "reload": True})
+    else:
+        ingredients = (await db.execute(select(Ingredient).where(Ingredient.id.in_(result.ingredient_ids)))).scalars().all()
+        for ing in ingredients:
+            estimator.set_stock(ing.id, ing.quantity_grams)
+        backplane.publish("inventory", {"type": "inventory_update", "delivery": summary, "ingredients": [ingredient_row(ing) for ing in ingredients]})
+    return {"message": "Deliveries imported", **summary}
+
+# Declared before /ingredients/{ingredient_id} so "stock" is not parsed as an id.
+@app.get("/ingredients/stock")
+async def get_stock_at(at: datetime, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    levels = await db.run_sync(stock_at, at)
+    existing = (await db.execute(
+        select(Ingredient.id, Ingredient.name).where(Ingredient.id.in_(list(levels)), or_(Ingredient.created_at.is_(None), Ingredient.created_at <= at)).order_by(Ingredient.id)
+    )).all()
+    return {"at": at, "ingredients": [{"id": ingredient_id, "name": name, "quantity_grams": levels[ingredient_id]} for ingredient_id, name in existing]}
+
+# Also declared before /ingredients/{ingredient_id}.
+@app.get("/ingredients/forecast")
+async def get_ingredient_forecast(within_days: Optional[float] = Query(None, ge=0), db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    (version,) = await version_tracker.current(db, [INGREDIENTS])
+    today = date.today()
+    await forecaster.ensure_fresh(db, today, version)
+    # orjson rather than the default encoder: with thousands of ingredients encoding dominates the request.
+    return Response(orjson.dumps(forecaster.forecast(today, within_days)), media_type="application/json")
+
+@app.get("/ingredients/{ingredient_id}/stock")
+async def get_ingredient_stock_at(ingredient_id: int, at: datetime, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    ingredient = await db.get(Ingredient, ingredient_id)
+    if not ingredient:
+        raise HTTPException(status_code=404, detail="Ingredient not found")
+    if ingredient.created_at and ingredient.created_at > at:
+        raise HTTPException(status_code=404, detail="Ingredient did not exist yet")
+    levels = await db.run_sync(stock_at, at, [ingredient_id])
+    return {"id": ingredient_id, "name": ingredient.name, "at": at, "quantity_grams": levels[ingredient_id]}
 
 @app.get("/ingredients/{ingredient_id}")
-async def get_ingredient(ingredient_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_ingredient(ingredient_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    ingredient = db.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
+    ingredient = await db.get(Ingredient, ingredient_id)
     if not ingredient:
         raise HTTPException(status_code=404, detail="Ingredient not found")
-    return {
-        "id": ingredient.id,
-        "name": ingredient.name,
-        "quantity_grams": ingredient.quantity_grams,
-        "minimum_quantity": ingredient.minimum_quantity,
-        "delivery_date": ingredient.delivery_date
-    }
+    return ingredient_row(ingredient)
 
 @app.put("/ingredients/{ingredient_id}")
-async def update_ingredient(ingredient_id: int, update_data: IngredientUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_ingredient(ingredient_id: int, update_data: IngredientUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    ingredient = db.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
+    ingredient = await db.get(Ingredient, ingredient_id)
     if not ingredient:
         raise HTTPException(status_code=404, detail="Ingredient not found")
+    previous = ingredient.quantity_grams
     if update_data.quantity_grams is not None:
         ingredient.quantity_grams = update_data.quantity_grams
     if update_data.delivery_date is not None:
         ingredient.delivery_date = update_data.delivery_date
     ingredient.updated_at = datetime.now()
-    db.commit()
-    await broadcast_update({"type": "inventory_update", "ingredient": ingredient.name, "quantity": ingredient.quantity_grams})
+    if ingredient.quantity_grams != previous:
+        db.add(InventoryTransaction(ingredient_id=ingredient.id, quantity_change_grams=ingredient.quantity_grams - previous,
+                                    user_id=current_user.id, transaction_type=TransactionType.DELIVERY))
+    low_alerts, resolved = [], []
+    if ingredient.quantity_grams < ingredient.minimum_quantity <= previous:
+        await db.flush()
+        low_alerts = await detect_low_stock(db, [ingredient.id])
+    elif ingredient.quantity_grams > previous:
+        await db.flush()
+        resolved = await alert_pipeline.resolve(db, [ingredient.id])
+    await bump_version(db, INGREDIENTS)
+    await db.commit()
+    version_tracker.expire()
+    alert_pipeline.track(low_alerts)
+    estimator.set_stock(ingredient.id, ingredient.quantity_grams)
+    publish_alerts(low_alerts)
+    publish_alerts(resolved, "alert_resolved")
+    backplane.publish("inventory", {"type": "inventory_update", "ingredient": ingredient.name, "quantity": ingredient.quantity_grams, "ingredients": [ingredient_row(ingredient)]})
     return {"message": "Ingredient updated"}
 
 @app.delete("/ingredients/{ingredient_id}")
-async def delete_ingredient(ingredient_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def delete_ingredient(ingredient_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    ingredient = db.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
+    ingredient = await db.get(Ingredient, ingredient_id, options=[selectinload(Ingredient.alerts)])
     if not ingredient:
         raise HTTPException(status_code=404, detail="Ingredient not found")
-    db.delete(ingredient)
-    db.commit()
-    await broadcast_update({"type": "inventory_delete", "ingredient": ingredient.name})
+    # Recipes and the ledger reference the ingredient with NOT NULL keys, and the ledger is history.
+    # The one exception is the opening DELIVERY written by add_ingredient, so a mistyped ingredient can still go.
+    if await db.scalar(select(exists().where(MealIngredient.ingredient_id == ingredient_id))):
+        raise HTTPException(status_code=409, detail="Ingredient is used in recipes; remove it from those meals first")
+    ledger = (await db.execute(
+        select(InventoryTransaction.id, InventoryTransaction.transaction_type).where(InventoryTransaction.ingredient_id == ingredient_id).limit(2)
+    )).all()
+    if len(ledger) > 1 or (ledger and ledger[0].transaction_type != TransactionType.DELIVERY):
+        raise HTTPException(status_code=409, detail="Ingredient has inventory history beyond its opening delivery and cannot be deleted")
+    await db.execute(delete(InventoryTransaction).where(InventoryTransaction.ingredient_id == ingredient_id))
+    await db.execute(delete(StockSnapshot).where(StockSnapshot.ingredient_id == ingredient_id))
+    await db.delete(ingredient)
+    version = await bump_version(db, RecipeCatalog.resource)
+    await bump_version(db, INGREDIENTS)
+    await db.commit()
+    version_tracker.expire()
+    recipe_catalog.remove_ingredient(version, ingredient_id)
+    estimator.remove_ingredient(ingredient_id)
+    backplane.publish("inventory", {"type": "inventory_delete", "ingredient": ingredient.name, "ingredient_id": ingredient_id})
     return {"message": "Ingredient deleted"}
 
 @app.post("/meals/")
-async def add_meal(meal: MealCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def add_meal(meal: MealCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -217,240 +429,319 @@ async def add_meal(meal: MealCreate, db: Session = Depends(get_db), current_user
         )
     db_meal = Meal(name=meal.name)
     db.add(db_meal)
-    db.flush()
+    await db.flush()
     for ing in meal.ingredients:
         meal_ing = MealIngredient(meal_id=db_meal.id, ingredient_id=ing.ingredient_id, quantity=ing.quantity)
         db.add(meal_ing)
-    db.commit()
+    items = await recipe_items(db, meal.ingredients)
+    version = await bump_version(db, RecipeCatalog.resource)
+    await db.commit()
+    version_tracker.expire()
+    recipe_catalog.put(version, db_meal.id, db_meal.name, items)
+    estimator.set_recipe(db_meal.id, db_meal.name, add_demand({}, items, 1), version)
     return {"message": "Meal added"}
 
 @app.get("/meals/")
-async def get_meals(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_meals(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin access required",
         )
-    meals = db.query(Meal).all()
-    result = []
-    for meal in meals:
-        meal_data = {
-            "id": meal.id,
-            "name": meal.name,
-            "ingredients": [
-                {"ingredient_id": mi.ingredient_id, "name": mi.ingredient.name, "quantity": mi.quantity}
-                for mi in meal.ingredients
-            ]
-        }
-        result.append(meal_data)
-    return result
+    async def build(response: Response):
+        return [recipe.to_dict() for recipe in await recipe_catalog.all(db)]
+    return await conditional_json(request, db, [RecipeCatalog.resource], build)
 
 @app.get("/meals/{meal_id}")
-async def get_meal(meal_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_meal(meal_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin access required",
         )
-    meal = db.query(Meal).filter(Meal.id == meal_id).first()
-    if not meal:
+    recipe = await recipe_catalog.get(db, meal_id)
+    if not recipe:
         raise HTTPException(status_code=404, detail="Meal not found")
-    return {
-        "id": meal.id,
-        "name": meal.name,
-        "ingredients": [
-            {"ingredient_id": mi.ingredient_id, "name": mi.ingredient.name, "quantity": mi.quantity}
-            for mi in meal.ingredients
-        ]
-    }
+    return recipe.to_dict()
 
 @app.put("/meals/{meal_id}")
-async def update_meal(meal_id: int, update_data: MealUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_meal(meal_id: int, update_data: MealUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin access required",
         )
-    meal = db.query(Meal).filter(Meal.id == meal_id).first()
+    meal = await db.get(Meal, meal_id)
     if not meal:
         raise HTTPException(status_code=404, detail="Meal not found")
     if update_data.name is not None:
         meal.name = update_data.name
     if update_data.ingredients is not None:
-        db.query(MealIngredient).filter(MealIngredient.meal_id == meal_id).delete()
+        await db.execute(delete(MealIngredient).where(MealIngredient.meal_id == meal_id))
         for ing in update_data.ingredients:
             meal_ing = MealIngredient(meal_id=meal_id, ingredient_id=ing.ingredient_id, quantity=ing.quantity)
             db.add(meal_ing)
+        items = await recipe_items(db, update_data.ingredients)
+    else:
+        current = await recipe_catalog.get(db, meal_id)
+        items = current.items if current else []
     meal.updated_at = datetime.now()
-    db.commit()
+    version = await bump_version(db, RecipeCatalog.resource)
+    await db.commit()
+    version_tracker.expire()
+    recipe_catalog.put(version, meal_id, meal.name, items)
+    estimator.set_recipe(meal_id, meal.name, add_demand({}, items, 1), version)
     return {"message": "Meal updated"}
 
 @app.delete("/meals/{meal_id}")
-async def delete_meal(meal_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def delete_meal(meal_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin access required",
         )
-    meal = db.query(Meal).filter(Meal.id == meal_id).first()
+    meal = await db.get(Meal, meal_id)
     if not meal:
         raise HTTPException(status_code=404, detail="Meal not found")
-    # Delete related MealServing records first
-    db.query(MealServing).filter(MealServing.meal_id == meal_id).delete()
+    # Take the servings out of the daily rollups, then delete them
+    await remove_meal_rollups(db, meal_id)
+    await db.execute(delete(MealServing).where(MealServing.meal_id == meal_id))
     # Delete related MealIngredient records
-    db.query(MealIngredient).filter(MealIngredient.meal_id == meal_id).delete()
+    await db.execute(delete(MealIngredient).where(MealIngredient.meal_id == meal_id))
     # Delete the Meal
-    db.delete(meal)
-    db.commit()
+    await db.execute(delete(Meal).where(Meal.id == meal_id))
+    version = await bump_version(db, RecipeCatalog.resource)
+    await bump_version(db, SERVINGS)
+    await db.commit()
+    version_tracker.expire()
+    recipe_catalog.remove(version, meal_id)
+    estimator.remove_meal(meal_id, version)
+    forecaster.invalidate()
     return {"message": "Meal deleted"}
 
+# Declared before /serve/{meal_id} so "batch" is not parsed as a meal id.
+@app.post("/serve/batch")
+async def serve_batch(request: ServeBatchRequest, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.COOK]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Admin or Cook access required",
+        )
+    if not request.lines:
+        raise HTTPException(status_code=400, detail="Batch contains no lines")
+    recipes = await recipe_catalog.many(db, {line.meal_id for line in request.lines})
+    missing = sorted({line.meal_id for line in request.lines} - recipes.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Meals not found: {', '.join(map(str, missing))}")
+    line_demands = [add_demand({}, recipes[line.meal_id].items, line.portions) for line in request.lines]
+    outcome = await serve(db, current_user.id, [(line.meal_id, line.portions, demand) for line, demand in zip(request.lines, line_demands)])
+    publish_alerts(outcome.alerts)
+    if outcome.remaining is None:
+        raise HTTPException(status_code=400, detail={"message": shortfall_message(outcome.shortfalls), "shortfalls": outcome.shortfalls})
+    alert_pipeline.track(outcome.alerts)
+    version_tracker.expire()
+    estimator.adjust_stock({ingredient_id: -grams for ingredient_id, grams in outcome.demand.items()})
+    served = [{"meal": recipes[line.meal_id].name, "portions": line.portions} for line in request.lines]
+    backplane.publish("inventory", {"type": "inventory_update", "meals": served, "portions": sum(line.portions for line in request.lines), "ingredients": stock_rows(outcome.remaining)})
+    return {"message": "Batch served", "servings": len(outcome.serving_ids)}
+
 @app.post("/serve/{meal_id}")
-async def serve_meal(meal_id: int, request: ServeMealRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def serve_meal(meal_id: int, request: ServeMealRequest, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     portions = request.portions
-    print(f"Received request to serve meal_id={meal_id} with portions={portions}")
     if current_user.role not in [Role.ADMIN, Role.COOK]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin or Cook access required",
         )
-    meal = db.query(Meal).filter(Meal.id == meal_id).first()
-    if not meal:
+    recipe = await recipe_catalog.get(db, meal_id)
+    if not recipe:
         raise HTTPException(status_code=404, detail="Meal not found")
-    insufficient = []
-    for meal_ing in meal.ingredients:
-        required = meal_ing.quantity * portions
-        if meal_ing.ingredient.quantity_grams < required:
-            insufficient.append(meal_ing.ingredient.name)
-    if insufficient:
-        alert = Alert(ingredient_id=meal_ing.ingredient.id, alert_type="LOW_STOCK", message=f"Insufficient {', '.join(insufficient)}")
-        db.add(alert)
-        db.commit()
-        await broadcast_update({"type": "alert", "message": alert.message})
-        raise HTTPException(status_code=400, detail=f"Insufficient ingredients: {', '.join(insufficient)}")
-    for meal_ing in meal.ingredients:
-        required = meal_ing.quantity * portions
-        meal_ing.ingredient.quantity_grams -= required
-        transaction = InventoryTransaction(
-            ingredient_id=meal_ing.ingredient_id,
-            quantity_change_grams=-required,
-            user_id=current_user.id,
-            transaction_type="CONSUMPTION"
-        )
-        db.add(transaction)
-    serving = MealServing(meal_id=meal_id, user_id=current_user.id, portions_served=portions)
-    db.add(serving)
-    db.commit()
-    await broadcast_update({"type": "inventory_update", "meal": meal.name, "portions": portions})
+    demand = add_demand({}, recipe.items, portions)
+    # The guarded UPDATE is the stock check, so concurrent servings cannot both pass it and overdraw.
+    outcome = await serve(db, current_user.id, [(meal_id, portions, demand)])
+    publish_alerts(outcome.alerts)
+    if outcome.remaining is None:
+        raise HTTPException(status_code=400, detail=shortfall_message(outcome.shortfalls))
+    alert_pipeline.track(outcome.alerts)
+    version_tracker.expire()
+    estimator.adjust_stock({ingredient_id: -grams for ingredient_id, grams in demand.items()})
+    backplane.publish("inventory", {"type": "inventory_update", "meal": recipe.name, "portions": portions, "ingredients": stock_rows(outcome.remaining)})
     return {"message": "Meal served"}
 
 @app.get("/portions/estimate")
-async def estimate_portions(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def estimate_portions(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    estimates = {}
-    for meal in db.query(Meal).all():
-        min_portions = float('inf')
-        for meal_ing in meal.ingredients:
-            portions = meal_ing.ingredient.quantity_grams / meal_ing.quantity
-            min_portions = min(min_portions, portions)
-        estimates[meal.name] = int(min_portions) if min_portions != float('inf') else 0
-    return estimates
+    recipes = await recipe_catalog.all(db)
+    if estimator.is_stale() or estimator.recipe_version != recipe_catalog.version:
+        await db.run_sync(lambda session: estimator.load(session, recipes, recipe_catalog.version))
+    return estimator.estimate()
 
 @app.get("/reports/monthly")
-async def get_monthly_reports(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_monthly_reports(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    reports = db.query(MonthlyReport).all()
-    return [{"month": r.report_month, "served": r.total_portions_served, "possible": r.total_portions_possible, "discrepancy": r.discrepancy_rate} for r in reports]
-
-@celery_app.task
-def generate_monthly_report():
-    with SessionLocal() as db:
-        month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        servings = db.query(MealServing).filter(MealServing.created_at >= month_start).all()
-        total_served = sum(s.portions_served for s in servings)
-        total_possible = sum(estimate_portions(db)[meal.name] for meal in db.query(Meal).all()) or 1
-        discrepancy = ((total_possible - total_served) / total_possible * 100) if total_possible else 0
-        if discrepancy > 15:
-            alert = Alert(alert_type="DISCREPANCY", message=f"Discrepancy rate {discrepancy:.2f}% exceeds 15%")
-            db.add(alert)
-        report = MonthlyReport(report_month=month_start, total_portions_served=total_served, total_portions_possible=total_possible, discrepancy_rate=discrepancy)
-        db.add(report)
-        db.commit()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(broadcast_update({"type": "report_update", "discrepancy": discrepancy}))
-        loop.close()
+    async def build(response: Response):
+        reports = (await db.execute(select(MonthlyReport).order_by(MonthlyReport.report_month))).scalars().all()
+        return [report_row(r) for r in reports]
+    return await conditional_json(request, db, [REPORTS], build)
+
+@app.get("/reports/breakdown")
+async def get_report_breakdown(month: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    try:
+        month_start = parse_month(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    breakdown = {"month": f"{month_start:%Y-%m}"}
+    for key, query in breakdown_queries(month_start).items():
+        breakdown[key] = [dict(row._mapping) for row in (await db.execute(query)).all()]
+    return breakdown
 
 @app.get("/api/servings")
-async def get_served_meals(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_served_meals(request: Request, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                           start: Optional[datetime] = None, end: Optional[datetime] = None, meal_id: Optional[int] = None, user_id: Optional[int] = None,
+                           db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
     try:
-        current_user = await auth.get_current_user(token, db)
-        if current_user.role not in [Role.ADMIN, Role.MANAGER]:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized: Manager or Admin access required",
+        async def build(response: Response):
+            query = (
+                select(MealServing.id, MealServing.created_at, MealServing.portions_served, Meal.name, User.full_name)
+                .outerjoin(Meal, Meal.id == MealServing.meal_id)
+                .outerjoin(User, User.id == MealServing.user_id)
             )
-        servings = db.query(MealServing).all()
-        result = []
-        for s in servings:
-            meal_name = s.meal.name if s.meal else "Unknown Meal"
-            user_name = s.user.full_name if s.user else "Unknown User"
-            result.append({
-                "meal": meal_name,
-                "user": user_name,
-                "portions": s.portions_served,
-                "time": s.created_at.isoformat() if s.created_at else None
-            })
-        return result
-    except auth.credentials_exception as e:
-        raise e
+            if start is not None:
+                query = query.where(MealServing.created_at >= start)
+            if end is not None:
+                query = query.where(MealServing.created_at < end)
+            if meal_id is not None:
+                query = query.where(MealServing.meal_id == meal_id)
+            if user_id is not None:
+                query = query.where(MealServing.user_id == user_id)
+            query = keyset(query, [MealServing.created_at, MealServing.id], cursor, [datetime, int])
+            rows = paginate((await db.execute(query.limit(limit + 1))).all(), limit, response, lambda row: [row.created_at, row.id])
+            return [
+                {
+                    "id": row.id,
+                    "meal": row.name or "Unknown Meal",
+                    "user": row.full_name or "Unknown User",
+                    "portions": row.portions_served,
+                    "time": row.created_at.isoformat() if row.created_at else None
+                }
+                for row in rows
+            ]
+        return await conditional_json(request, db, [SERVINGS, RecipeCatalog.resource], build)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching servings: {str(e)}"
         )
 
-@app.get("/alerts")
-async def get_alerts(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@app.get("/export/{dataset}")
+async def export_history(dataset: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$"), gzip: bool = False,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None, ingredient_id: Optional[int] = None, meal_id: Optional[int] = None,
+                         current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN, Role.MANAGER]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Manager or Admin access required",
+        )
+    queries = {"transactions": transactions_query, "servings": servings_query}
+    if dataset not in queries:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    query = queries[dataset](start=start, end=end, ingredient_id=ingredient_id, meal_id=meal_id)
+    filename = f"{dataset}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_rows(query, format, compress=gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role not in [Role.ADMIN]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized: Admin access required",
+        )
+    return {"recipes": recipe_catalog.stats(), "principals": auth.principal_cache.stats(), "websockets": hub.stats(), "backplane": backplane.stats(), "alerts": alert_pipeline.stats(), "serving": serving_writer.stats(), "etags": etags.stats(), "stock_snapshots": stock_snapshotter.stats(), "profiler": profiler.stats(), "forecast": forecaster.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+# Served under /api because GET /alerts is the HTML page.
+@app.get("/api/alerts")
+async def get_alerts(response: Response, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     state: str = Query("open", pattern="^(open|resolved|all)$"), alert_type: Optional[AlertType] = None, ingredient_id: Optional[int] = None,
+                     start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN, Role.MANAGER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Manager or Admin access required",
         )
-    alerts = db.query(Alert).all()
-    return [{"id": a.id, "type": a.alert_type, "message": a.message, "time": a.created_at} for a in alerts]
-
-async def check_low_stock(db: Session):
-    for ing in db.query(Ingredient).all():
-        if ing.quantity_grams < ing.minimum_quantity:
-            alert = db.query(Alert).filter(Alert.ingredient_id == ing.id, Alert.alert_type == "LOW_STOCK").first()
-            if not alert:
-                message = f"{str(ing.name).strip()} below minimum {float(ing.minimum_quantity)}g"
-                alert = Alert(ingredient_id=ing.id, alert_type="LOW_STOCK", message=message)
-                db.add(alert)
-                db.commit()
-                await broadcast_update({"type": "alert", "message": message})
+    query = select(Alert)
+    if state != "all":
+        query = query.where(Alert.status == AlertStatus(state))
+    if alert_type is not None:
+        query = query.where(Alert.alert_type == alert_type)
+    if ingredient_id is not None:
+        query = query.where(Alert.ingredient_id == ingredient_id)
+    if start is not None:
+        query = query.where(Alert.created_at >= start)
+    if end is not None:
+        query = query.where(Alert.created_at < end)
+    query = keyset(query, [Alert.created_at, Alert.id], cursor, [datetime, int])
+    alerts = paginate((await db.execute(query.limit(limit + 1))).scalars().all(), limit, response, lambda a: [a.created_at, a.id])
+    return [alert_row(a) for a in alerts]
+
+async def check_low_stock(db: AsyncSession):
+    """Full sweep; the stock-changing endpoints already check the ingredients they take below minimum."""
+    alerts = await detect_low_stock(db)
+    await db.commit()
+    alert_pipeline.track(alerts)
+    publish_alerts(alerts)
+    return alerts
 
 @app.post("/trigger-low-stock-check")
-async def trigger_low_stock_check(db: Session = Depends(get_db)):
-    await check_low_stock(db)
-    return {"message": "Low stock check triggered"}
+async def trigger_low_stock_check(db: AsyncSession = Depends(get_db)):
+    alerts = await check_low_stock(db)
+    return {"message": "Low stock check triggered", "alerts": len(alerts)}
 
 @app.post("/tasks/generate-report")
-async def trigger_report(current_user: User = Depends(get_current_user)):
+async def trigger_report(month: Optional[str] = None, current_user: User = Depends(get_current_user)):
     if current_user.role not in [Role.ADMIN]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized: Admin access required",
         )
-    generate_monthly_report.delay()
+    if month:
+        try:
+            parse_month(month)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    # Celery is only needed here, so the web process does not pay for it at startup.
+    from jobs import generate_monthly_report
+    generate_monthly_report.delay(month)
     return {"message": "Report generation scheduled"}
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+"""Request and database metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request and files it under the matched
+route template (``/meals/{meal_id}``, not the raw path) with its status code.
+Engine cursor events count the queries each request runs and the time spent in
+them, so an N+1 regression shows up as a jump in ``http_request_db_queries``
+for one route. Gauges such as open WebSockets are read only when ``/metrics``
+is scraped.
+
+Everything is kept in plain dicts in this process; with several workers each
+one is scraped on its own.
+"""
+import os
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# When set, GET /metrics requires "Authorization: Bearer <token>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+UNMATCHED = "<unmatched>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# [queries, seconds] for the request being handled; None outside requests.
+_request_db = ContextVar("request_db", default=None)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-route request histograms and status counts, database totals and scrape-time gauges."""
+
+    def __init__(self):
+        self.latency = {}
+        self.queries = {}
+        self.db_time = {}
+        self.statuses = {}
+        self.db_queries_total = 0
+        self.db_seconds_total = 0.0
+        self.gauges = {}
+        # Called as observe(seconds, statement, parameters, executemany) for every statement.
+        self.query_observers = []
+
+    def observe_request(self, method, route, status, seconds, queries, db_seconds):
+        key = (method, route)
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.queries[key] = Histogram(QUERY_BUCKETS)
+            self.db_time[key] = Histogram(LATENCY_BUCKETS)
+        latency.observe(seconds)
+        self.queries[key].observe(queries)
+        self.db_time[key].observe(db_seconds)
+        key = (method, route, status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def observe_query(self, seconds, statement, parameters, executemany):
+        self.db_queries_total += 1
+        self.db_seconds_total += seconds
+        usage = _request_db.get()
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += seconds
+        for observe in self.query_observers:
+            observe(seconds, statement, parameters, executemany)
+
+    def gauge(self, name, help, read):
+        """Register ``read()`` to be called at scrape time for the current value of ``name``."""
+        self.gauges[name] = (help, read)
+
+    def render(self):
+        lines = []
+
+        def histograms(name, help, series):
+            lines.extend((f"# HELP {name} {help}", f"# TYPE {name} histogram"))
+            for (method, route), histogram in sorted(series.items()):
+                lines.extend(histogram.lines(name, f'method="{method}",route="{_escape(route)}"'))
+
+        histograms("http_request_duration_seconds", "Time to handle a request, including streaming the body.", self.latency)
+        histograms("http_request_db_queries", "SQL statements executed per request.", self.queries)
+        histograms("http_request_db_seconds", "Time spent executing SQL per request.", self.db_time)
+        lines.extend(("# HELP http_requests_total Requests by route and status code.", "# TYPE http_requests_total counter"))
+        for (method, route, status), count in sorted(self.statuses.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+        lines.extend((
+            "# HELP db_queries_total SQL statements executed, inside requests or not.", "# TYPE db_queries_total counter",
+            f"db_queries_total {self.db_queries_total}",
+            "# HELP db_query_seconds_total Time spent executing SQL statements.", "# TYPE db_query_seconds_total counter",
+            f"db_query_seconds_total {self.db_seconds_total}",
+        ))
+        for name, (help, read) in sorted(self.gauges.items()):
+            lines.extend((f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {read()}"))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrument_engine(engine, registry: Metrics = metrics):
+    """Time every statement run through a (sync) engine; pass ``async_engine.sync_engine`` for the async one.
+
+    This is the only pair of cursor listeners: each one costs a few microseconds
+    per statement in SQLAlchemy's event dispatch, so other consumers subscribe
+    to ``registry.query_observers`` instead of adding their own.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finished(conn, cursor, statement, parameters, context, executemany):
+        registry.observe_query(perf_counter() - context._metrics_started, statement, parameters, executemany)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so timing a request costs a few dict and list operations."""
+
+    def __init__(self, app, registry: Metrics = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        usage = [0, 0.0]
+        token = _request_db.set(usage)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db.reset(token)
+            route = scope.get("route")
+            self.registry.observe_request(scope["method"], route.path if route else UNMATCHED, status,
+                                          perf_counter() - started, usage[0], usage[1])
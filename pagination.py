@@ -0,0 +1,42 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset(query, columns, cursor: str | None, types, descending=True):
+    """Order ``query`` by ``columns`` and start strictly after ``cursor`` (newest first by default)."""
+    if cursor:
+        position = decode_cursor(cursor, *types)
+        key = tuple_(*columns)
+        query = query.where(key < position if descending else key > position)
+    return query.order_by(*(c.desc() if descending else c.asc() for c in columns))
+
+
+def paginate(rows, limit: int, response: Response, cursor_of):
+    """Trim the ``limit + 1`` rows fetched by the caller and advertise the next cursor in a header."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*cursor_of(rows[-1]))
+    return rows
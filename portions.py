@@ -0,0 +1,125 @@
+import time
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database import Ingredient, Meal, MealIngredient
+
+
+class PortionEstimator:
+    """Keeps recipes and stock as NumPy arrays and estimates servable portions for every meal at once.
+
+    Stock changes are applied in place; recipe changes patch the recipe dict and
+    the flat arrays are rebuilt on the next estimate. Writes made by other
+    processes are picked up by reloading once the data is older than ``max_age``.
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self.loaded_at = None
+        self.meal_names = {}
+        self.recipes = {}
+        self.columns = {}
+        self.stock = np.zeros(0)
+        self.recipe_version = None
+        self._arrays = None
+
+    @classmethod
+    def from_session(cls, db: Session):
+        estimator = cls()
+        estimator.load(db)
+        return estimator
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def invalidate(self):
+        """Reload everything on the next estimate, e.g. after a bulk change."""
+        self.loaded_at = None
+
+    def load(self, db: Session, recipes=None, recipe_version=None):
+        """Reload stock, and recipes too unless ``recipes`` records from the catalog are passed in."""
+        if recipes is None:
+            self.meal_names = dict(db.execute(select(Meal.id, Meal.name)).all())
+            recipe_rows = db.execute(select(MealIngredient.meal_id, MealIngredient.ingredient_id, MealIngredient.quantity)).all()
+        else:
+            self.meal_names = {recipe.meal_id: recipe.name for recipe in recipes}
+            recipe_rows = [(recipe.meal_id, item.ingredient_id, item.grams) for recipe in recipes for item in recipe.items]
+        self.recipes = {meal_id: {} for meal_id in self.meal_names}
+        for meal_id, ingredient_id, grams in recipe_rows:
+            recipe = self.recipes.setdefault(meal_id, {})
+            recipe[ingredient_id] = recipe.get(ingredient_id, 0.0) + grams
+        self.recipe_version = recipe_version
+        rows = db.execute(select(Ingredient.id, Ingredient.quantity_grams)).all()
+        self.columns = {ingredient_id: column for column, (ingredient_id, _) in enumerate(rows)}
+        self.stock = np.array([quantity for _, quantity in rows], dtype=np.float64)
+        self._arrays = None
+        self.loaded_at = time.monotonic()
+
+    def _column(self, ingredient_id):
+        column = self.columns.get(ingredient_id)
+        if column is None:
+            column = self.columns[ingredient_id] = len(self.stock)
+            self.stock = np.append(self.stock, 0.0)
+        return column
+
+    def set_stock(self, ingredient_id, quantity):
+        column = self._column(ingredient_id)
+        self.stock[column] = quantity
+
+    def adjust_stock(self, deltas: dict):
+        for ingredient_id, grams in deltas.items():
+            column = self._column(ingredient_id)
+            self.stock[column] += grams
+
+    def remove_ingredient(self, ingredient_id):
+        column = self.columns.get(ingredient_id)
+        if column is not None:
+            self.stock[column] = 0.0
+
+    def _recipes_changed(self, version):
+        self._arrays = None
+        # Follow the catalog version only when this is the very next change, otherwise force a reload.
+        if version is not None and self.recipe_version is not None and version == self.recipe_version + 1:
+            self.recipe_version = version
+        else:
+            self.recipe_version = None
+
+    def set_recipe(self, meal_id, name, items: dict, version=None):
+        self.meal_names[meal_id] = name
+        self.recipes[meal_id] = dict(items)
+        self._recipes_changed(version)
+
+    def remove_meal(self, meal_id, version=None):
+        self.meal_names.pop(meal_id, None)
+        self.recipes.pop(meal_id, None)
+        self._recipes_changed(version)
+
+    def _build(self):
+        meal_ids = list(self.meal_names)
+        counts = np.array([len(self.recipes.get(meal_id, ())) for meal_id in meal_ids], dtype=np.int64)
+        columns = np.fromiter(
+            (self._column(ingredient_id) for meal_id in meal_ids for ingredient_id in self.recipes.get(meal_id, ())),
+            dtype=np.int64, count=int(counts.sum()),
+        )
+        grams = np.fromiter(
+            (g for meal_id in meal_ids for g in self.recipes.get(meal_id, {}).values()),
+            dtype=np.float64, count=int(counts.sum()),
+        )
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(counts) else np.zeros(0, dtype=np.int64)
+        self._arrays = (meal_ids, counts > 0, starts[counts > 0], columns, grams)
+
+    def estimate(self):
+        """Return ``{meal_name: portions}`` from one min-of-ratios pass over all recipe entries."""
+        if self._arrays is None:
+            self._build()
+        meal_ids, has_ingredients, starts, columns, grams = self._arrays
+        portions = np.zeros(len(meal_ids), dtype=np.int64)
+        if len(columns):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratios = np.where(grams > 0, self.stock[columns] / grams, np.inf)
+            per_meal = np.minimum.reduceat(ratios, starts)
+            portions[has_ingredients] = np.where(np.isfinite(per_meal), np.floor(per_meal), 0).astype(np.int64)
+        return {self.meal_names[meal_id]: int(p) for meal_id, p in zip(meal_ids, portions)}
+
+
+estimator = PortionEstimator()
@@ -0,0 +1,200 @@
+"""On-demand request profiling and the slow-query log.
+
+A request is profiled when an admin sends ``X-Profile: 1`` or when it falls in
+the ``PROFILE_SAMPLE_RATE`` fraction of traffic. Its handler runs under
+cProfile while every SQL statement it issues is recorded with its time and the
+shape of its bind parameters (types only, never values). Each capture becomes
+``<id>.prof`` (load with ``pstats`` or snakeviz) and ``<id>.json`` in
+``PROFILE_DIR``, of which the newest ``PROFILE_KEEP`` are kept; the response
+carries ``X-Profile-Id``.
+
+cProfile follows the thread, not the task, so functions of requests running
+concurrently on the same worker can show up in a capture; the SQL list is exact.
+Only one request per worker is profiled at a time.
+
+Independently of profiling, any statement slower than ``SLOW_QUERY_MS`` is
+printed with its parameter shape.
+"""
+import asyncio
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from time import perf_counter
+from fastapi import HTTPException
+from auth import principal_for_token
+from database import AsyncSessionLocal, Role
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+PROFILE_TOP_FUNCTIONS = 40
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_TEXT_LIMIT = 1000
+
+# Statements of the request being profiled; None everywhere else.
+_statements = ContextVar("profiled_statements", default=None)
+
+
+def _type_runs(values):
+    """``(int, int, int, str)`` -> ``int*3, str`` so long IN lists stay readable."""
+    runs = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return ", ".join(name if count == 1 else f"{name}*{count}" for name, count in runs)
+
+
+def parameter_shape(parameters, executemany=False):
+    if executemany:
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}" if parameters else "0 x ()"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return f"({_type_runs(parameters)})"
+    return type(parameters).__name__
+
+
+class Profiler:
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 slow_query_ms: float = SLOW_QUERY_MS):
+        self.directory = directory
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.active = False
+        self.captured = 0
+        self.skipped = 0
+        self.slow_queries = 0
+
+    def observe_query(self, seconds, statement, parameters, executemany):
+        if seconds >= self.slow_query_seconds:
+            self.slow_queries += 1
+            text = " ".join(statement.split())[:SLOW_QUERY_TEXT_LIMIT]
+            logger.warning("Slow query (%.1f ms): %s -- parameters %s", seconds * 1000, text, parameter_shape(parameters, executemany))
+        statements = _statements.get()
+        if statements is not None:
+            statements.append({"ms": round(seconds * 1000, 3), "statement": statement, "parameters": parameter_shape(parameters, executemany)})
+
+    async def requested_by_admin(self, scope):
+        """True if the request carries the profile header and a token belonging to an admin."""
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER, b"0") in (b"", b"0"):
+            return False
+        scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        try:
+            async with AsyncSessionLocal() as db:
+                principal = await principal_for_token(db, token)
+        except HTTPException:
+            return False
+        return principal.role == Role.ADMIN
+
+    async def capture(self, app, scope, receive, send):
+        if self.active:
+            self.skipped += 1
+            return await app(scope, receive, send)
+        self.active = True
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:6]}"
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, profile_id.encode())]}
+            await send(message)
+
+        statements = []
+        token = _statements.set(statements)
+        profile = cProfile.Profile()
+        started = perf_counter()
+        profile.enable()
+        try:
+            await app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            elapsed = perf_counter() - started
+            _statements.reset(token)
+            self.active = False
+            route = scope.get("route")
+            report = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "route": route.path if route else None,
+                "status": status,
+                "ms": round(elapsed * 1000, 3),
+                "sql_ms": round(sum(s["ms"] for s in statements), 3),
+                "sql_count": len(statements),
+                "sql": statements,
+            }
+            try:
+                await asyncio.to_thread(self.write, profile_id, profile, report)
+                self.captured += 1
+            except OSError as e:
+                logger.error("Writing profile %s failed: %s", profile_id, e)
+
+    def write(self, profile_id, profile, report):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        profile.dump_stats(base + ".prof")
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        report["top"] = summary.getvalue().splitlines()
+        with open(base + ".json", "w") as f:
+            json.dump(report, f, indent=1)
+        self.rotate()
+
+    def rotate(self):
+        # Ids start with a timestamp, so name order is age order.
+        captures = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+        for old in captures[:max(0, len(captures) - self.keep)]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, old + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        return {"directory": self.directory, "sample_rate": self.sample_rate, "captured": self.captured, "skipped": self.skipped,
+                "slow_query_ms": self.slow_query_seconds * 1000, "slow_queries": self.slow_queries}
+
+
+profiler = Profiler()
+
+
+def trace_queries(registry, target: Profiler = profiler):
+    """Feed every statement timed by ``metrics.instrument_engine`` to the slow-query log and any capture in progress."""
+    registry.query_observers.append(target.observe_query)
+
+
+class ProfilerMiddleware:
+    """Profiles sampled or admin-requested requests; everything else only pays for a header lookup."""
+
+    def __init__(self, app, target: Profiler = profiler):
+        self.app = app
+        self.profiler = target
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if (self.profiler.sample_rate and random.random() < self.profiler.sample_rate) or (
+                any(name == PROFILE_HEADER for name, _ in scope["headers"]) and await self.profiler.requested_by_admin(scope)):
+            return await self.profiler.capture(self.app, scope, receive, send)
+        return await self.app(scope, receive, send)
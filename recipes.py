@@ -0,0 +1,148 @@
+import os
+import time
+from typing import NamedTuple
+from sqlalchemy import select, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import Ingredient, Meal, MealIngredient, ResourceVersion
+
+# How often a worker re-reads the shared version counter to notice writes made by other workers.
+RECIPE_CACHE_CHECK_SECONDS = float(os.getenv("RECIPE_CACHE_CHECK_SECONDS", "1.0"))
+
+
+class RecipeItem(NamedTuple):
+    ingredient_id: int
+    name: str
+    grams: float
+
+
+class Recipe(NamedTuple):
+    meal_id: int
+    name: str
+    items: tuple
+
+    def to_dict(self):
+        return {
+            "id": self.meal_id,
+            "name": self.name,
+            "ingredients": [{"ingredient_id": i.ingredient_id, "name": i.name, "quantity": i.grams} for i in self.items],
+        }
+
+
+async def read_version(db: AsyncSession, name: str):
+    return (await db.execute(select(ResourceVersion.version).where(ResourceVersion.name == name))).scalar() or 0
+
+
+def _bump_statement(name: str):
+    return update(ResourceVersion).where(ResourceVersion.name == name).values(version=ResourceVersion.version + 1).returning(ResourceVersion.version)
+
+
+async def bump_version(db: AsyncSession, name: str):
+    """Increment a shared version counter inside the caller's transaction and return the new value."""
+    version = (await db.execute(_bump_statement(name))).scalar()
+    if version is None:
+        await db.execute(insert(ResourceVersion).values(name=name, version=1))
+        version = 1
+    return version
+
+
+def bump_version_sync(db: Session, name: str):
+    """``bump_version`` for synchronous sessions (report generation, Celery)."""
+    version = db.execute(_bump_statement(name)).scalar()
+    if version is None:
+        db.execute(insert(ResourceVersion).values(name=name, version=1))
+        version = 1
+    return version
+
+
+class RecipeCatalog:
+    """In-process cache of immutable recipe records, shared by the serving and meal endpoints.
+
+    Every recipe write bumps the ``recipes`` row in ``resource_versions`` in the
+    same transaction. Workers compare that counter with their own at most once
+    per ``check_interval`` and reload everything with one query when it moved.
+    """
+
+    resource = "recipes"
+
+    def __init__(self, check_interval: float = RECIPE_CACHE_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self.recipes = None
+        self.version = -1
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    async def _load(self, db: AsyncSession):
+        version = await read_version(db, self.resource)
+        recipes = {}
+        for meal_id, meal_name, ingredient_id, name, grams in (await db.execute(
+            select(Meal.id, Meal.name, MealIngredient.ingredient_id, Ingredient.name, MealIngredient.quantity)
+            .outerjoin(MealIngredient, MealIngredient.meal_id == Meal.id)
+            .outerjoin(Ingredient, Ingredient.id == MealIngredient.ingredient_id)
+            .order_by(Meal.id, MealIngredient.id)
+        )).all():
+            _, items = recipes.setdefault(meal_id, (meal_name, []))
+            if ingredient_id is not None:
+                items.append(RecipeItem(ingredient_id, name, grams))
+        self.recipes = {meal_id: Recipe(meal_id, name, tuple(items)) for meal_id, (name, items) in recipes.items()}
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.reloads += 1
+
+    async def _ensure_fresh(self, db: AsyncSession):
+        if self.recipes is not None:
+            if time.monotonic() - self.checked_at < self.check_interval:
+                self.hits += 1
+                return
+            self.checked_at = time.monotonic()
+            if await read_version(db, self.resource) == self.version:
+                self.hits += 1
+                return
+        self.misses += 1
+        await self._load(db)
+
+    async def get(self, db: AsyncSession, meal_id: int):
+        await self._ensure_fresh(db)
+        return self.recipes.get(meal_id)
+
+    async def many(self, db: AsyncSession, meal_ids):
+        await self._ensure_fresh(db)
+        return {meal_id: self.recipes[meal_id] for meal_id in meal_ids if meal_id in self.recipes}
+
+    async def all(self, db: AsyncSession):
+        await self._ensure_fresh(db)
+        return list(self.recipes.values())
+
+    def _committed(self, version):
+        # Only patch in place when no other worker wrote in between; otherwise reload on next read.
+        if self.recipes is None or version != self.version + 1:
+            self.invalidate()
+            return False
+        self.version = version
+        return True
+
+    def put(self, version, meal_id, name, items):
+        if self._committed(version):
+            self.recipes[meal_id] = Recipe(meal_id, name, tuple(RecipeItem(*item) for item in items))
+
+    def remove(self, version, meal_id):
+        if self._committed(version):
+            self.recipes.pop(meal_id, None)
+
+    def remove_ingredient(self, version, ingredient_id):
+        if self._committed(version):
+            for meal_id, recipe in list(self.recipes.items()):
+                if any(item.ingredient_id == ingredient_id for item in recipe.items):
+                    self.recipes[meal_id] = recipe._replace(items=tuple(i for i in recipe.items if i.ingredient_id != ingredient_id))
+
+    def invalidate(self):
+        self.recipes = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "reloads": self.reloads, "version": self.version,
+                "recipes": len(self.recipes) if self.recipes is not None else 0}
+
+
+recipe_catalog = RecipeCatalog()
@@ -0,0 +1,238 @@
+"""Monthly reports computed from daily rollups.
+
+``record_rollup`` runs inside the serving transaction, so reports only aggregate
+~31 rollup rows per month. Rollups for older data can be rebuilt and many
+months regenerated at once from the command line:
+
+    python reporting.py backfill 2024-01 2024-12 --workers 4
+    python reporting.py generate 2024-05
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from sqlalchemy import select, delete, insert, update, bindparam, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import (
+    SessionLocal, Alert, AlertStatus, AlertType, DailyIngredientUsage, DailyMealServing, Ingredient, InventoryTransaction, Meal,
+    MealServing, MonthlyReport, TransactionType,
+)
+from etags import REPORTS
+from portions import PortionEstimator
+from recipes import bump_version_sync
+from stock import stock_at
+
+DISCREPANCY_ALERT_PERCENT = 15
+
+
+def parse_month(value: str) -> datetime:
+    """Parse ``YYYY-MM`` into the first instant of that month."""
+    return datetime.strptime(value, "%Y-%m")
+
+
+def month_bounds(month_start: datetime):
+    month_start = month_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if month_start.month == 12:
+        return month_start, month_start.replace(year=month_start.year + 1, month=1)
+    return month_start, month_start.replace(month=month_start.month + 1)
+
+
+def iter_months(first: datetime, last: datetime):
+    month, _ = month_bounds(first)
+    while month <= last:
+        yield month
+        month = month_bounds(month)[1]
+
+
+def _upsert(db, table, keys, column):
+    """INSERT ... ON CONFLICT that adds to ``column`` instead of replacing it (SQLite and PostgreSQL)."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table)
+    return stmt.on_conflict_do_update(index_elements=keys, set_={column: getattr(table.c, column) + getattr(stmt.excluded, column)})
+
+
+async def record_rollup(db, day: date, servings):
+    """Add ``[(meal_id, portions, demand), ...]`` to the day's rollups inside the caller's transaction."""
+    portions, grams = {}, {}
+    for meal_id, served, demand in servings:
+        portions[meal_id] = portions.get(meal_id, 0) + served
+        for ingredient_id, used in demand.items():
+            grams[ingredient_id] = grams.get(ingredient_id, 0.0) + used
+    if portions:
+        await db.execute(
+            _upsert(db, DailyMealServing.__table__, ["day", "meal_id"], "portions"),
+            [{"day": day, "meal_id": meal_id, "portions": p} for meal_id, p in portions.items()],
+        )
+    if grams:
+        await db.execute(
+            _upsert(db, DailyIngredientUsage.__table__, ["day", "ingredient_id"], "grams"),
+            [{"day": day, "ingredient_id": ingredient_id, "grams": g} for ingredient_id, g in grams.items()],
+        )
+
+
+async def remove_meal_rollups(db, meal_id: int):
+    """Take a meal's servings out of the rollups and detach their ledger rows, inside the caller's transaction.
+
+    Call before deleting the servings. The CONSUMPTION rows stay (the stock did
+    go down) but no longer count as usage, the same as ``rebuild_rollups`` sees them.
+    """
+    servings = select(MealServing.id).where(MealServing.meal_id == meal_id)
+    used = {}
+    for served_at, ingredient_id, change in (await db.execute(
+        select(MealServing.created_at, InventoryTransaction.ingredient_id, InventoryTransaction.quantity_change_grams)
+        .join(MealServing, MealServing.id == InventoryTransaction.meal_serving_id)
+        .where(MealServing.meal_id == meal_id, InventoryTransaction.transaction_type == TransactionType.CONSUMPTION)
+    )).all():
+        key = (served_at.date(), ingredient_id)
+        used[key] = used.get(key, 0.0) - change
+    if used:
+        table = DailyIngredientUsage.__table__
+        await db.execute(
+            update(table).where(table.c.day == bindparam("b_day"), table.c.ingredient_id == bindparam("b_ingredient_id"))
+            .values(grams=table.c.grams - bindparam("b_grams")),
+            [{"b_day": day, "b_ingredient_id": ingredient_id, "b_grams": grams} for (day, ingredient_id), grams in used.items()],
+        )
+        # Days left with no usage have no row, as after a rebuild.
+        await db.execute(delete(table).where(
+            table.c.day.in_({day for day, _ in used}), table.c.ingredient_id.in_({i for _, i in used}), table.c.grams <= 1e-9))
+    await db.execute(
+        update(InventoryTransaction).where(InventoryTransaction.meal_serving_id.in_(servings))
+        .values(meal_serving_id=None).execution_options(synchronize_session=False)
+    )
+    await db.execute(delete(DailyMealServing).where(DailyMealServing.meal_id == meal_id))
+
+
+def rebuild_rollups(db: Session, start: datetime, end: datetime):
+    """Recompute the rollups for ``[start, end)`` from the servings table and the ledger."""
+    first_day, last_day = start.date(), end.date()
+    db.execute(delete(DailyMealServing).where(DailyMealServing.day >= first_day, DailyMealServing.day < last_day))
+    db.execute(delete(DailyIngredientUsage).where(DailyIngredientUsage.day >= first_day, DailyIngredientUsage.day < last_day))
+    serving_day = func.date(MealServing.created_at)
+    db.execute(insert(DailyMealServing).from_select(
+        ["day", "meal_id", "portions"],
+        select(serving_day, MealServing.meal_id, func.sum(MealServing.portions_served))
+        .where(MealServing.created_at >= start, MealServing.created_at < end)
+        .group_by(serving_day, MealServing.meal_id),
+    ))
+    usage_day = func.date(InventoryTransaction.created_at)
+    db.execute(insert(DailyIngredientUsage).from_select(
+        ["day", "ingredient_id", "grams"],
+        select(usage_day, InventoryTransaction.ingredient_id, -func.sum(InventoryTransaction.quantity_change_grams))
+        .where(
+            InventoryTransaction.transaction_type == TransactionType.CONSUMPTION,
+            # Consumption of deleted meals' servings is detached by remove_meal_rollups.
+            InventoryTransaction.meal_serving_id.is_not(None),
+            InventoryTransaction.created_at >= start, InventoryTransaction.created_at < end,
+        )
+        .group_by(usage_day, InventoryTransaction.ingredient_id),
+    ))
+
+
+def breakdown_queries(month_start: datetime):
+    """Per-day, per-meal and per-ingredient totals for a month, read from the rollups."""
+    start, end = (d.date() for d in month_bounds(month_start))
+    in_meal_month = (DailyMealServing.day >= start, DailyMealServing.day < end)
+    in_usage_month = (DailyIngredientUsage.day >= start, DailyIngredientUsage.day < end)
+    return {
+        "days": select(DailyMealServing.day, func.sum(DailyMealServing.portions).label("portions"))
+        .where(*in_meal_month).group_by(DailyMealServing.day).order_by(DailyMealServing.day),
+        "meals": select(DailyMealServing.meal_id, Meal.name, func.sum(DailyMealServing.portions).label("portions"))
+        .outerjoin(Meal, Meal.id == DailyMealServing.meal_id)
+        .where(*in_meal_month).group_by(DailyMealServing.meal_id, Meal.name).order_by(DailyMealServing.meal_id),
+        "ingredients": select(DailyIngredientUsage.ingredient_id, Ingredient.name, func.sum(DailyIngredientUsage.grams).label("grams"))
+        .outerjoin(Ingredient, Ingredient.id == DailyIngredientUsage.ingredient_id)
+        .where(*in_usage_month).group_by(DailyIngredientUsage.ingredient_id, Ingredient.name).order_by(DailyIngredientUsage.ingredient_id),
+    }
+
+
+def report_row(r: MonthlyReport):
+    return {"month": r.report_month, "served": r.total_portions_served, "possible": r.total_portions_possible, "discrepancy": r.discrepancy_rate}
+
+
+def _update_month_alert(db: Session, month_start: datetime, discrepancy: float):
+    """Keep one open DISCREPANCY alert per month, keyed by the month its message starts with.
+
+    These alerts have no ingredient, so ``uq_alerts_open`` cannot de-duplicate
+    them; a regenerated month updates its alert, or resolves it once the rate
+    is back under ``DISCREPANCY_ALERT_PERCENT``.
+    """
+    now = datetime.now()
+    prefix = f"{month_start:%Y-%m}:"
+    open_alerts = db.execute(
+        select(Alert).where(
+            Alert.alert_type == AlertType.DISCREPANCY, Alert.status == AlertStatus.OPEN,
+            Alert.ingredient_id.is_(None), Alert.message.startswith(prefix, autoescape=True),
+        ).order_by(Alert.id)
+    ).scalars().all()
+    if discrepancy > DISCREPANCY_ALERT_PERCENT:
+        message = f"{prefix} discrepancy rate {discrepancy:.2f}% exceeds {DISCREPANCY_ALERT_PERCENT}%"
+        if open_alerts:
+            alert = open_alerts.pop(0)
+            alert.message = message
+            alert.occurrences = (alert.occurrences or 1) + 1
+            alert.last_seen_at = now
+        else:
+            db.add(Alert(alert_type=AlertType.DISCREPANCY, status=AlertStatus.OPEN, message=message, occurrences=1,
+                         created_at=now, last_seen_at=now))
+    # Anything left is either a duplicate from before this was keyed or a month back under the threshold.
+    for alert in open_alerts:
+        alert.status = AlertStatus.RESOLVED
+        alert.resolved_at = now
+
+
+def generate_report(db: Session, month_start: datetime):
+    """Compute and store the report for one month, replacing an earlier one for the same month."""
+    start, end = month_bounds(month_start)
+    total_served = db.execute(
+        select(func.coalesce(func.sum(DailyMealServing.portions), 0))
+        .where(DailyMealServing.day >= start.date(), DailyMealServing.day < end.date())
+    ).scalar_one()
+    # Portions that could still be cooked from the stock left at the end of the month.
+    estimator = PortionEstimator.from_session(db)
+    if end <= datetime.now():
+        for ingredient_id, quantity in stock_at(db, end).items():
+            estimator.set_stock(ingredient_id, quantity)
+    total_possible = sum(estimator.estimate().values()) or 1
+    discrepancy = ((total_possible - total_served) / total_possible * 100) if total_possible else 0
+    _update_month_alert(db, start, discrepancy)
+    db.execute(delete(MonthlyReport).where(MonthlyReport.report_month == start))
+    report = MonthlyReport(report_month=start, total_portions_served=total_served, total_portions_possible=total_possible, discrepancy_rate=discrepancy)
+    db.add(report)
+    bump_version_sync(db, REPORTS)
+    db.commit()
+    return report
+
+
+def _generate(month_start: datetime):
+    with SessionLocal() as db:
+        report = generate_report(db, month_start)
+        return f"{month_start:%Y-%m}", report.total_portions_served, report.discrepancy_rate
+
+
+def backfill(first: datetime, last: datetime, workers: int = 4):
+    """Rebuild the rollups covering ``first``..``last`` once, then regenerate the months in parallel."""
+    months = list(iter_months(first, last))
+    with SessionLocal() as db:
+        rebuild_rollups(db, months[0], month_bounds(months[-1])[1])
+        db.commit()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_generate, months))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate monthly reports from the daily rollups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="regenerate one month from the existing rollups")
+    generate.add_argument("month", type=parse_month, help="YYYY-MM")
+    fill = commands.add_parser("backfill", help="rebuild rollups from raw data and regenerate a range of months")
+    fill.add_argument("first", type=parse_month, help="YYYY-MM")
+    fill.add_argument("last", type=parse_month, help="YYYY-MM")
+    fill.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        month, served, discrepancy = _generate(args.month)
+        print(f"{month}: {served} portions served, discrepancy {discrepancy:.2f}%")
+    else:
+        for month, served, discrepancy in backfill(args.first, args.last, args.workers):
+            print(f"{month}: {served} portions served, discrepancy {discrepancy:.2f}%")
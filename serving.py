@@ -0,0 +1,177 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from alerts import alert_pipeline
+from database import AsyncSessionLocal, AlertType, MealServing
+from etags import INGREDIENTS, SERVINGS
+from inventory import consume_stock, crossed_minimum, detect_low_stock, find_shortfalls, record_consumption
+from recipes import bump_version
+from reporting import record_rollup
+
+# Optional group commit for SQLite: one writer task applies servings in micro-batches,
+# one transaction per SERVE_GROUP_COMMIT_MAX_BATCH requests or SERVE_GROUP_COMMIT_MAX_WAIT_MS.
+SERVE_GROUP_COMMIT = os.getenv("SERVE_GROUP_COMMIT", "0") == "1"
+SERVE_GROUP_COMMIT_MAX_BATCH = int(os.getenv("SERVE_GROUP_COMMIT_MAX_BATCH", "64"))
+SERVE_GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("SERVE_GROUP_COMMIT_MAX_WAIT_MS", "2"))
+
+
+class ServeOutcome(NamedTuple):
+    serving_ids: list
+    demand: dict
+    remaining: dict
+    shortfalls: list
+    alerts: list
+
+
+async def serve_lines(db: AsyncSession, user_id: int, lines):
+    """Write servings for ``[(meal_id, portions, demand), ...]`` without committing.
+
+    Shared ingredients are summed so all lines are checked against stock at
+    once. On a shortfall stock is left untouched and a LOW_STOCK alert is
+    raised instead, so the outcome can be committed either way.
+    """
+    total_demand = {}
+    for _, _, demand in lines:
+        for ingredient_id, grams in demand.items():
+            total_demand[ingredient_id] = total_demand.get(ingredient_id, 0.0) + grams
+    remaining = await consume_stock(db, total_demand)
+    if remaining is None:
+        shortfalls = await find_shortfalls(db, total_demand)
+        if not shortfalls:
+            # A delivery committed between the failed UPDATE and the re-read; try once more.
+            remaining = await consume_stock(db, total_demand)
+            if remaining is None:
+                shortfalls = await find_shortfalls(db, total_demand)
+    if remaining is None:
+        # Still no shortfall to name means stock keeps moving under us: fail the serve, but raise no alert.
+        if not shortfalls:
+            return ServeOutcome([], total_demand, None, [], [])
+        # One alert per short ingredient, so each stays open until that ingredient is restocked.
+        alerts = []
+        for shortfall in shortfalls:
+            name = shortfall["ingredient"] or f"ingredient #{shortfall['ingredient_id']}"
+            alert = await alert_pipeline.raise_alert(db, shortfall["ingredient_id"], AlertType.LOW_STOCK, f"Insufficient {name}")
+            if alert:
+                alerts.append(alert)
+        return ServeOutcome([], total_demand, None, shortfalls, alerts)
+    now = datetime.now()
+    serving_ids = (await db.execute(
+        insert(MealServing).returning(MealServing.id, sort_by_parameter_order=True),
+        [{"meal_id": meal_id, "user_id": user_id, "portions_served": portions, "created_at": now} for meal_id, portions, _ in lines],
+    )).scalars().all()
+    await record_consumption(db, user_id, [(serving_id, demand) for serving_id, (_, _, demand) in zip(serving_ids, lines)])
+    await record_rollup(db, now.date(), lines)
+    low_alerts = await detect_low_stock(db, crossed_minimum(remaining, total_demand))
+    await bump_version(db, INGREDIENTS)
+    await bump_version(db, SERVINGS)
+    return ServeOutcome(serving_ids, total_demand, remaining, [], low_alerts)
+
+
+class _Order(NamedTuple):
+    user_id: int
+    lines: list
+    future: asyncio.Future
+
+
+class GroupCommitWriter:
+    """Single writer task that applies queued servings in micro-batches.
+
+    Each batch is one transaction and one commit. If the batch fails as a
+    whole, its orders are retried one transaction each so every request
+    still gets its own result.
+    """
+
+    def __init__(self, enabled: bool = SERVE_GROUP_COMMIT, max_batch: int = SERVE_GROUP_COMMIT_MAX_BATCH, max_wait_ms: float = SERVE_GROUP_COMMIT_MAX_WAIT_MS):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.batches = 0
+        self.orders = 0
+        self._task = None
+
+    async def submit(self, user_id: int, lines):
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_Order(user_id, lines, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            order = await self.queue.get()
+            if order is None:
+                return
+            batch = [order]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        order = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    order = self.queue.get_nowait()
+                if order is None:
+                    stopping = True
+                    break
+                batch.append(order)
+            await self._apply(batch)
+
+    async def _apply(self, batch):
+        try:
+            async with AsyncSessionLocal() as db:
+                outcomes = [await serve_lines(db, order.user_id, order.lines) for order in batch]
+                await db.commit()
+                # Only now: a failed batch is retried order by order and must not leave alerts it never committed.
+                alert_pipeline.committed(db)
+        except Exception as e:
+            if len(batch) > 1:
+                for order in batch:
+                    await self._apply([order])
+            elif not batch[0].future.done():
+                batch[0].future.set_exception(e)
+            return
+        self.batches += 1
+        self.orders += len(batch)
+        for order, outcome in zip(batch, outcomes):
+            if not order.future.done():
+                order.future.set_result(outcome)
+
+    async def stop(self):
+        """Apply everything already queued, then end the writer task."""
+        if self._task and not self._task.done():
+            await self.queue.put(None)
+            await self._task
+        self._task = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "batches": self.batches,
+            "orders": self.orders,
+            "mean_batch": round(self.orders / self.batches, 1) if self.batches else 0.0,
+            "queued": self.queue.qsize() if self.queue else 0,
+        }
+
+
+async def serve(db: AsyncSession, user_id: int, lines):
+    """Apply and commit servings, through the group-commit writer when it is enabled."""
+    if serving_writer.enabled:
+        return await serving_writer.submit(user_id, lines)
+    outcome = await serve_lines(db, user_id, lines)
+    await db.commit()
+    alert_pipeline.committed(db)
+    return outcome
+
+
+serving_writer = GroupCommitWriter()
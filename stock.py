@@ -0,0 +1,217 @@
+"""Stock levels at any point in time.
+
+``stock_snapshots`` holds a copy of every ingredient's quantity, taken every
+``STOCK_SNAPSHOT_INTERVAL_SECONDS``. The level at a moment starts from whichever
+is closest in time: the snapshot before it, the snapshot after it, or the live
+quantity. Only the ledger rows in between are applied, so the cost depends on
+the snapshot interval, not on the length of the ledger.
+
+Before each snapshot the live quantities are reconciled against the previous
+snapshot plus the ledger; mismatches open DISCREPANCY alerts.
+
+Ledger rows are stamped before their transaction commits, so a serve stamped
+just before a snapshot may only become visible after it. A snapshot is
+therefore taken as of ``STOCK_SNAPSHOT_GRACE_SECONDS`` ago: the live quantities
+with the ledger since then rolled back, in one statement. Anything still
+uncommitted is in neither and is replayed after the snapshot once it commits.
+The grace must exceed the longest write transaction.
+
+    python stock.py snapshot     # reconcile, then take a snapshot
+    python stock.py reconcile    # only report mismatches
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, func, literal, DateTime
+from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, SessionLocal, Alert, AlertStatus, AlertType, Ingredient, InventoryTransaction, StockSnapshot
+
+logger = logging.getLogger(__name__)
+
+STOCK_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("STOCK_SNAPSHOT_INTERVAL_SECONDS", "3600"))
+STOCK_RECONCILE_TOLERANCE_GRAMS = float(os.getenv("STOCK_RECONCILE_TOLERANCE_GRAMS", "0.01"))
+STOCK_SNAPSHOT_GRACE_SECONDS = float(os.getenv("STOCK_SNAPSHOT_GRACE_SECONDS", "60"))
+
+
+def _ledger_change(start, end, ingredient_ids):
+    """Net change per ingredient for ledger rows with ``start <= created_at < end`` (either bound optional)."""
+    query = select(InventoryTransaction.ingredient_id, func.sum(InventoryTransaction.quantity_change_grams).label("change"))
+    if start is not None:
+        query = query.where(InventoryTransaction.created_at >= start)
+    if end is not None:
+        query = query.where(InventoryTransaction.created_at < end)
+    if ingredient_ids is not None:
+        query = query.where(InventoryTransaction.ingredient_id.in_(ingredient_ids))
+    return query.group_by(InventoryTransaction.ingredient_id).subquery()
+
+
+def _snapshot(taken_at):
+    return select(StockSnapshot.ingredient_id, StockSnapshot.quantity_grams).where(StockSnapshot.taken_at == taken_at).subquery()
+
+
+def replayed(taken_at, end, ingredient_ids=None):
+    """``(ingredient_id, grams)`` from the snapshot at ``taken_at`` (or zero) plus the ledger up to ``end``."""
+    change = _ledger_change(taken_at, end, ingredient_ids)
+    if taken_at is None:
+        query = select(Ingredient.id, func.coalesce(change.c.change, 0.0).label("grams"))
+    else:
+        snapshot = _snapshot(taken_at)
+        start = func.coalesce(snapshot.c.quantity_grams, 0.0)
+        query = select(Ingredient.id, (start + func.coalesce(change.c.change, 0.0)).label("grams")).outerjoin(snapshot, snapshot.c.ingredient_id == Ingredient.id)
+    return query.outerjoin(change, change.c.ingredient_id == Ingredient.id)
+
+
+def rewound(at, taken_at=None, ingredient_ids=None):
+    """``(ingredient_id, grams)`` from the snapshot at ``taken_at`` (or live stock) minus the ledger since ``at``."""
+    change = _ledger_change(at, taken_at, ingredient_ids)
+    if taken_at is None:
+        query = select(Ingredient.id, (Ingredient.quantity_grams - func.coalesce(change.c.change, 0.0)).label("grams"))
+    else:
+        snapshot = _snapshot(taken_at)
+        start = func.coalesce(snapshot.c.quantity_grams, 0.0)
+        query = select(Ingredient.id, (start - func.coalesce(change.c.change, 0.0)).label("grams")).outerjoin(snapshot, snapshot.c.ingredient_id == Ingredient.id)
+    return query.outerjoin(change, change.c.ingredient_id == Ingredient.id)
+
+
+def stock_at(db: Session, at: datetime, ingredient_ids=None):
+    """``{ingredient_id: grams}`` as of ``at`` (ledger rows from ``at`` on excluded), from the nearest starting point."""
+    previous, following = db.execute(select(
+        select(func.max(StockSnapshot.taken_at)).where(StockSnapshot.taken_at <= at).scalar_subquery(),
+        select(func.min(StockSnapshot.taken_at)).where(StockSnapshot.taken_at > at).scalar_subquery(),
+    )).one()
+    ids = list(ingredient_ids) if ingredient_ids is not None else None
+    # Any later snapshot is at least as close as the live quantity.
+    ahead = (following or datetime.now()) - at
+    if previous is not None and at - previous < ahead:
+        query = replayed(previous, at, ids)
+    else:
+        query = rewound(at, following, ids)
+    if ids is not None:
+        query = query.where(Ingredient.id.in_(ids))
+    return dict(db.execute(query).all())
+
+
+def reconcile(db: Session, tolerance: float = STOCK_RECONCILE_TOLERANCE_GRAMS):
+    """Check ``quantity_grams`` against the latest snapshot plus the ledger since.
+
+    Returns ``(mismatches, alerts)``: one dict per ingredient that is off by
+    more than ``tolerance`` grams, and the DISCREPANCY alerts newly opened for
+    them. Without a snapshot there is nothing to check against yet.
+    """
+    latest = db.execute(select(func.max(StockSnapshot.taken_at))).scalar()
+    if latest is None:
+        return [], []
+    expected = replayed(latest, None).subquery()
+    mismatches = [
+        {"ingredient_id": ingredient_id, "ingredient": name, "quantity_grams": actual, "expected_grams": grams}
+        for ingredient_id, name, actual, grams in db.execute(
+            select(Ingredient.id, Ingredient.name, Ingredient.quantity_grams, expected.c.grams)
+            .join(expected, expected.c.id == Ingredient.id)
+            .where(func.abs(Ingredient.quantity_grams - expected.c.grams) > tolerance)
+            .order_by(Ingredient.id)
+        ).all()
+    ]
+    if not mismatches:
+        return [], []
+    already_open = set(db.execute(
+        select(Alert.ingredient_id).where(
+            Alert.alert_type == AlertType.DISCREPANCY, Alert.status == AlertStatus.OPEN,
+            Alert.ingredient_id.in_([m["ingredient_id"] for m in mismatches]),
+        )
+    ).scalars())
+    now = datetime.now()
+    alerts = [
+        Alert(
+            ingredient_id=m["ingredient_id"], alert_type=AlertType.DISCREPANCY, status=AlertStatus.OPEN, occurrences=1,
+            message=f"{m['ingredient']}: stock {m['quantity_grams']:g}g does not match ledger {m['expected_grams']:g}g",
+            created_at=now, last_seen_at=now,
+        )
+        for m in mismatches if m["ingredient_id"] not in already_open
+    ]
+    db.add_all(alerts)
+    db.flush()
+    return mismatches, alerts
+
+
+def take_snapshot(db: Session, taken_at: datetime = None, grace: float = STOCK_SNAPSHOT_GRACE_SECONDS):
+    """Copy every ingredient's stock as of ``taken_at``, by default ``grace`` seconds ago."""
+    taken_at = taken_at or datetime.now() - timedelta(seconds=grace)
+    levels = rewound(taken_at).subquery()
+    db.execute(insert(StockSnapshot).from_select(
+        ["taken_at", "ingredient_id", "quantity_grams"],
+        select(literal(taken_at, DateTime), levels.c.id, levels.c.grams),
+    ))
+    return taken_at
+
+
+def checkpoint(db: Session, interval: float = 0):
+    """Reconcile and take a snapshot if the latest one is at least ``interval`` seconds old; the caller commits."""
+    latest = db.execute(select(func.max(StockSnapshot.taken_at))).scalar()
+    if latest is not None and (datetime.now() - latest).total_seconds() < interval:
+        return None, [], []
+    mismatches, alerts = reconcile(db)
+    return take_snapshot(db), mismatches, alerts
+
+
+class StockSnapshotter:
+    """Takes a checkpoint every ``interval`` seconds; with several workers whichever is first does it."""
+
+    def __init__(self, interval: float = STOCK_SNAPSHOT_INTERVAL_SECONDS):
+        self.interval = interval
+        self.snapshots = 0
+        self.mismatches = 0
+        self.last_taken_at = None
+        self._task = None
+
+    async def run_once(self):
+        async with AsyncSessionLocal() as db:
+            taken_at, mismatches, alerts = await db.run_sync(checkpoint, self.interval)
+            await db.commit()
+        if taken_at:
+            self.snapshots += 1
+            self.mismatches += len(mismatches)
+            self.last_taken_at = taken_at
+        for m in mismatches:
+            logger.warning("Stock mismatch for %s: %sg recorded, %sg from ledger", m["ingredient"], m["quantity_grams"], m["expected_grams"])
+        return alerts
+
+    async def start(self, publish):
+        """Check every few minutes whether a checkpoint is due and hand new alerts to ``publish``."""
+        async def loop():
+            while True:
+                try:
+                    publish(await self.run_once())
+                except Exception:
+                    logger.exception("Stock snapshot failed")
+                await asyncio.sleep(min(self.interval, 300))
+        self._task = asyncio.create_task(loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {"snapshots": self.snapshots, "mismatches": self.mismatches, "last_taken_at": self.last_taken_at}
+
+
+stock_snapshotter = StockSnapshotter()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stock snapshots and ledger reconciliation.")
+    parser.add_argument("command", choices=["snapshot", "reconcile"])
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "snapshot":
+            taken_at, mismatches, _ = checkpoint(db)
+        else:
+            mismatches, _ = reconcile(db)
+        db.commit()
+    for m in mismatches:
+        print(f"{m['ingredient']}: {m['quantity_grams']}g recorded, {m['expected_grams']}g from ledger")
+    if args.command == "snapshot":
+        print(f"Snapshot taken at {taken_at:%Y-%m-%d %H:%M:%S}")
@@ -1,5 +1,2 @@
-from celery import Celery
-from main import generate_monthly_report
-
-celery_app = Celery('tasks', broker='redis://localhost:6379/0')
-celery_app.task(name='generate_monthly_report')(generate_monthly_report)
\ No newline at end of file
+# Kept so "celery -A tasks worker" still starts a worker; the jobs live in jobs.py.
+from jobs import celery_app, generate_monthly_report
@@ -0,0 +1,38 @@
+// Live updates: resume from the last applied event after a reconnect, reload on resync.
+// Included into the <script> of every page with live data, so the protocol lives in one place.
+function connectLive(topics, onEvent, onResync) {
+    let lastSeq = null, epoch = null, retry = 1000;
+    function open() {
+        const url = new URL(`ws://${window.location.host}/ws`);
+        url.searchParams.set('topics', topics);
+        if (lastSeq !== null) {
+            url.searchParams.set('since', lastSeq);
+            url.searchParams.set('epoch', epoch);
+        }
+        const ws = new WebSocket(url);
+        ws.onopen = () => { retry = 1000; };
+        ws.onmessage = (event) => {
+            let data;
+            try {
+                data = JSON.parse(event.data);
+            } catch (err) {
+                console.error('Failed to parse WebSocket message:', err, event.data);
+                return;
+            }
+            if (data.type === 'resync' || data.type === 'lagged') {
+                onResync();
+            } else if (data.type !== 'hello') {
+                onEvent(data);
+            }
+            if (data.seq !== undefined) {
+                lastSeq = data.seq;
+                epoch = data.epoch;
+            }
+        };
+        ws.onclose = () => {
+            setTimeout(open, retry);
+            retry = Math.min(retry * 2, 30000);
+        };
+    }
+    open();
+}